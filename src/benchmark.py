@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import logging
+import datetime
+import statistics
+import tracemalloc
+import requests
+from bs4 import BeautifulSoup
+from requests.utils import get_encoding_from_headers
+from warc_archive import WarcWriter, read_record
+from save_url import MEDIA_DOMAINS_DIR, iter_media_domain_rows, should_skip_url
+from parser import parse_html, detect_category, extract_publication_date, content_row, get_user_agent
+
+logger = logging.getLogger(__name__)
+
+# Saved pages (a WARC file plus an index) and the expected parser output for
+# them. The committed corpus is small and offline; --build fetches a larger
+# one into BUILD_DIR, which can then be benchmarked via BENCHMARK_CORPUS_DIR
+CORPUS_DIR = os.getenv('BENCHMARK_CORPUS_DIR', './assets/benchmark_corpus')
+BUILD_DIR = os.getenv('BENCHMARK_BUILD_DIR', './benchmark_corpus')
+CORPUS_INDEX = os.path.join(CORPUS_DIR, 'corpus.json')
+GOLDEN_FILE = os.path.join(CORPUS_DIR, 'golden.json')
+
+PAGES_PER_DOMAIN = 5
+# Timed passes over the corpus, the first one also warms up caches
+BENCHMARK_ROUNDS = int(os.getenv('BENCHMARK_ROUNDS', 3))
+
+
+def build_corpus(pages_per_domain=PAGES_PER_DOMAIN, seed=0, directory=BUILD_DIR):
+    """
+    Fetch a fixed sample of article pages per domain and archive them.
+
+    The sample is drawn with a fixed seed from the newmediadomains files so
+    rebuilding picks the same URLs, as long as they are still online.
+    """
+    rng = random.Random(seed)
+    writer = WarcWriter(directory, prefix='corpus', max_size=1 << 62)
+    entries = []
+
+    try:
+        for filename in sorted(os.listdir(MEDIA_DOMAINS_DIR)):
+            if not filename.endswith('.json'):
+                continue
+            urls = sorted({url for _, _, _, url in iter_media_domain_rows(os.path.join(MEDIA_DOMAINS_DIR, filename))
+                           if not should_skip_url(url)})
+            for url in rng.sample(urls, min(pages_per_domain, len(urls))):
+                try:
+                    response = requests.get(url, headers={'User-Agent': get_user_agent()}, timeout=30)
+                    response.raise_for_status()
+                except requests.RequestException as e:
+                    print(f"skip {url}: {e}")
+                    continue
+                path, offset, length = writer.write_response(url, response.status_code, response.reason, response.headers, response.content)
+                entries.append({
+                    'url': url,
+                    'file': os.path.basename(path),
+                    'offset': offset,
+                    'length': length,
+                    'fetched_at': datetime.datetime.now().isoformat(timespec='seconds'),
+                })
+                print(f"saved {url}")
+    finally:
+        writer.close()
+
+    with open(os.path.join(directory, 'corpus.json'), 'w', encoding='utf-8') as f:
+        json.dump(entries, f, indent=2, ensure_ascii=False)
+    print(f"Corpus of {len(entries)} pages written to {directory}, "
+          f"run with BENCHMARK_CORPUS_DIR={directory} and --update-golden to snapshot it")
+
+
+def load_corpus():
+    """Return [(url, body, encoding, fetched_at)] for every saved page."""
+    with open(CORPUS_INDEX, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+
+    pages = []
+    for entry in entries:
+        _, _, http_headers, body = read_record(os.path.join(CORPUS_DIR, entry['file']), entry['offset'], entry['length'])
+        pages.append((entry['url'], body, get_encoding_from_headers(http_headers), entry['fetched_at']))
+    return pages
+
+
+def snapshot(url, body, encoding, fetched_at):
+    """
+    The stored row for a page, minus what changes from run to run.
+
+    The extraction time is pinned to the fetch time so relative dates
+    ("२ घण्टा अगाडि") normalize the same way on every run.
+    """
+    data = parse_html(body, url, encoding)
+    data['extraction_timestamp'] = fetched_at
+    row = content_row(url, data)
+    body_text = row.pop('articleBody') or ''
+    row.pop('extractionTimestamp')
+    row.pop('urlID')
+    row.pop('searchVector')
+    row['articleBodySha1'] = hashlib.sha1(body_text.encode('utf-8')).hexdigest()
+    row['publishedAt'] = row['publishedAt'].isoformat() if row['publishedAt'] else None
+    return row
+
+
+def percentiles(samples):
+    """(p50, p99) of a list of seconds, in milliseconds."""
+    if len(samples) < 2:
+        value = samples[0] * 1000 if samples else 0
+        return value, value
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return cuts[49] * 1000, cuts[98] * 1000
+
+
+def run_benchmark(pages, rounds=BENCHMARK_ROUNDS):
+    """Time the full parse and the two heuristics separately, and measure peak memory."""
+    timings = {'parse_html': [], 'detect_category': [], 'extract_publication_date': []}
+
+    for _ in range(rounds):
+        for url, body, encoding, _ in pages:
+            started = time.perf_counter()
+            parse_html(body, url, encoding)
+            timings['parse_html'].append(time.perf_counter() - started)
+
+            # The heuristics get their own soup, parse_html consumes parts of it
+            soup = BeautifulSoup(body, 'lxml', from_encoding=encoding or 'utf-8-sig')
+            started = time.perf_counter()
+            detect_category(soup, url)
+            timings['detect_category'].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            extract_publication_date(soup, url)
+            timings['extract_publication_date'].append(time.perf_counter() - started)
+
+    # tracemalloc slows everything down, so memory gets its own untimed pass
+    tracemalloc.start()
+    for url, body, encoding, _ in pages:
+        parse_html(body, url, encoding)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{len(pages)} pages x {rounds} rounds")
+    print(f"{'stage':<26} {'pages/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for stage, samples in timings.items():
+        p50, p99 = percentiles(samples)
+        rate = len(samples) / sum(samples) if sum(samples) else 0
+        print(f"{stage:<26} {rate:>9.1f} {p50:>9.2f} {p99:>9.2f}")
+    print(f"peak traced memory during one parse pass: {peak / (1024 * 1024):.2f} MiB")
+
+
+def check_golden(pages, update=False):
+    """
+    Compare the extraction output with the golden snapshots.
+
+    Returns the number of pages whose output changed. With update the
+    current output becomes the new golden file instead. A missing golden
+    file counts as every page changed, so a check never passes against
+    snapshots it just wrote.
+    """
+    current = {url: snapshot(url, body, encoding, fetched_at) for url, body, encoding, fetched_at in pages}
+
+    if update:
+        with open(GOLDEN_FILE, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2, ensure_ascii=False, sort_keys=True)
+        print(f"Golden snapshots written for {len(current)} pages")
+        return 0
+
+    if not os.path.exists(GOLDEN_FILE):
+        print(f"No golden snapshots at {GOLDEN_FILE}, create them with --update-golden")
+        return len(current)
+
+    with open(GOLDEN_FILE, 'r', encoding='utf-8') as f:
+        golden = json.load(f)
+
+    changed = 0
+    for url, expected in golden.items():
+        actual = current.get(url)
+        if actual is None:
+            print(f"MISSING {url}")
+            changed += 1
+            continue
+        diffs = [name for name in sorted(set(expected) | set(actual)) if expected.get(name) != actual.get(name)]
+        if diffs:
+            changed += 1
+            print(f"CHANGED {url}")
+            for name in diffs:
+                print(f"    {name}: {expected.get(name)!r} -> {actual.get(name)!r}")
+
+    print(f"{changed} of {len(golden)} pages differ from the golden snapshots")
+    return changed
+
+
+def main(argv):
+    # Fetch a fresh corpus into BUILD_DIR (needs network), optionally with pages per domain
+    if argv and argv[0] == '--build':
+        build_corpus(int(argv[1]) if len(argv) > 1 else PAGES_PER_DOMAIN)
+        return 0
+
+    pages = load_corpus()
+    # Accept the current output as the new expected output
+    if argv and argv[0] == '--update-golden':
+        return check_golden(pages, update=True)
+
+    run_benchmark(pages)
+    return 1 if check_golden(pages) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
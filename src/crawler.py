@@ -29,31 +29,28 @@ from urllib3.exceptions import (
 from socket import error as SocketError
 import psycopg
 from database import get_connection, return_connection, close_all_connections
+from dates import url_date
+from fetch_outcome import classify_exception
+from metrics import (
+    CRAWLER_METRICS_PORT,
+    DB_FLUSH_DURATION,
+    QUEUE_DEPTH,
+    URLS_DUPLICATE,
+    URLS_INSERTED,
+    observe_failure,
+    observe_response,
+    start_metrics_server,
+)
 from urllib.parse import urlparse, urljoin
-import logging
+from log_setup import SAMPLED, setup_logging
+from url_store import KnownUrls
+from index_delta import compute_delta, record_churn, create_table as create_churn_table
 
 # Define the path to your log file on your local machine
 local_log_path = './local_crawler.log'  
 
-# First try to clean up any existing handlers
-root = logging.getLogger()
-if root.handlers:
-    for handler in root.handlers:
-        root.removeHandler(handler)
-
-# Configure logging
-# Create a file handler that writes to your local path
-file_handler = logging.FileHandler(local_log_path, mode='a')
-console_handler = logging.StreamHandler()
-
-# Configure formatters
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
-
-# Set up the root logger
-root.setLevel(logging.INFO)
-root.addHandler(file_handler)
+# The crawler keeps its own log file instead of database.log
+setup_logging(local_log_path, force=True)
 
 
 # Create our named logger
@@ -62,7 +59,8 @@ logger = logging.getLogger(__name__)
 # Test the logger
 logger.info("Logging system initialized successfully")
 
-SERVER = 'https://index.commoncrawl.org/'
+# CDX index server, point at a mock server for load tests
+SERVER = os.getenv('CC_INDEX_SERVER', 'https://index.commoncrawl.org/')
 user_agents = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_4_1) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5 Safari/605.1.15",
@@ -83,6 +81,25 @@ INITIAL_BACKOFF = 2
 MAX_BACKOFF = 300  
 SESSION_RESET_THRESHOLD = 4 
 
+# Multiplies the politeness delays between index queries; 0 for load tests
+# against local mock servers
+DELAY_SCALE = float(os.getenv('CRAWLER_DELAY_SCALE', 1))
+
+INDICES = [
+   "CC-MAIN-2025-05", "CC-MAIN-2025-08", "CC-MAIN-2025-13", "CC-MAIN-2025-18", "CC-MAIN-2025-21"
+]
+DOMAIN_FILES_DIR = './assets/newmediadomains'
+
+# Per-domain sets of URLs already in url_registry, see url_store.py
+known_urls = KnownUrls()
+
+def parse_cdx_timestamp(value):
+    """CDX capture times are 14-digit UTC strings (YYYYMMDDhhmmss), None if malformed."""
+    try:
+        return datetime.datetime.strptime(value[:14], '%Y%m%d%H%M%S')
+    except ValueError:
+        return None
+
 def filter_url_path_before_storing_into_database(domain, url_paths):
     filtered_url_paths = []
 
@@ -116,14 +133,21 @@ def filter_url_path_before_storing_into_database(domain, url_paths):
 
     return filtered_url_paths
 
-async def insert_into_url_registry_table(conn, domain_name, timestamp, index, url_paths):
+async def insert_into_url_registry_table(conn, domain_name, timestamp, index, url_paths, warc_records=None, capture_times=None):
     """
     Async batch insert with detailed feedback about insertions vs conflicts using psycopg3
+
+    warc_records maps a URL to the (filename, offset, length) of its Common
+    Crawl capture so the parser can range-request it instead of the origin.
+    capture_times maps a URL to when that capture was taken.
     """
+    warc_records = warc_records or {}
+    capture_times = capture_times or {}
     if not url_paths:
         logger.info("No URLs to insert")
         return {"inserted": 0, "duplicates": 0, "total": 0}
     
+    started = time.monotonic()
     try:
         async with conn.transaction():
             # Get count of existing URLs before insertion
@@ -137,11 +161,17 @@ async def insert_into_url_registry_table(conn, domain_name, timestamp, index, ur
             async with conn.cursor() as cur:
                 await cur.executemany(
                     """
-                    INSERT INTO url_registry (domain, accessTimestamp, index, urlPath, status)
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (urlPath) DO NOTHING
+                    INSERT INTO url_registry (domain, accessTimestamp, index, urlPath, status, warcFilename, warcOffset, warcLength, captureTimestamp, urlDate)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (urlPath) DO UPDATE SET
+                        warcFilename = EXCLUDED.warcFilename,
+                        warcOffset = EXCLUDED.warcOffset,
+                        warcLength = EXCLUDED.warcLength,
+                        captureTimestamp = EXCLUDED.captureTimestamp
+                    WHERE url_registry.warcFilename IS NULL AND EXCLUDED.warcFilename IS NOT NULL
                     """,
-                    [(domain_name, timestamp, index, url_path, 'pending') for url_path in url_paths]
+                    [(domain_name, timestamp, index, url_path, 'pending', *warc_records.get(url_path, (None, None, None)), capture_times.get(url_path), url_date(url_path))
+                     for url_path in url_paths]
                 )
             
             # Get count after insertion
@@ -157,6 +187,9 @@ async def insert_into_url_registry_table(conn, domain_name, timestamp, index, ur
             inserted = existing_after - existing_before
             
             logger.info(f"Batch insert results: {inserted} new URLs inserted, {duplicates} duplicates skipped, {total_urls} total processed for domain {domain_name}")
+            DB_FLUSH_DURATION.labels('crawler').observe(time.monotonic() - started)
+            URLS_INSERTED.labels('crawler').inc(inserted)
+            URLS_DUPLICATE.labels('crawler').inc(duplicates)
             
             return {
                 "inserted": inserted,
@@ -167,6 +200,46 @@ async def insert_into_url_registry_table(conn, domain_name, timestamp, index, ur
     except Exception as e:
         logger.error(f"Error during batch insert for domain {domain_name}: {e}")
         raise
+
+async def backfill_warc_locations(conn, url_paths, warc_records, capture_times, batch_size=10000):
+    """
+    Fill the WARC location and capture time of already registered URLs that lack them.
+
+    URLs the URL store already knows skip the insert, so its ON CONFLICT
+    backfill never sees them; this gives rows registered before CC
+    locations were kept (or from assets and discovery) the latest capture.
+    Rows that already have a location are left alone. Returns how many
+    rows were updated.
+    """
+    rows = [(url_path, *warc_records[url_path], capture_times.get(url_path))
+            for url_path in url_paths if url_path in warc_records]
+    updated = 0
+    try:
+        async with conn.transaction():
+            async with conn.cursor() as cur:
+                for start in range(0, len(rows), batch_size):
+                    url_batch, filenames, offsets, lengths, captured = zip(*rows[start:start + batch_size])
+                    await cur.execute(
+                        """
+                        UPDATE url_registry r SET
+                            warcFilename = w.warcFilename,
+                            warcOffset = w.warcOffset,
+                            warcLength = w.warcLength,
+                            captureTimestamp = w.captureTimestamp
+                        FROM unnest(%s::text[], %s::text[], %s::bigint[], %s::bigint[], %s::timestamp[])
+                            AS w(urlPath, warcFilename, warcOffset, warcLength, captureTimestamp)
+                        WHERE r.urlPath = w.urlPath AND r.warcFilename IS NULL
+                        """,
+                        (list(url_batch), list(filenames), list(offsets), list(lengths), list(captured))
+                    )
+                    updated += cur.rowcount
+    except Exception as e:
+        logger.error(f"Error backfilling WARC locations: {e}")
+        raise
+    
+    if updated:
+        logger.info(f"Backfilled WARC locations for {updated} known URLs")
+    return updated
     
 def get_next_agent():
     """Rotate through user agents to avoid being blocked"""
@@ -200,7 +273,7 @@ def make_request_with_retry(url, session=None, max_retries=MAX_RETRIES, backoff_
     while retries < max_retries:
         try:
             myagent = get_next_agent()
-            logger.info(f'Using agent: {myagent}')
+            logger.debug('Using agent: %s', myagent, extra=SAMPLED)
             
             headers = {
                 'User-Agent': myagent,
@@ -210,6 +283,7 @@ def make_request_with_retry(url, session=None, max_retries=MAX_RETRIES, backoff_
             }
             
             # Make the request
+            started = time.monotonic()
             response = session.get(
                 url, 
                 headers=headers,
@@ -218,10 +292,13 @@ def make_request_with_retry(url, session=None, max_retries=MAX_RETRIES, backoff_
             )
             
             # Check if we got a valid response
+            if not response.ok:
+                observe_response('crawler', url, response.status_code, 0, time.monotonic() - started)
             response.raise_for_status()
             
             # Read the full content to detect potential chunking errors early
             content = response.text
+            observe_response('crawler', url, response.status_code, len(response.content), time.monotonic() - started)
             
             consecutive_failures = 0  # Reset failure counter on success
             return content
@@ -239,6 +316,7 @@ def make_request_with_retry(url, session=None, max_retries=MAX_RETRIES, backoff_
             RemoteDisconnected,
             SocketError
         ) as e:
+            observe_failure('crawler', url, classify_exception(e), time.monotonic() - started)
             consecutive_failures += 1
             retries += 1
             
@@ -295,6 +373,8 @@ def search_single_cc_index(domain, index_name):
         # Process the content
         lines = content.strip().split('\n')
         index_urls = []
+        warc_records = {}
+        capture_times = {}
         
         logger.info(f"Processing {len(lines)} lines from {index_name}")
         
@@ -304,6 +384,11 @@ def search_single_cc_index(domain, index_name):
                     record = json.loads(line)
                     if record.get("status") == '200':
                         index_urls.append(record.get("url"))
+                        # Keep where the capture lives inside the CC WARC files
+                        if record.get("filename") and record.get("offset") and record.get("length"):
+                            warc_records[record.get("url")] = (record["filename"], int(record["offset"]), int(record["length"]))
+                        if record.get("timestamp"):
+                            capture_times[record.get("url")] = parse_cdx_timestamp(record["timestamp"])
                 except json.JSONDecodeError:
                     logger.warning(f"Could not parse line {line_idx + 1}: {line[:100]}...")
         
@@ -311,7 +396,9 @@ def search_single_cc_index(domain, index_name):
         if index_urls:
             index_data = {
                 "index": index_name,
-                "url_paths": index_urls
+                "url_paths": index_urls,
+                "warc_records": warc_records,
+                "capture_times": capture_times
             }
             logger.info(f"Successfully processed {index_name}: found {len(index_urls)} valid URLs from {len(lines)} total lines")
             return index_data, len(lines)
@@ -403,6 +490,10 @@ async def update_domain_file_with_new_index_data(domain_file_data, new_index_dat
         # Get the existing indices
         existing_indices = {item['index'] for item in domain_file_data.get('URL_paths', [])}
         
+        # WARC locations go to the database only, the domain file keeps the URL list
+        warc_records = new_index_data.pop('warc_records', {})
+        capture_times = new_index_data.pop('capture_times', {})
+        
         index_name = new_index_data.get('index')
         url_paths = new_index_data.get('url_paths', [])
         total_lines_added = len(url_paths)
@@ -411,8 +502,15 @@ async def update_domain_file_with_new_index_data(domain_file_data, new_index_dat
             # Get domain from domain_file_data
             domain = domain_file_data.get('domain', '')
             
+            # Most of an index repeats earlier ones; only URLs no earlier index
+            # registered go on to filtering and the database
+            new_url_paths, churn = compute_delta(known_urls, domain_file_data, url_paths)
+            logger.info(f"Index {index_name} for {domain}: {churn['total']} URLs, {churn['new']} new, "
+                        f"{churn['carried']} carried over and {churn['dropped']} dropped since {churn['previous_index']}")
+            await record_churn(conn, domain, index_name, churn)
+
             # Call filtered_url function
-            filtered_url_paths = filter_url_path_before_storing_into_database(domain, url_paths)
+            filtered_url_paths = filter_url_path_before_storing_into_database(domain, new_url_paths)
 
             if filtered_url_paths:
                 # Insert into database - now using await
@@ -422,12 +520,16 @@ async def update_domain_file_with_new_index_data(domain_file_data, new_index_dat
                         domain_name=domain,
                         timestamp=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 
                         index=index_name, 
-                        url_paths=filtered_url_paths
+                        url_paths=filtered_url_paths,
+                        warc_records=warc_records,
+                        capture_times=capture_times
                     )
                 except Exception as e:
                     logger.error(f"Failed to insert URLs into database: {e}")
                     raise  # Re-raise to handle connection cleanup
-             
+                # Only after the insert committed, so the store never gets ahead of the table
+                known_urls.add(filtered_url_paths)
+
 
             # Add new entry to the TOP of the list (stack behavior - LIFO)
             domain_file_data['URL_paths'].insert(0, new_index_data)
@@ -454,11 +556,7 @@ async def update_domain_file_with_new_index_data(domain_file_data, new_index_dat
             await return_connection(conn)
 
 async def main():
-    INDICES = [
-       "CC-MAIN-2025-05", "CC-MAIN-2025-08", "CC-MAIN-2025-13", "CC-MAIN-2025-18", "CC-MAIN-2025-21"
-    ]
-
-    input_url = './assets/newmediadomains'
+    input_url = DOMAIN_FILES_DIR
 
     try:
         files = os.listdir(input_url)
@@ -475,6 +573,13 @@ async def main():
 
     logger.info(f"Starting to process {len(json_files)} domain files from file index {start_file_idx}, index position {start_index_position}")
 
+    conn = await get_connection()
+    try:
+        await create_churn_table(conn)
+    finally:
+        await return_connection(conn)
+    start_metrics_server(CRAWLER_METRICS_PORT)
+
     try:
         count = 0
         
@@ -534,6 +639,8 @@ async def main():
                 # Process each index starting from the current position
                 for index_position in range(current_index_position, len(INDICES)):
                     index_name = INDICES[index_position]
+                    # (domain file, index) pairs left in this run
+                    QUEUE_DEPTH.labels('crawler').set((len(json_files) - file_idx - 1) * len(INDICES) + len(INDICES) - index_position)
                     
                     # Skip if this index was already processed for this file
                     if index_name in current_processed_indices:
@@ -543,7 +650,7 @@ async def main():
                     logger.info(f"Processing domain file {file_idx + 1}/{len(json_files)}, index {index_position + 1}/{len(INDICES)}: {index_name} for domain {domain}")
                     
                     # Add delay before processing index
-                    delay = random.uniform(20, 30)
+                    delay = random.uniform(20, 30) * DELAY_SCALE
                     logger.info(f'Waiting {delay:.2f}s before processing index: {index_name}')
                     
                     # Use asyncio.sleep instead of time.sleep for async context
@@ -605,7 +712,7 @@ async def main():
                         
                         # Add delay between indices (only after successful processing)
                         if index_position < len(INDICES) - 1:
-                            delay = random.uniform(50, 60)
+                            delay = random.uniform(50, 60) * DELAY_SCALE
                             logger.info(f"Waiting {delay:.2f} seconds before next index...")
                             await asyncio.sleep(delay)  # Use asyncio.sleep
                 
@@ -629,6 +736,7 @@ async def main():
         logger.error(f"Fatal error in main process: {e}", exc_info=True)
     finally:
         # Close all database connections
+        known_urls.close()
         await close_all_connections()
         logger.info(f"Process completed. Total domain files processed: {count if 'count' in locals() else 0}")
         
@@ -648,9 +756,64 @@ async def resume_from_crash():
     await main()
     return True
 
+async def backfill_warc():
+    """
+    One-off pass giving registered URLs the WARC location they lack.
+
+    The crawl only stores locations for URLs it inserts. Rows registered
+    before locations were kept are filled here from the newest index
+    backwards, so each row gets its latest capture; a domain is skipped
+    as soon as none of its rows is missing a location.
+    """
+    try:
+        json_files = sorted(f for f in os.listdir(DOMAIN_FILES_DIR) if f.endswith('.json'))
+    except Exception as e:
+        logger.error(f'Failed to load the newmediadomains folder: {e}')
+        return
+
+    total = 0
+    try:
+        for filename in json_files:
+            try:
+                with open(os.path.join(DOMAIN_FILES_DIR, filename), 'r', encoding='utf-8') as file:
+                    loaded_data = json.load(file)
+            except Exception as e:
+                logger.error(f'Failed to load domain file {filename}: {e}')
+                continue
+            domain_file_data = loaded_data[0] if isinstance(loaded_data, list) and loaded_data else loaded_data
+            domain = domain_file_data.get('domain', '') if isinstance(domain_file_data, dict) else ''
+            if not domain:
+                logger.error(f'No domain found in file {filename}')
+                continue
+
+            for index_name in reversed(INDICES):
+                conn = await get_connection()
+                try:
+                    async with conn.cursor() as cur:
+                        await cur.execute(
+                            "SELECT EXISTS (SELECT 1 FROM url_registry WHERE domain = %s AND warcFilename IS NULL)",
+                            (domain,)
+                        )
+                        (missing,) = await cur.fetchone()
+                    if not missing:
+                        break
+                    index_data, _ = search_single_cc_index(domain, index_name)
+                    if index_data:
+                        total += await backfill_warc_locations(
+                            conn, index_data['url_paths'], index_data['warc_records'], index_data['capture_times']
+                        )
+                finally:
+                    await return_connection(conn)
+                await asyncio.sleep(random.uniform(20, 30) * DELAY_SCALE)
+    finally:
+        await close_all_connections()
+        logger.info(f"WARC backfill completed. Total rows updated: {total}")
+
 if __name__ == "__main__":
     # Check for resume argument
     if len(sys.argv) > 1 and sys.argv[1] == '--resume':
         asyncio.run(resume_from_crash())
+    elif len(sys.argv) > 1 and sys.argv[1] == '--backfill-warc':
+        asyncio.run(backfill_warc())
     else:
         asyncio.run(main())
\ No newline at end of file
@@ -1,20 +1,17 @@
 import os
+import time
 import logging
 import asyncio
 from dotenv import load_dotenv
 from psycopg_pool import AsyncConnectionPool
+from log_setup import setup_logging
 
 # Set correct event loop policy for Windows
 if os.name == 'nt':  # Check if running on Windows
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     
 # Configure logging
-logging.basicConfig(
-    filename='database.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Load environment variables
@@ -35,45 +32,129 @@ DB_CONFIG = {
     "port": os.getenv("DB_PORT"),
 }
 
+# Pool sizing and lifetimes, tune against the numbers pool_stats() reports
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 3))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", 60 * 60))
+POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", 10 * 60))
+
+# Server-side prepare a statement after it has run this many times on a connection
+PREPARE_THRESHOLD = int(os.getenv("DB_PREPARE_THRESHOLD", 2))
+
 # Initialize connection pool variable
 connection_pool = None
+# Created on first use and dropped with the pool: an asyncio.Lock belongs to
+# the event loop it was first used in, and each asyncio.run() starts a new one
+pool_lock = None
+
+# Checkout instrumentation, see pool_stats()
+pool_metrics = {
+    "checkouts": 0,
+    "saturated_checkouts": 0,
+    "wait_total": 0.0,
+    "wait_max": 0.0,
+    "checkout_total": 0.0,
+    "checkout_max": 0.0,
+    "in_use_max": 0,
+}
+checked_out = {}
+
+async def configure_connection(conn):
+    conn.prepare_threshold = PREPARE_THRESHOLD
 
 async def initialize_pool():
-    """Initialize the async connection pool."""
-    global connection_pool
-    try:
-        # Create the pool but don't connect yet
-        connection_pool = AsyncConnectionPool(
-            conninfo=" ".join(f"{k}={v}" for k, v in DB_CONFIG.items()),
-            min_size=3,
-            max_size=10,
-            open=False  # Don't open connections in constructor
-        )
-        
-        # Now explicitly open the pool using the recommended approach
-        await connection_pool.open()
-        logger.info("Async database connection pool initialized successfully")
-    except Exception as e:
-        logger.error(f"Failed to initialize async database connection pool: {e}")
-        raise
+    """Initialize the async connection pool, once, however many callers race for it."""
+    global connection_pool, pool_lock
+    if pool_lock is None:
+        pool_lock = asyncio.Lock()
+    async with pool_lock:
+        if connection_pool is not None:
+            return
+        try:
+            # Create the pool but don't connect yet
+            pool = AsyncConnectionPool(
+                conninfo=" ".join(f"{k}={v}" for k, v in DB_CONFIG.items()),
+                min_size=POOL_MIN_SIZE,
+                max_size=POOL_MAX_SIZE,
+                timeout=POOL_TIMEOUT,
+                max_lifetime=POOL_MAX_LIFETIME,
+                max_idle=POOL_MAX_IDLE,
+                configure=configure_connection,
+                open=False  # Don't open connections in constructor
+            )
+            
+            # Now explicitly open the pool using the recommended approach
+            await pool.open()
+            connection_pool = pool
+            logger.info(f"Async database connection pool initialized successfully (min {POOL_MIN_SIZE}, max {POOL_MAX_SIZE})")
+        except Exception as e:
+            logger.error(f"Failed to initialize async database connection pool: {e}")
+            raise
 
 async def get_connection():
     """Get a connection from the async pool."""
     if connection_pool is None:
         await initialize_pool()
+    
+    started = time.monotonic()
+    # Every connection is out, this caller has to wait for one to come back
+    saturated = len(checked_out) >= POOL_MAX_SIZE
     # The correct method is getconn() not acquire()
-    return await connection_pool.getconn()
+    conn = await connection_pool.getconn()
+    waited = time.monotonic() - started
+    
+    checked_out[id(conn)] = time.monotonic()
+    pool_metrics["checkouts"] += 1
+    pool_metrics["saturated_checkouts"] += saturated
+    pool_metrics["wait_total"] += waited
+    pool_metrics["wait_max"] = max(pool_metrics["wait_max"], waited)
+    pool_metrics["in_use_max"] = max(pool_metrics["in_use_max"], len(checked_out))
+    return conn
 
 async def return_connection(conn):
     """Return the connection to the async pool."""
+    checked_out_at = checked_out.pop(id(conn), None)
+    if checked_out_at is not None:
+        held = time.monotonic() - checked_out_at
+        pool_metrics["checkout_total"] += held
+        pool_metrics["checkout_max"] = max(pool_metrics["checkout_max"], held)
     # The correct method is putconn() not release()
     await connection_pool.putconn(conn)
 
+def pool_stats():
+    """
+    Pool wait time, checkout duration and saturation since startup.
+    
+    A high wait_avg or saturated_checkouts with in_use_max at max_size
+    means the pool is too small for the number of workers; a low
+    in_use_max means it can shrink.
+    """
+    checkouts = pool_metrics["checkouts"] or 1
+    returned = pool_metrics["checkouts"] - len(checked_out) or 1
+    stats = {
+        "max_size": POOL_MAX_SIZE,
+        "in_use": len(checked_out),
+        "in_use_max": pool_metrics["in_use_max"],
+        "checkouts": pool_metrics["checkouts"],
+        "saturated_checkouts": pool_metrics["saturated_checkouts"],
+        "wait_avg": pool_metrics["wait_total"] / checkouts,
+        "wait_max": pool_metrics["wait_max"],
+        "checkout_avg": pool_metrics["checkout_total"] / returned,
+        "checkout_max": pool_metrics["checkout_max"],
+    }
+    if connection_pool is not None:
+        # psycopg's own counters: requests_waiting, requests_wait_ms, connections_errors, ...
+        stats.update(connection_pool.get_stats())
+    return stats
+
 async def close_all_connections():
     """Close all connections in the async pool (call this at app exit)."""
+    global connection_pool, pool_lock
     if connection_pool:
+        stats = pool_stats()
+        logger.info("Connection pool stats: " + ", ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in stats.items()))
         await connection_pool.close()
+        connection_pool = None
         logger.info("All database connections closed")
-
-
-
+    pool_lock = None
@@ -0,0 +1,378 @@
+import re
+import asyncio
+import logging
+import datetime
+from zoneinfo import ZoneInfo
+from dateutil import parser as dateutil_parser
+from log_setup import setup_logging
+from database import get_connection, return_connection, close_all_connections
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Dates without an explicit offset are local to the sites we crawl
+NEPAL_TZ = ZoneInfo('Asia/Kathmandu')
+
+BATCH_SIZE = 1000
+
+NEPALI_DIGITS = str.maketrans('०१२३४५६७८९', '0123456789')
+
+# Days per month for each Bikram Sambat year, Baisakh first
+BS_MONTH_DAYS = {
+    2060: [31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30],
+    2061: [31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31],
+    2062: [30, 32, 31, 32, 31, 31, 29, 30, 29, 30, 29, 31],
+    2063: [31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30],
+    2064: [31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30],
+    2065: [31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31],
+    2066: [31, 31, 31, 32, 31, 31, 29, 30, 30, 29, 29, 31],
+    2067: [31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30],
+    2068: [31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30],
+    2069: [31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31],
+    2070: [31, 31, 31, 32, 31, 31, 29, 30, 30, 29, 30, 30],
+    2071: [31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30],
+    2072: [31, 32, 31, 32, 31, 30, 30, 29, 30, 29, 30, 30],
+    2073: [31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31],
+    2074: [31, 31, 31, 32, 31, 31, 30, 29, 30, 29, 30, 30],
+    2075: [31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30],
+    2076: [31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 30],
+    2077: [31, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31],
+    2078: [31, 31, 31, 32, 31, 31, 30, 29, 30, 29, 30, 30],
+    2079: [31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30],
+    2080: [31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 30],
+    2081: [31, 31, 32, 32, 31, 30, 30, 30, 29, 30, 30, 30],
+    2082: [30, 32, 31, 32, 31, 30, 30, 30, 29, 30, 30, 30],
+    2083: [31, 31, 32, 31, 31, 30, 30, 30, 29, 30, 30, 30],
+}
+
+# 1 Baisakh 2060 BS
+BS_EPOCH_YEAR = 2060
+BS_EPOCH_AD = datetime.date(2003, 4, 14)
+
+# Ordinal of 1 Baisakh of every year in the table, so a conversion is a
+# dict lookup plus a short sum instead of a walk from the epoch
+BS_YEAR_START = {}
+_ordinal = BS_EPOCH_AD.toordinal()
+for _year in sorted(BS_MONTH_DAYS):
+    BS_YEAR_START[_year] = _ordinal
+    _ordinal += sum(BS_MONTH_DAYS[_year])
+
+BS_MONTHS = {
+    1: ['बैशाख', 'वैशाख', 'baisakh', 'baishakh', 'vaisakh'],
+    2: ['जेठ', 'जेष्ठ', 'jestha', 'jeth'],
+    3: ['असार', 'आषाढ', 'asar', 'ashadh', 'asadh'],
+    4: ['साउन', 'श्रावण', 'shrawan', 'saun', 'srawan'],
+    5: ['भदौ', 'भाद्र', 'bhadra', 'bhadau'],
+    6: ['असोज', 'आश्विन', 'asoj', 'ashwin', 'aswin'],
+    7: ['कार्तिक', 'कात्तिक', 'kartik', 'kattik'],
+    8: ['मंसिर', 'मङ्सिर', 'मार्ग', 'mangsir', 'marga'],
+    9: ['पुस', 'पौष', 'poush', 'push', 'paush'],
+    10: ['माघ', 'magh'],
+    11: ['फागुन', 'फाल्गुन', 'falgun', 'phagun', 'phalgun'],
+    12: ['चैत', 'चैत्र', 'chaitra', 'chait'],
+}
+BS_MONTH_LOOKUP = {name: number for number, names in BS_MONTHS.items() for name in names}
+BS_MONTH_PATTERN = '|'.join(sorted(map(re.escape, BS_MONTH_LOOKUP), key=len, reverse=True))
+
+BS_NAMED_PATTERNS = [
+    # २०८१ असोज १५
+    re.compile(rf'(?P<year>20\d\d)\s*,?\s*(?P<month>{BS_MONTH_PATTERN})\s*(?P<day>\d{{1,2}})', re.IGNORECASE),
+    # असोज १५, २०८१
+    re.compile(rf'(?P<month>{BS_MONTH_PATTERN})\s*(?P<day>\d{{1,2}})\s*,?\s*(?P<year>20\d\d)', re.IGNORECASE),
+    # १५ असोज २०८१
+    re.compile(rf'(?P<day>\d{{1,2}})\s*(?:गते)?\s*(?P<month>{BS_MONTH_PATTERN})\s*,?\s*(?P<year>20\d\d)', re.IGNORECASE),
+]
+NUMERIC_DATE_PATTERN = re.compile(r'(?P<year>\d{4})[-/.](?P<month>\d{1,2})[-/.](?P<day>\d{1,2})')
+TIME_PATTERN = re.compile(r'(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?')
+
+RELATIVE_UNITS = {
+    'second': 'seconds', 'sec': 'seconds', 'सेकेन्ड': 'seconds', 'सेकेण्ड': 'seconds',
+    'minute': 'minutes', 'min': 'minutes', 'मिनेट': 'minutes', 'मिनट': 'minutes',
+    'hour': 'hours', 'hr': 'hours', 'घण्टा': 'hours', 'घन्टा': 'hours',
+    'day': 'days', 'दिन': 'days',
+    'week': 'weeks', 'हप्ता': 'weeks',
+    'month': 'months', 'महिना': 'months',
+    'year': 'years', 'वर्ष': 'years', 'बर्ष': 'years',
+}
+RELATIVE_UNIT_PATTERN = '|'.join(sorted(map(re.escape, RELATIVE_UNITS), key=len, reverse=True))
+RELATIVE_PATTERN = re.compile(
+    rf'(?P<amount>\d+)\s*(?P<unit>{RELATIVE_UNIT_PATTERN})s?\s*(?:ago|अगाडि|अघि|पहिले|पहिला)',
+    re.IGNORECASE
+)
+
+# dateutil's fuzzy mode reads any stray number as a day ('Comments 3',
+# 'Page 2 of 5'), so it only runs on text carrying a year or month name
+GREGORIAN_ANCHOR_PATTERN = re.compile(
+    r'\b(?:\d{4}|jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|'
+    r'aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b',
+    re.IGNORECASE
+)
+
+# Anything outside this range is a misparse rather than a publication date
+MIN_AD_YEAR = 1990
+
+
+async def create_table(conn):
+    """Add the typed, indexed publication timestamp to url_parsed_content."""
+    try:
+        async with conn.cursor() as cursor:
+            await cursor.execute("""
+                ALTER TABLE url_parsed_content ADD COLUMN IF NOT EXISTS publishedAt TIMESTAMPTZ;
+
+                CREATE INDEX IF NOT EXISTS url_parsed_content_published_at
+                    ON url_parsed_content (publishedAt);
+            """)
+
+        await conn.commit()
+        logger.info("publishedAt column ensured")
+    except Exception as e:
+        await conn.rollback()
+        logger.error(f"Error creating publishedAt column: {e}")
+
+
+def bs_to_ad(year, month, day):
+    """Convert a Bikram Sambat date to a Gregorian date, None if out of range."""
+    month_days = BS_MONTH_DAYS.get(year)
+    if not month_days or not 1 <= month <= 12 or not 1 <= day <= month_days[month - 1]:
+        return None
+    return datetime.date.fromordinal(BS_YEAR_START[year] + sum(month_days[:month - 1]) + day - 1)
+
+
+def extract_time(text):
+    """Pick an HH:MM[:SS] time out of the text, midnight if there is none."""
+    match = TIME_PATTERN.search(text)
+    if match:
+        hour, minute = int(match.group('hour')), int(match.group('minute'))
+        second = int(match.group('second') or 0)
+        if re.search(r'\bpm\b|बेलुका|साँझ|दिउँसो', text, re.IGNORECASE) and hour < 12:
+            hour += 12
+        if hour < 24 and minute < 60 and second < 60:
+            return datetime.time(hour, minute, second)
+    return datetime.time(0, 0)
+
+
+def parse_bikram_sambat(text):
+    """Parse a BS date written with month names or as a numeric 20xx date."""
+    for pattern in BS_NAMED_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            month = BS_MONTH_LOOKUP[match.group('month').lower()]
+            date = bs_to_ad(int(match.group('year')), month, int(match.group('day')))
+            if date:
+                return datetime.datetime.combine(date, extract_time(text[match.end():]), NEPAL_TZ)
+
+    match = NUMERIC_DATE_PATTERN.search(text)
+    if match and int(match.group('year')) in BS_MONTH_DAYS:
+        date = bs_to_ad(int(match.group('year')), int(match.group('month')), int(match.group('day')))
+        if date:
+            return datetime.datetime.combine(date, extract_time(text[match.end():]), NEPAL_TZ)
+
+    return None
+
+
+def parse_relative(text, reference):
+    """Resolve '3 hours ago' / '३ घण्टा अगाडि' against the extraction time."""
+    match = RELATIVE_PATTERN.search(text)
+    if not match:
+        return None
+
+    amount = int(match.group('amount'))
+    unit = RELATIVE_UNITS[match.group('unit').lower()]
+    if unit == 'months':
+        return reference - datetime.timedelta(days=30 * amount)
+    if unit == 'years':
+        return reference - datetime.timedelta(days=365 * amount)
+    return reference - datetime.timedelta(**{unit: amount})
+
+
+def parse_gregorian(text):
+    """Parse ISO and English-style dates."""
+    try:
+        parsed = datetime.datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        if not GREGORIAN_ANCHOR_PATTERN.search(text):
+            return None
+        try:
+            parsed = dateutil_parser.parse(text, fuzzy=True)
+        except (ValueError, OverflowError):
+            return None
+
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=NEPAL_TZ)
+    return parsed
+
+
+def extract_date_from_url(url):
+    """Extract date from URL if it contains date patterns"""
+    # Common date patterns in URLs: YYYY/MM/DD or YYYY-MM-DD
+    date_patterns = [
+        r'(\d{4})[/-](\d{1,2})[/-](\d{1,2})',  # YYYY/MM/DD or YYYY-MM-DD
+        r'(\d{4})(\d{2})(\d{2})'               # YYYYMMDD
+    ]
+
+    for pattern in date_patterns:
+        match = re.search(pattern, url)
+        if match:
+            year, month, day = match.groups()
+            try:
+                # Validate date
+                date_obj = datetime.datetime(int(year), int(month), int(day))
+                # Return ISO format
+                return date_obj.strftime('%Y-%m-%d')
+            except ValueError:
+                continue
+    return None
+
+
+def url_date(url):
+    """
+    Date in a URL path (BS dates included) as naive UTC, the form stored in
+    url_registry.urlDate. None when the path has no usable date.
+    """
+    published = normalize_published_date(extract_date_from_url(url))
+    if published is None:
+        return None
+    return published.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def normalize_published_date(raw, reference=None):
+    """
+    Turn a scraped publication date into an aware datetime.
+
+    Handles ISO strings, English dates, Bikram Sambat dates in Nepali or
+    Latin digits, and relative "ago" strings (resolved against reference,
+    usually the extraction timestamp). Returns None when nothing usable
+    is found.
+    """
+    if not raw or raw == 'N/A':
+        return None
+
+    if reference is None:
+        reference = datetime.datetime.now(NEPAL_TZ)
+    elif reference.tzinfo is None:
+        reference = reference.replace(tzinfo=NEPAL_TZ)
+
+    text = ' '.join(str(raw).translate(NEPALI_DIGITS).split())
+
+    parsed = parse_relative(text, reference) or parse_bikram_sambat(text) or parse_gregorian(text)
+
+    if parsed is None:
+        return None
+
+    # BS years (20xx) can slip through dateutil and land decades in the future
+    if not MIN_AD_YEAR <= parsed.year <= reference.year + 1:
+        return None
+
+    # Nothing can be published after it was extracted
+    if parsed > reference:
+        return None
+
+    return parsed
+
+
+async def backfill_published_at(conn, batch_size=BATCH_SIZE):
+    """Fill publishedAt for existing rows, one keyset batch per transaction."""
+    last_parse_id = ''
+    updated_count = 0
+    unparsed_count = 0
+
+    while True:
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute("""
+                    SELECT parseID, publishedDate, extractionTimestamp
+                    FROM url_parsed_content
+                    WHERE publishedAt IS NULL
+                      AND publishedDate IS NOT NULL
+                      AND parseID > %s
+                    ORDER BY parseID
+                    LIMIT %s
+                """, (last_parse_id, batch_size))
+                rows = await cursor.fetchall()
+
+                if not rows:
+                    break
+
+                last_parse_id = rows[-1][0]
+                updates = []
+                for parse_id, published_date, extraction_timestamp in rows:
+                    published_at = normalize_published_date(published_date, extraction_timestamp)
+                    if published_at:
+                        updates.append((published_at, parse_id))
+                    else:
+                        unparsed_count += 1
+
+                if updates:
+                    await cursor.executemany("""
+                        UPDATE url_parsed_content SET publishedAt = %s WHERE parseID = %s
+                    """, updates)
+                updated_count += len(updates)
+
+            await conn.commit()
+            logger.info(f"publishedAt backfill progress: {updated_count} updated, {unparsed_count} unparseable")
+        except Exception as e:
+            await conn.rollback()
+            logger.error(f"Error during publishedAt backfill: {e}")
+            break
+
+    logger.info(f"publishedAt backfill finished: {updated_count} updated, {unparsed_count} unparseable")
+
+
+async def backfill_url_dates(conn, batch_size=BATCH_SIZE):
+    """Fill urlDate for pending URLs registered before it existed, one keyset batch per transaction."""
+    last_url_id = ''
+    updated_count = 0
+
+    while True:
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute("""
+                    SELECT urlID, urlPath
+                    FROM url_registry
+                    WHERE status = 'pending'
+                      AND urlDate IS NULL
+                      AND urlID > %s
+                    ORDER BY urlID
+                    LIMIT %s
+                """, (last_url_id, batch_size))
+                rows = await cursor.fetchall()
+
+                if not rows:
+                    break
+
+                last_url_id = rows[-1][0]
+                updates = [(date, url_id) for url_id, url_path in rows if (date := url_date(url_path))]
+
+                if updates:
+                    await cursor.executemany("""
+                        UPDATE url_registry SET urlDate = %s WHERE urlID = %s
+                    """, updates)
+                updated_count += len(updates)
+
+            await conn.commit()
+            logger.info(f"urlDate backfill progress: {updated_count} updated")
+        except Exception as e:
+            await conn.rollback()
+            logger.error(f"Error during urlDate backfill: {e}")
+            break
+
+    logger.info(f"urlDate backfill finished: {updated_count} updated")
+
+
+async def main():
+    conn = await get_connection()
+
+    try:
+        await create_table(conn)
+        await backfill_published_at(conn)
+        await backfill_url_dates(conn)
+    except Exception as e:
+        logger.error(f"Unexpected error in date backfill: {e}")
+    finally:
+        if conn:
+            await return_connection(conn)
+        await close_all_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
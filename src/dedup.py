@@ -0,0 +1,251 @@
+import re
+import asyncio
+import hashlib
+import logging
+from log_setup import setup_logging
+from database import get_connection, return_connection, close_all_connections
+from search import create_table as create_search_table
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# SimHash settings: 64-bit fingerprints split into 4 bands of 16 bits.
+# Two fingerprints within MAX_HAMMING_DISTANCE <= 3 bits must agree on at
+# least one whole band, so an exact band lookup finds every candidate.
+SIMHASH_BITS = 64
+BAND_COUNT = 4
+BAND_BITS = SIMHASH_BITS // BAND_COUNT
+MAX_HAMMING_DISTANCE = 3
+SHINGLE_SIZE = 3
+
+# Short bodies ("No content found", teasers) would all collide
+MIN_WORDS = 50
+
+BATCH_SIZE = 1000
+
+# Devanagari danda and common punctuation are separators, not word content
+TOKEN_SPLIT_PATTERN = re.compile(r'[\s।॥.,;:!?"\'()\[\]{}<>|/\\\-–—‘’“”]+')
+
+
+async def create_table(conn):
+    """Create the fingerprint table and the duplicate link on url_parsed_content."""
+    try:
+        async with conn.cursor() as cursor:
+            await cursor.execute("""
+                ALTER TABLE url_parsed_content ADD COLUMN IF NOT EXISTS duplicateOf TEXT;
+
+                CREATE TABLE IF NOT EXISTS article_fingerprints (
+                    urlID TEXT PRIMARY KEY,
+                    simhash BIGINT NOT NULL,
+                    band0 INTEGER NOT NULL,
+                    band1 INTEGER NOT NULL,
+                    band2 INTEGER NOT NULL,
+                    band3 INTEGER NOT NULL,
+                    canonicalUrlID TEXT,
+                    FOREIGN KEY (urlID) REFERENCES url_registry(urlID) ON DELETE CASCADE
+                );
+
+                CREATE INDEX IF NOT EXISTS article_fingerprints_band0 ON article_fingerprints (band0);
+                CREATE INDEX IF NOT EXISTS article_fingerprints_band1 ON article_fingerprints (band1);
+                CREATE INDEX IF NOT EXISTS article_fingerprints_band2 ON article_fingerprints (band2);
+                CREATE INDEX IF NOT EXISTS article_fingerprints_band3 ON article_fingerprints (band3);
+            """)
+
+        await conn.commit()
+        logger.info("Dedup tables ensured")
+    except Exception as e:
+        await conn.rollback()
+        logger.error(f"Error creating dedup tables: {e}")
+
+
+def tokenize(text):
+    """Split article text into lower-cased word tokens."""
+    return [token for token in TOKEN_SPLIT_PATTERN.split(text.lower()) if token]
+
+
+def simhash(text):
+    """
+    Compute the 64-bit SimHash of a text over word shingles.
+
+    Returns None when the text is too short to fingerprint reliably.
+    """
+    if not text:
+        return None
+
+    tokens = tokenize(text)
+    if len(tokens) < MIN_WORDS:
+        return None
+
+    weights = [0] * SIMHASH_BITS
+    for i in range(len(tokens) - SHINGLE_SIZE + 1):
+        shingle = ' '.join(tokens[i:i + SHINGLE_SIZE])
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(SIMHASH_BITS):
+            if value >> bit & 1:
+                weights[bit] += 1
+            else:
+                weights[bit] -= 1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def bands(fingerprint):
+    """Split a fingerprint into its BAND_COUNT band values."""
+    mask = (1 << BAND_BITS) - 1
+    return [(fingerprint >> (i * BAND_BITS)) & mask for i in range(BAND_COUNT)]
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def to_signed(fingerprint):
+    """Map an unsigned 64-bit value onto Postgres BIGINT."""
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def closest_match(fingerprint, candidates, exclude_url_id=None):
+    """
+    Pick the canonical urlID among (urlID, simhash, canonicalUrlID) candidates.
+
+    Candidates that are, or resolve to, exclude_url_id are skipped: when a
+    canonical article is parsed again it matches its own duplicates, and
+    must not become a duplicate of itself. Returns None if no candidate is
+    within MAX_HAMMING_DISTANCE.
+
+    >>> closest_match(5, [('B', 5, 'A')], exclude_url_id='A') is None
+    True
+    >>> closest_match(5, [('B', 5, 'A')], exclude_url_id='C')
+    'A'
+    """
+    best = None
+    for url_id, candidate, canonical_url_id in candidates:
+        # Always point at the original, never at another duplicate
+        resolved_url_id = canonical_url_id or url_id
+        if exclude_url_id is not None and exclude_url_id in (url_id, resolved_url_id):
+            continue
+        distance = hamming_distance(fingerprint, to_unsigned(candidate))
+        if distance <= MAX_HAMMING_DISTANCE and (best is None or distance < best[0]):
+            best = (distance, resolved_url_id)
+
+    return best[1] if best else None
+
+
+async def find_duplicate(cursor, fingerprint, exclude_url_id=None):
+    """
+    Look up the canonical copy of a near-duplicate article.
+
+    Returns the urlID of the canonical article, or None if nothing stored
+    other than exclude_url_id and its own duplicates is within
+    MAX_HAMMING_DISTANCE of the fingerprint.
+    """
+    band_values = bands(fingerprint)
+    await cursor.execute("""
+        SELECT urlID, simhash, canonicalUrlID
+        FROM article_fingerprints
+        WHERE (band0 = %s OR band1 = %s OR band2 = %s OR band3 = %s)
+          AND urlID IS DISTINCT FROM %s
+    """, (*band_values, exclude_url_id))
+
+    return closest_match(fingerprint, await cursor.fetchall(), exclude_url_id)
+
+
+async def store_fingerprint(cursor, url_id, fingerprint, canonical_url_id=None):
+    """Add a fingerprint to the LSH index."""
+    await cursor.execute("""
+        INSERT INTO article_fingerprints (urlID, simhash, band0, band1, band2, band3, canonicalUrlID)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (urlID) DO UPDATE SET
+            simhash = EXCLUDED.simhash,
+            band0 = EXCLUDED.band0,
+            band1 = EXCLUDED.band1,
+            band2 = EXCLUDED.band2,
+            band3 = EXCLUDED.band3,
+            canonicalUrlID = EXCLUDED.canonicalUrlID
+    """, (url_id, to_signed(fingerprint), *bands(fingerprint), canonical_url_id))
+
+
+async def dedup_existing_content(conn, batch_size=BATCH_SIZE):
+    """
+    Fingerprint the rows already in url_parsed_content and collapse duplicates.
+
+    Rows are visited oldest first so the earliest copy stays canonical.
+    Duplicate rows keep their metadata but lose articleBody and their
+    searchVector, so search shows the story once, and get duplicateOf set
+    to the canonical urlID.
+    """
+    last_timestamp, last_parse_id = None, None
+    processed_count = 0
+    duplicate_count = 0
+
+    while True:
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute("""
+                    SELECT c.urlID, c.articleBody, c.extractionTimestamp, c.parseID
+                    FROM url_parsed_content c
+                    LEFT JOIN article_fingerprints f ON f.urlID = c.urlID
+                    WHERE f.urlID IS NULL
+                      AND c.duplicateOf IS NULL
+                      AND (%s::timestamp IS NULL OR (c.extractionTimestamp, c.parseID) > (%s::timestamp, %s::text))
+                    ORDER BY c.extractionTimestamp, c.parseID
+                    LIMIT %s
+                """, (last_timestamp, last_timestamp, last_parse_id, batch_size))
+                rows = await cursor.fetchall()
+
+                if not rows:
+                    break
+
+                for url_id, article_body, extraction_timestamp, parse_id in rows:
+                    last_timestamp, last_parse_id = extraction_timestamp, parse_id
+                    fingerprint = simhash(article_body)
+                    if fingerprint is None:
+                        continue
+
+                    canonical_url_id = await find_duplicate(cursor, fingerprint, exclude_url_id=url_id)
+                    if canonical_url_id:
+                        await cursor.execute("""
+                            UPDATE url_parsed_content
+                            SET articleBody = NULL, duplicateOf = %s, searchVector = NULL
+                            WHERE urlID = %s
+                        """, (canonical_url_id, url_id))
+                        duplicate_count += 1
+
+                    await store_fingerprint(cursor, url_id, fingerprint, canonical_url_id)
+                    processed_count += 1
+
+            await conn.commit()
+            logger.info(f"Dedup progress: {processed_count} fingerprinted, {duplicate_count} duplicates linked")
+        except Exception as e:
+            await conn.rollback()
+            logger.error(f"Error during bulk dedup: {e}")
+            break
+
+    logger.info(f"Bulk dedup finished: {processed_count} fingerprinted, {duplicate_count} duplicates linked")
+
+
+async def main():
+    conn = await get_connection()
+
+    try:
+        await create_table(conn)
+        await create_search_table(conn)
+        await dedup_existing_content(conn)
+    except Exception as e:
+        logger.error(f"Unexpected error in dedup: {e}")
+    finally:
+        if conn:
+            await return_connection(conn)
+        await close_all_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,343 @@
+import os
+import sys
+import gzip
+import asyncio
+import logging
+import datetime
+import requests
+import xml.etree.ElementTree as ET
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin, urlparse
+from log_setup import setup_logging
+from database import get_connection, return_connection, close_all_connections
+from save_url import read_media_domain_headers, should_skip_url
+from dates import url_date
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Folder with one JSON file per news domain, same layout the crawler uses
+DOMAINS_DIR = os.getenv('DISCOVERY_DOMAINS_DIR', './assets/newmediadomains')
+
+# fetch() result for a source that has not changed since the last run
+NOT_MODIFIED = object()
+
+# Where a domain's site lives; point at a local fixture server for testing,
+# e.g. DISCOVERY_BASE_URL=http://127.0.0.1:8000/{domain}
+BASE_URL_TEMPLATE = os.getenv('DISCOVERY_BASE_URL', 'https://{domain}')
+
+DEFAULT_SITEMAP_PATHS = ['/sitemap.xml', '/sitemap_index.xml']
+DEFAULT_FEED_PATHS = ['/feed', '/rss', '/rss.xml']
+
+# Nested sitemap indexes deeper than this are ignored
+MAX_SITEMAP_DEPTH = 3
+
+REQUEST_TIMEOUT = (10, 30)
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+
+async def create_table(conn):
+    """Create the per-source high-water mark table."""
+    try:
+        async with conn.cursor() as cursor:
+            await cursor.execute("""
+                CREATE TABLE IF NOT EXISTS discovery_state (
+                    domain VARCHAR(255) NOT NULL,
+                    sourceUrl TEXT NOT NULL,
+                    highWaterMark TIMESTAMPTZ,
+                    etag TEXT,
+                    lastModified TEXT,
+                    lastChecked TIMESTAMPTZ,
+                    PRIMARY KEY (domain, sourceUrl)
+                );
+            """)
+
+        await conn.commit()
+        logger.info("Discovery state table ensured")
+    except Exception as e:
+        await conn.rollback()
+        logger.error(f"Error creating discovery state table: {e}")
+
+
+def local_name(tag):
+    """Strip the XML namespace from a tag name."""
+    return tag.rsplit('}', 1)[-1]
+
+
+def child_text(element, name):
+    for child in element:
+        if local_name(child.tag) == name:
+            return (child.text or '').strip()
+    return None
+
+
+def parse_timestamp(value):
+    """Parse sitemap (W3C datetime) and feed (RFC 822) timestamps."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            parsed = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def parse_document(content):
+    """
+    Parse a sitemap, sitemap index, RSS or Atom document.
+
+    Returns (kind, entries) where kind is 'sitemapindex' or 'urls' and
+    entries is a list of (url, timestamp).
+    """
+    if content[:2] == b'\x1f\x8b':
+        content = gzip.decompress(content)
+
+    root = ET.fromstring(content)
+    root_name = local_name(root.tag)
+
+    if root_name == 'sitemapindex':
+        return 'sitemapindex', [(child_text(s, 'loc'), parse_timestamp(child_text(s, 'lastmod')))
+                                for s in root if local_name(s.tag) == 'sitemap']
+
+    if root_name == 'urlset':
+        return 'urls', [(child_text(u, 'loc'), parse_timestamp(child_text(u, 'lastmod')))
+                        for u in root if local_name(u.tag) == 'url']
+
+    entries = []
+    # RSS: rss/channel/item, Atom: feed/entry
+    for element in root.iter():
+        name = local_name(element.tag)
+        if name == 'item':
+            entries.append((child_text(element, 'link'),
+                            parse_timestamp(child_text(element, 'pubDate') or child_text(element, 'date'))))
+        elif name == 'entry':
+            link = next((child.get('href') for child in element
+                         if local_name(child.tag) == 'link' and child.get('rel', 'alternate') == 'alternate'), None)
+            entries.append((link, parse_timestamp(child_text(element, 'updated') or child_text(element, 'published'))))
+    return 'urls', entries
+
+
+class DomainDiscovery:
+    """Discover new article URLs for one domain from its sitemaps and feeds."""
+
+    def __init__(self, domain, state, session=None):
+        self.domain = domain
+        self.base_url = BASE_URL_TEMPLATE.format(domain=domain).rstrip('/')
+        # sourceUrl -> {'high_water_mark', 'etag', 'last_modified'}
+        self.state = state
+        self.updated_state = {}
+        self.session = session or requests.Session()
+        self.bytes_downloaded = 0
+
+    def fetch(self, url, conditional=True):
+        """Conditional GET; returns the body, NOT_MODIFIED, or None if unavailable."""
+        previous = self.state.get(url, {}) if conditional else {}
+        headers = {'User-Agent': USER_AGENT}
+        if previous.get('etag'):
+            headers['If-None-Match'] = previous['etag']
+        if previous.get('last_modified'):
+            headers['If-Modified-Since'] = previous['last_modified']
+
+        try:
+            response = self.session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            logger.warning(f"Could not fetch {url}: {e}")
+            return None
+
+        if response.status_code == 304:
+            logger.info(f"Not modified: {url}")
+            return NOT_MODIFIED
+        if response.status_code != 200:
+            logger.info(f"Skipping {url}: HTTP {response.status_code}")
+            return None
+
+        self.bytes_downloaded += len(response.content)
+        if conditional:
+            self.remember(url, etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+        return response.content
+
+    def remember(self, url, **values):
+        entry = self.updated_state.setdefault(url, dict(self.state.get(url, {})))
+        entry.update({key: value for key, value in values.items() if value is not None})
+
+    def sources(self):
+        """Sitemaps announced in robots.txt, falling back to the usual paths, plus feeds."""
+        sitemaps = []
+        # Always read robots.txt in full, a 304 would hide the sitemap list
+        robots = self.fetch(self.base_url + '/robots.txt', conditional=False)
+        if robots:
+            for line in robots.decode('utf-8', 'replace').splitlines():
+                name, _, value = line.partition(':')
+                if name.strip().lower() == 'sitemap' and value.strip():
+                    sitemaps.append(urljoin(self.base_url + '/', value.strip()))
+        if not sitemaps:
+            sitemaps = [self.base_url + path for path in DEFAULT_SITEMAP_PATHS]
+        feeds = [self.base_url + path for path in DEFAULT_FEED_PATHS]
+        return sitemaps, feeds
+
+    def read_source(self, url, depth=0):
+        """
+        Yield (url, timestamp) entries newer than the source's high-water mark.
+
+        Returns (as the generator's value) whether the source could be read.
+        In a sitemap index the mark only moves up to just before the oldest
+        child that failed, so that child is read again on the next run.
+        """
+        content = self.fetch(url)
+        if content is NOT_MODIFIED:
+            return True
+        if content is None:
+            return False
+
+        try:
+            kind, entries = parse_document(content)
+        except ET.ParseError as e:
+            logger.info(f"Not a sitemap or feed: {url} ({e})")
+            return False
+
+        high_water_mark = self.state.get(url, {}).get('high_water_mark')
+        read_timestamps = []
+        # lastmod of the oldest child sitemap that could not be read
+        oldest_failed = None
+
+        for loc, timestamp in entries:
+            if not loc:
+                continue
+            # Unchanged since the last run, nothing new below this entry
+            if timestamp and high_water_mark and timestamp <= high_water_mark:
+                continue
+
+            if kind == 'sitemapindex' and depth < MAX_SITEMAP_DEPTH:
+                read = yield from self.read_source(urljoin(url, loc), depth + 1)
+                if not read:
+                    if timestamp and (oldest_failed is None or timestamp < oldest_failed):
+                        oldest_failed = timestamp
+                    continue
+            elif kind != 'sitemapindex':
+                yield urljoin(url, loc), timestamp
+
+            if timestamp:
+                read_timestamps.append(timestamp)
+
+        if oldest_failed:
+            read_timestamps = [timestamp for timestamp in read_timestamps if timestamp < oldest_failed]
+        newest = max(read_timestamps + ([high_water_mark] if high_water_mark else []), default=None)
+        self.remember(url, high_water_mark=newest)
+        return True
+
+    def discover(self):
+        """Return the set of candidate URLs found since the last run."""
+        sitemaps, feeds = self.sources()
+        found = set()
+        for source in sitemaps + feeds:
+            for url, _ in self.read_source(source):
+                if self.belongs_to_domain(url) and not should_skip_url(url):
+                    found.add(url)
+        return found
+
+    def belongs_to_domain(self, url):
+        host = urlparse(url).netloc.lower().replace('www.', '')
+        base_host = urlparse(self.base_url).netloc.lower().replace('www.', '')
+        return host in (self.domain.lower().replace('www.', ''), base_host)
+
+
+async def load_state(conn, domain):
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            SELECT sourceUrl, highWaterMark, etag, lastModified
+            FROM discovery_state
+            WHERE domain = %s
+        """, (domain,))
+        return {
+            source_url: {'high_water_mark': high_water_mark, 'etag': etag, 'last_modified': last_modified}
+            for source_url, high_water_mark, etag, last_modified in await cursor.fetchall()
+        }
+
+
+async def save_discovered(conn, domain, index_name, urls, updated_state):
+    """Insert new URLs and move the high-water marks forward in one transaction."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    inserted = 0
+    try:
+        async with conn.cursor() as cursor:
+            if urls:
+                url_paths = list(urls)
+                await cursor.execute("""
+                    INSERT INTO url_registry (domain, accessTimestamp, index, urlPath, status, urlDate)
+                    SELECT %s, %s, %s, url_path, 'pending', url_date
+                    FROM unnest(%s::text[], %s::timestamp[]) AS u(url_path, url_date)
+                    ON CONFLICT (urlPath) DO NOTHING
+                    RETURNING urlID
+                """, (domain, now.replace(tzinfo=None), index_name, url_paths, [url_date(url_path) for url_path in url_paths]))
+                inserted = len(await cursor.fetchall())
+
+            await cursor.executemany("""
+                INSERT INTO discovery_state (domain, sourceUrl, highWaterMark, etag, lastModified, lastChecked)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (domain, sourceUrl) DO UPDATE SET
+                    highWaterMark = EXCLUDED.highWaterMark,
+                    etag = EXCLUDED.etag,
+                    lastModified = EXCLUDED.lastModified,
+                    lastChecked = EXCLUDED.lastChecked
+            """, [(domain, source_url, values.get('high_water_mark'), values.get('etag'), values.get('last_modified'), now)
+                  for source_url, values in updated_state.items()])
+
+        await conn.commit()
+    except Exception as e:
+        await conn.rollback()
+        logger.error(f"Error saving discovered URLs for {domain}: {e}")
+        raise
+    return inserted
+
+
+def load_domains(folder=DOMAINS_DIR):
+    """Read the domain names from the newmediadomains JSON files, streaming past the URL lists."""
+    domains = []
+    for filename in sorted(os.listdir(folder)):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            headers = read_media_domain_headers(os.path.join(folder, filename))
+        except Exception as e:
+            logger.error(f"Failed to load domain file {filename}: {e}")
+            continue
+        domains.extend(header['domain'] for header in headers if header.get('domain'))
+    return domains
+
+
+async def discover_domain(conn, domain, session):
+    state = await load_state(conn, domain)
+    discovery = DomainDiscovery(domain, state, session)
+    urls = discovery.discover()
+    inserted = await save_discovered(conn, domain, 'Sitemap/RSS', urls, discovery.updated_state)
+    logger.info(f"Discovery for {domain}: {len(urls)} candidate URLs, {inserted} new, {discovery.bytes_downloaded} bytes downloaded")
+    return inserted
+
+
+async def main(domains=None):
+    conn = await get_connection()
+    session = requests.Session()
+    total_inserted = 0
+
+    try:
+        await create_table(conn)
+        for domain in domains or load_domains():
+            try:
+                total_inserted += await discover_domain(conn, domain, session)
+            except Exception as e:
+                logger.error(f"Discovery failed for {domain}: {e}")
+        logger.info(f"Discovery finished: {total_inserted} new URLs")
+    finally:
+        if conn:
+            await return_connection(conn)
+        await close_all_connections()
+
+
+if __name__ == "__main__":
+    # Optionally limit the run to the domains given on the command line
+    asyncio.run(main(sys.argv[1:] or None))
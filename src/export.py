@@ -0,0 +1,308 @@
+import os
+import sys
+import gzip
+import json
+import asyncio
+import hashlib
+import logging
+import datetime
+from psycopg.rows import dict_row
+from log_setup import setup_logging
+from database import get_connection, return_connection, close_all_connections
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Shards and manifest.json land here, one subdirectory per format
+EXPORT_DIR = os.getenv('EXPORT_DIR', './exports')
+
+# A shard is closed once its compressed size passes this
+SHARD_MAX_BYTES = int(os.getenv('EXPORT_SHARD_MAX_BYTES', 256 * 1024 * 1024))
+
+# Rows pulled from the server-side cursor per round trip, and per Parquet row group
+FETCH_SIZE = 2000
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+EXPORT_COLUMNS = [
+    'urlID', 'urlPath', 'domain', 'title', 'author', 'type', 'category', 'keywords',
+    'publishedDate', 'publishedAt', 'extractionTimestamp', 'wordCount', 'textLength', 'articleBody',
+]
+
+
+async def create_table(conn):
+    """Create the shard manifest table and the index the export reads in order."""
+    try:
+        async with conn.cursor() as cursor:
+            await cursor.execute("""
+                CREATE TABLE IF NOT EXISTS export_manifest (
+                    format TEXT NOT NULL,
+                    shardName TEXT NOT NULL,
+                    rowCount INTEGER NOT NULL,
+                    byteSize BIGINT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    firstExtractionTimestamp TIMESTAMP NOT NULL,
+                    lastExtractionTimestamp TIMESTAMP NOT NULL,
+                    lastParseID TEXT NOT NULL,
+                    createdAt TIMESTAMP NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (format, shardName)
+                );
+                -- Watermark; shards recorded before it existed have none
+                ALTER TABLE export_manifest ADD COLUMN IF NOT EXISTS lastWrittenAt TIMESTAMPTZ;
+
+                DROP INDEX IF EXISTS url_parsed_content_extraction;
+                CREATE INDEX IF NOT EXISTS url_parsed_content_written
+                    ON url_parsed_content (writtenAt, parseID);
+            """)
+
+        await conn.commit()
+        logger.info("Export manifest table ensured")
+    except Exception as e:
+        await conn.rollback()
+        logger.error(f"Error creating export manifest table: {e}")
+
+
+def json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+class JsonlShard:
+    """Gzipped JSON lines, one article per line."""
+
+    extension = 'jsonl.gz'
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.gzip = gzip.GzipFile(fileobj=self.file, mode='wb', compresslevel=6)
+
+    def write(self, rows):
+        for row in rows:
+            line = json.dumps({name: json_value(row[name.lower()]) for name in EXPORT_COLUMNS}, ensure_ascii=False)
+            self.gzip.write(line.encode('utf-8') + b'\n')
+
+    def size(self):
+        return self.file.tell()
+
+    def close(self):
+        self.gzip.close()
+        self.file.close()
+
+
+class ParquetShard:
+    """Zstd-compressed Parquet, one row group per fetched batch."""
+
+    extension = 'parquet'
+
+    def __init__(self, path):
+        # Only needed for Parquet output
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([
+            ('urlID', pa.string()), ('urlPath', pa.string()), ('domain', pa.string()),
+            ('title', pa.string()), ('author', pa.string()), ('type', pa.string()),
+            ('category', pa.string()), ('keywords', pa.string()), ('publishedDate', pa.string()),
+            ('publishedAt', pa.timestamp('us', tz='UTC')), ('extractionTimestamp', pa.timestamp('us')),
+            ('wordCount', pa.int32()), ('textLength', pa.int32()), ('articleBody', pa.string()),
+        ])
+        self.file = open(path, 'wb')
+        self.writer = pq.ParquetWriter(self.file, self.schema, compression='zstd')
+
+    def write(self, rows):
+        columns = {name: [row[name.lower()] for row in rows] for name in EXPORT_COLUMNS}
+        self.writer.write_table(self.pa.table(columns, schema=self.schema))
+
+    def size(self):
+        return self.file.tell()
+
+    def close(self):
+        self.writer.close()
+        self.file.close()
+
+
+SHARD_FORMATS = {'jsonl': JsonlShard, 'parquet': ParquetShard}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def export_watermark(conn, export_format):
+    """(writtenAt, parseID) of the last exported row, and the next shard number."""
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            SELECT lastWrittenAt, lastParseID, COUNT(*) OVER ()
+            FROM export_manifest
+            WHERE format = %s
+            ORDER BY lastWrittenAt DESC NULLS LAST, lastParseID DESC
+            LIMIT 1
+        """, (export_format,))
+        row = await cursor.fetchone()
+    if row is None:
+        return (EPOCH, ''), 0
+    if row[0] is None:
+        # Only shards from before the writtenAt watermark, start over
+        return (EPOCH, ''), row[2]
+    return (row[0], row[1]), row[2]
+
+
+async def settled_before(conn, read_conn):
+    """
+    writtenAt below which every row is committed.
+
+    writtenAt is now() of the writing transaction, i.e. when it started,
+    so a row still waiting to commit is never older than the oldest open
+    transaction. Exporting only rows before that point means no row can
+    commit later below the watermark; a long open transaction only delays
+    the export.
+    """
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            SELECT COALESCE(MIN(xact_start), clock_timestamp())
+            FROM pg_stat_activity
+            WHERE xact_start IS NOT NULL
+              AND pid NOT IN (pg_backend_pid(), %s)
+        """, (read_conn.info.backend_pid,))
+        return (await cursor.fetchone())[0]
+
+
+async def write_manifest(conn, export_format, directory):
+    """Rewrite manifest.json from export_manifest, for readers without database access."""
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute("""
+            SELECT shardName, rowCount, byteSize, sha256, firstExtractionTimestamp, lastExtractionTimestamp, createdAt
+            FROM export_manifest
+            WHERE format = %s
+            ORDER BY shardName
+        """, (export_format,))
+        shards = [{key: json_value(value) for key, value in row.items()} for row in await cursor.fetchall()]
+
+    temp_path = os.path.join(directory, 'manifest.json.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'format': export_format, 'columns': EXPORT_COLUMNS, 'shards': shards}, f, indent=2)
+    os.replace(temp_path, os.path.join(directory, 'manifest.json'))
+
+
+async def export_articles(read_conn, write_conn, export_format='jsonl', max_bytes=SHARD_MAX_BYTES):
+    """
+    Export articles parsed since the last export into new shards.
+
+    Rows are streamed from a server-side cursor in (writtenAt, parseID)
+    order, so memory stays at one fetch batch. writtenAt follows commit
+    order up to settled_before, so rows committed late by a slow parser are
+    still picked up next time. A shard is written to a temp file and only
+    renamed and recorded in export_manifest once it is complete; an
+    interrupted export resumes after the last recorded shard. Re-parsed
+    articles get a new writtenAt and are exported again, consumers keep
+    the latest row per urlID.
+    """
+    shard_class = SHARD_FORMATS[export_format]
+    directory = os.path.join(EXPORT_DIR, export_format)
+    os.makedirs(directory, exist_ok=True)
+    (last_written_at, last_parse_id), shard_number = await export_watermark(write_conn, export_format)
+    settled = await settled_before(write_conn, read_conn)
+    await write_conn.commit()
+    logger.info(f"Exporting {export_format} written after {last_written_at} / {last_parse_id!r} and before {settled}, "
+                f"starting at shard {shard_number}")
+
+    shard = None
+    shard_rows = 0
+    # Extraction time range of the shard, for readers of the manifest
+    first_timestamp = last_extraction_timestamp = None
+    last_row = None
+    total_rows = 0
+
+    async def finish_shard():
+        nonlocal shard, shard_number
+        shard.close()
+        shard_name = f"part-{shard_number:05d}.{shard_class.extension}"
+        final_path = os.path.join(directory, shard_name)
+        os.replace(temp_path, final_path)
+
+        async with write_conn.cursor() as cursor:
+            await cursor.execute("""
+                INSERT INTO export_manifest (format, shardName, rowCount, byteSize, sha256,
+                                             firstExtractionTimestamp, lastExtractionTimestamp, lastParseID, lastWrittenAt)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (export_format, shard_name, shard_rows, os.path.getsize(final_path), file_sha256(final_path),
+                  first_timestamp, last_extraction_timestamp, last_row['parseid'], last_row['writtenat']))
+        await write_conn.commit()
+        await write_manifest(write_conn, export_format, directory)
+        logger.info(f"Wrote {shard_name}: {shard_rows} rows, {os.path.getsize(final_path)} bytes")
+        shard = None
+        shard_number += 1
+
+    try:
+        async with read_conn.cursor(name='export_articles', row_factory=dict_row) as cursor:
+            cursor.itersize = FETCH_SIZE
+            await cursor.execute("""
+                SELECT c.parseID, c.writtenAt, c.urlID, r.urlPath, r.domain, c.title, c.author, c.type, c.category,
+                       c.keywords, c.publishedDate, c.publishedAt, c.extractionTimestamp, c.wordCount, c.textLength,
+                       c.articleBody
+                FROM url_parsed_content c
+                JOIN url_registry r ON r.urlID = c.urlID
+                WHERE (c.writtenAt, c.parseID) > (%s, %s)
+                  AND c.writtenAt < %s
+                  AND c.duplicateOf IS NULL
+                ORDER BY c.writtenAt, c.parseID
+            """, (last_written_at, last_parse_id, settled))
+
+            while rows := await cursor.fetchmany(FETCH_SIZE):
+                if shard is None:
+                    temp_path = os.path.join(directory, f"part-{shard_number:05d}.{shard_class.extension}.tmp")
+                    shard = shard_class(temp_path)
+                    shard_rows = 0
+                    first_timestamp = last_extraction_timestamp = rows[0]['extractiontimestamp']
+
+                extraction_timestamps = [row['extractiontimestamp'] for row in rows]
+                first_timestamp = min(first_timestamp, *extraction_timestamps)
+                last_extraction_timestamp = max(last_extraction_timestamp, *extraction_timestamps)
+                shard.write(rows)
+                shard_rows += len(rows)
+                total_rows += len(rows)
+                last_row = rows[-1]
+
+                if shard.size() >= max_bytes:
+                    await finish_shard()
+
+        if shard is not None:
+            await finish_shard()
+        await read_conn.commit()
+    except Exception:
+        await read_conn.rollback()
+        # The unfinished shard is not in the manifest, the next run redoes it
+        if shard is not None:
+            shard.close()
+            os.remove(temp_path)
+        raise
+
+    logger.info(f"Export finished: {total_rows} rows")
+    return total_rows
+
+
+async def main(export_format='jsonl'):
+    # The cursor's transaction stays open for the whole export, so shards
+    # are recorded over a second connection
+    read_conn = await get_connection()
+    write_conn = await get_connection()
+
+    try:
+        await create_table(write_conn)
+        rows = await export_articles(read_conn, write_conn, export_format)
+        print(f"Exported {rows} articles to {os.path.join(EXPORT_DIR, export_format)}")
+    finally:
+        await return_connection(read_conn)
+        await return_connection(write_conn)
+        await close_all_connections()
+
+
+if __name__ == "__main__":
+    # jsonl (default) or parquet, which needs pyarrow
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else 'jsonl'))
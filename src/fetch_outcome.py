@@ -0,0 +1,154 @@
+import os
+import ssl
+import socket
+import random
+import datetime
+from enum import Enum
+from http.client import RemoteDisconnected
+from requests.exceptions import (
+    HTTPError,
+    SSLError,
+    Timeout,
+    TooManyRedirects,
+    ConnectionError,
+    ChunkedEncodingError,
+    ContentDecodingError,
+    InvalidURL,
+    MissingSchema,
+    InvalidSchema,
+)
+from urllib3.exceptions import DecodeError, NameResolutionError, ProtocolError
+
+# Retry schedule: BASE * 2^(attempts-1) with jitter, capped, for at most MAX_ATTEMPTS fetches
+MAX_ATTEMPTS = int(os.getenv('FETCH_MAX_ATTEMPTS', 6))
+RETRY_BASE_DELAY = int(os.getenv('FETCH_RETRY_BASE_DELAY', 300))
+MAX_RETRY_DELAY = int(os.getenv('FETCH_MAX_RETRY_DELAY', 24 * 60 * 60))
+
+
+class FetchOutcome(Enum):
+    """What happened when a URL was fetched and parsed."""
+    SUCCESS = 'success'
+    NOT_MODIFIED = 'not_modified'
+    HTTP_NO_CONTENT = 'http_204'
+    HTTP_CLIENT_ERROR = 'http_4xx'
+    HTTP_RATE_LIMITED = 'http_429'
+    HTTP_SERVER_ERROR = 'http_5xx'
+    DNS = 'dns'
+    TLS = 'tls'
+    TIMEOUT = 'timeout'
+    CONNECTION_RESET = 'reset'
+    CONNECTION_ERROR = 'connection'
+    DECODE_ERROR = 'decode'
+    TOO_MANY_REDIRECTS = 'redirects'
+    INVALID_URL = 'invalid_url'
+    NOT_HTML = 'not_html'
+    TOO_LARGE = 'too_large'
+    PARSE_ERROR = 'parse_error'
+    STORE_ERROR = 'store_error'
+    UNKNOWN = 'unknown'
+
+    @property
+    def permanent(self):
+        """True when fetching the URL again would give the same result."""
+        return self in PERMANENT_OUTCOMES
+
+
+PERMANENT_OUTCOMES = {
+    FetchOutcome.HTTP_NO_CONTENT,
+    FetchOutcome.HTTP_CLIENT_ERROR,
+    FetchOutcome.TLS,
+    FetchOutcome.TOO_MANY_REDIRECTS,
+    FetchOutcome.INVALID_URL,
+    FetchOutcome.NOT_HTML,
+    FetchOutcome.TOO_LARGE,
+    FetchOutcome.PARSE_ERROR,
+}
+
+
+def classify_status(status_code):
+    """Map an HTTP status code onto an outcome."""
+    if status_code == 204:
+        return FetchOutcome.HTTP_NO_CONTENT
+    # The server gave up waiting for our request, not a limit on us
+    if status_code == 408:
+        return FetchOutcome.TIMEOUT
+    if status_code == 429:
+        return FetchOutcome.HTTP_RATE_LIMITED
+    if 400 <= status_code < 500:
+        return FetchOutcome.HTTP_CLIENT_ERROR
+    if status_code >= 500:
+        return FetchOutcome.HTTP_SERVER_ERROR
+    return FetchOutcome.SUCCESS
+
+
+def exception_chain(exc):
+    """Yield the exception and everything it wraps (cause, context, args, urllib3 reason)."""
+    seen = set()
+    stack = [exc]
+    while stack:
+        current = stack.pop()
+        if current is None or id(current) in seen:
+            continue
+        seen.add(id(current))
+        yield current
+
+        stack.extend([current.__cause__, current.__context__])
+        # MaxRetryError keeps the real error in .reason, requests wraps it in args
+        reason = getattr(current, 'reason', None)
+        if isinstance(reason, BaseException):
+            stack.append(reason)
+        stack.extend(arg for arg in current.args if isinstance(arg, BaseException))
+
+
+def classify_exception(exc):
+    """Map an exception raised while fetching a URL onto an outcome."""
+    if isinstance(exc, HTTPError) and exc.response is not None:
+        return classify_status(exc.response.status_code)
+    if isinstance(exc, SSLError):
+        return FetchOutcome.TLS
+    if isinstance(exc, Timeout):
+        return FetchOutcome.TIMEOUT
+    if isinstance(exc, TooManyRedirects):
+        return FetchOutcome.TOO_MANY_REDIRECTS
+    if isinstance(exc, (InvalidURL, MissingSchema, InvalidSchema)):
+        return FetchOutcome.INVALID_URL
+
+    for cause in exception_chain(exc):
+        if isinstance(cause, (NameResolutionError, socket.gaierror)):
+            return FetchOutcome.DNS
+        if isinstance(cause, ssl.SSLError):
+            return FetchOutcome.TLS
+        if isinstance(cause, (socket.timeout, TimeoutError)):
+            return FetchOutcome.TIMEOUT
+        # A body that arrived but would not decompress, not a dropped connection
+        if isinstance(cause, (ContentDecodingError, DecodeError)):
+            return FetchOutcome.DECODE_ERROR
+        if isinstance(cause, (ConnectionResetError, RemoteDisconnected, ProtocolError, ChunkedEncodingError)):
+            return FetchOutcome.CONNECTION_RESET
+
+    if isinstance(exc, ConnectionError):
+        return FetchOutcome.CONNECTION_ERROR
+    return FetchOutcome.UNKNOWN
+
+
+def retry_after_seconds(response):
+    """Read a numeric Retry-After header, None if absent or a date."""
+    if response is None:
+        return None
+    value = response.headers.get('Retry-After', '')
+    return int(value) if value.isdigit() else None
+
+
+def next_attempt_at(attempts, retry_after=None, now=None):
+    """
+    When a URL that has failed `attempts` times may be fetched again.
+
+    Exponential backoff with jitter, never sooner than the server's
+    Retry-After.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+    delay *= random.uniform(0.8, 1.2)
+    if retry_after:
+        delay = max(delay, retry_after)
+    return now + datetime.timedelta(seconds=delay)
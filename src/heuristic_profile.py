@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from urllib.parse import urlparse
+from log_setup import setup_logging
+from database import get_connection, return_connection, close_all_connections
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Time every extraction method the parser tries; off by default, it costs a
+# perf_counter call per attempt
+PROFILE_HEURISTICS = os.getenv('PROFILE_HEURISTICS', '0') == '1'
+
+
+async def create_table(conn):
+    """Create the per-domain method statistics table."""
+    try:
+        async with conn.cursor() as cursor:
+            await cursor.execute("""
+                CREATE TABLE IF NOT EXISTS heuristic_profile (
+                    domain VARCHAR(255) NOT NULL,
+                    heuristic TEXT NOT NULL,
+                    method TEXT NOT NULL,
+                    attempts BIGINT NOT NULL DEFAULT 0,
+                    hits BIGINT NOT NULL DEFAULT 0,
+                    totalSeconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    PRIMARY KEY (domain, heuristic, method)
+                );
+            """)
+
+        await conn.commit()
+        logger.info("Heuristic profile table ensured")
+    except Exception as e:
+        await conn.rollback()
+        logger.error(f"Error creating heuristic profile table: {e}")
+
+
+class HeuristicProfile:
+    """
+    Attempts, hits and time spent per (domain, heuristic, method).
+
+    A hit is the method that produced the value; methods after it are not
+    run and so not counted, which is exactly the cost the parser pays.
+    """
+
+    def __init__(self):
+        # (domain, heuristic, method) -> [attempts, hits, seconds]
+        self.stats = defaultdict(lambda: [0, 0, 0.0])
+
+    def run(self, heuristic, methods, soup, url):
+        """Try (name, function) methods in order, return the first value that is not None."""
+        domain = urlparse(url).netloc
+        for name, method in methods:
+            started = time.perf_counter()
+            value = method(soup, url)
+            entry = self.stats[(domain, heuristic, name)]
+            entry[0] += 1
+            entry[2] += time.perf_counter() - started
+            if value is not None:
+                entry[1] += 1
+                return value
+        return None
+
+    def drain(self):
+        """Return the collected stats as plain tuples and start over."""
+        rows = [(*key, *values) for key, values in self.stats.items()]
+        self.stats.clear()
+        return rows
+
+    def merge(self, rows):
+        """Add stats drained from another process."""
+        for domain, heuristic, method, attempts, hits, seconds in rows:
+            entry = self.stats[(domain, heuristic, method)]
+            entry[0] += attempts
+            entry[1] += hits
+            entry[2] += seconds
+
+
+profile = HeuristicProfile()
+
+
+def run_methods(heuristic, methods, soup, url):
+    """Run an extraction chain, timing each method when PROFILE_HEURISTICS is set."""
+    if PROFILE_HEURISTICS:
+        return profile.run(heuristic, methods, soup, url)
+    for _, method in methods:
+        value = method(soup, url)
+        if value is not None:
+            return value
+    return None
+
+
+async def save_profile(conn):
+    """Add this run's stats to heuristic_profile."""
+    rows = profile.drain()
+    if not rows:
+        return
+    try:
+        async with conn.cursor() as cursor:
+            await cursor.executemany("""
+                INSERT INTO heuristic_profile (domain, heuristic, method, attempts, hits, totalSeconds)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (domain, heuristic, method) DO UPDATE SET
+                    attempts = heuristic_profile.attempts + EXCLUDED.attempts,
+                    hits = heuristic_profile.hits + EXCLUDED.hits,
+                    totalSeconds = heuristic_profile.totalSeconds + EXCLUDED.totalSeconds
+            """, rows)
+        await conn.commit()
+        logger.info(f"Saved heuristic profile for {len(rows)} (domain, method) pairs")
+    except Exception as e:
+        await conn.rollback()
+        logger.error(f"Error saving heuristic profile: {e}")
+
+
+async def report(conn, domain=None):
+    """
+    Rank the methods of each heuristic by cost per success.
+
+    Cost per success is the total time spent in a method divided by the
+    times it produced the value; a method that never hits sorts last.
+    """
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            SELECT heuristic, method, SUM(attempts), SUM(hits), SUM(totalSeconds)
+            FROM heuristic_profile
+            WHERE %s::text IS NULL OR domain = %s
+            GROUP BY heuristic, method
+            ORDER BY heuristic,
+                     SUM(hits) = 0,
+                     SUM(totalSeconds) / NULLIF(SUM(hits), 0)
+        """, (domain, domain))
+        rows = await cursor.fetchall()
+
+    lines = [f"{'heuristic':<12} {'method':<18} {'attempts':>9} {'hits':>8} {'hit rate':>9} {'ms/attempt':>11} {'ms/success':>11}"]
+    for heuristic, method, attempts, hits, seconds in rows:
+        hit_rate = hits / attempts if attempts else 0
+        per_attempt = seconds * 1000 / attempts if attempts else 0
+        per_success = f"{seconds * 1000 / hits:11.3f}" if hits else f"{'-':>11}"
+        lines.append(f"{heuristic:<12} {method:<18} {attempts:>9} {hits:>8} {hit_rate:>9.1%} {per_attempt:>11.3f} {per_success}")
+    return '\n'.join(lines)
+
+
+async def main(domain=None):
+    conn = await get_connection()
+
+    try:
+        await create_table(conn)
+        print(await report(conn, domain))
+    finally:
+        if conn:
+            await return_connection(conn)
+        await close_all_connections()
+
+
+if __name__ == "__main__":
+    # Optionally restrict the report to one domain
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else None))
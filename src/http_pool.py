@@ -0,0 +1,161 @@
+import os
+import time
+import socket
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import connection as urllib3_connection
+from metrics import CONNECTIONS_OPENED, DNS_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# How long a resolved address is reused before asking DNS again
+DNS_CACHE_TTL = int(os.getenv('DNS_CACHE_TTL', 300))
+
+# Hosts with an open session; the least recently used one is closed past this
+MAX_HOST_SESSIONS = int(os.getenv('MAX_HOST_SESSIONS', 256))
+
+# Keep-alive connections kept per host
+CONNECTIONS_PER_HOST = int(os.getenv('CONNECTIONS_PER_HOST', 2))
+
+
+class DnsCache:
+    """getaddrinfo results per (host, port), kept for DNS_CACHE_TTL seconds."""
+
+    def __init__(self, ttl=DNS_CACHE_TTL):
+        self.ttl = ttl
+        # Metrics label, set by install_dns_cache
+        self.component = 'parser'
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, host, port):
+        key = (host, port)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                DNS_LOOKUPS.labels(self.component, 'hit').inc()
+                return entry[1]
+
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = (now + self.ttl, addresses)
+        DNS_LOOKUPS.labels(self.component, 'miss').inc()
+        return addresses
+
+    def forget(self, host, port):
+        with self.lock:
+            self.entries.pop((host, port), None)
+
+
+dns_cache = DnsCache()
+# Connections opened per host, to tell how often keep-alive saved a handshake
+connections_opened = {}
+original_create_connection = urllib3_connection.create_connection
+
+
+def create_connection(address, *args, **kwargs):
+    """
+    urllib3's create_connection, resolving the host through the DNS cache.
+
+    Only the socket address changes; urllib3 still uses the host name for
+    SNI and certificate checks.
+    """
+    host, port = address
+    connections_opened[host] = connections_opened.get(host, 0) + 1
+    CONNECTIONS_OPENED.labels(dns_cache.component, host).inc()
+
+    try:
+        addresses = dns_cache.resolve(host, port)
+    except socket.gaierror:
+        # Let urllib3 raise its usual NameResolutionError
+        return original_create_connection(address, *args, **kwargs)
+
+    error = None
+    for *_, sockaddr in addresses:
+        try:
+            return original_create_connection((sockaddr[0], port), *args, **kwargs)
+        except OSError as e:
+            error = e
+    # Every cached address failed, the host may have moved
+    dns_cache.forget(host, port)
+    raise error
+
+
+def install_dns_cache(component):
+    """Route new urllib3 connections through the DNS cache (idempotent)."""
+    dns_cache.component = component
+    urllib3_connection.create_connection = create_connection
+
+
+class HostSessions:
+    """
+    One requests.Session per host, so consecutive fetches from a site reuse
+    the same keep-alive connection instead of a new TCP and TLS handshake.
+    """
+
+    def __init__(self, component, max_hosts=MAX_HOST_SESSIONS):
+        self.max_hosts = max_hosts
+        self.sessions = OrderedDict()
+        self.requests_made = {}
+        install_dns_cache(component)
+
+    def session(self, host):
+        session = self.sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CONNECTIONS_PER_HOST)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.sessions[host] = session
+            if len(self.sessions) > self.max_hosts:
+                _, evicted = self.sessions.popitem(last=False)
+                evicted.close()
+        else:
+            self.sessions.move_to_end(host)
+        return session
+
+    def reserve(self, urls):
+        """
+        Grow the LRU to hold a session for every host among urls.
+
+        The scheduler interleaves domains, so a host's next turn comes only
+        after every other host in the batch had one; an LRU smaller than
+        the batch's hosts would close each session just before its reuse.
+        """
+        hosts = len({urlparse(url).netloc for url in urls})
+        if hosts > self.max_hosts:
+            logger.info(f"Growing host sessions from {self.max_hosts} to {hosts} hosts")
+            self.max_hosts = hosts
+
+    def get(self, url, **kwargs):
+        """requests.get through the session of the URL's host."""
+        host = urlparse(url).netloc
+        self.requests_made[host] = self.requests_made.get(host, 0) + 1
+        return self.session(host).get(url, **kwargs)
+
+    def stats(self):
+        """Requests, new connections and DNS cache use so far."""
+        total_requests = sum(self.requests_made.values())
+        total_connections = sum(connections_opened.values())
+        return {
+            'hosts': len(self.requests_made),
+            'requests': total_requests,
+            'connections_opened': total_connections,
+            'connection_reuse': 1 - total_connections / total_requests if total_requests else 0,
+            'dns_hits': dns_cache.hits,
+            'dns_misses': dns_cache.misses,
+        }
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
@@ -0,0 +1,118 @@
+import sys
+import asyncio
+import logging
+from log_setup import setup_logging
+from database import get_connection, return_connection, close_all_connections
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+async def create_table(conn):
+    """Create the per (domain, index) churn table."""
+    try:
+        async with conn.cursor() as cursor:
+            await cursor.execute("""
+                CREATE TABLE IF NOT EXISTS index_churn (
+                    domain VARCHAR(255) NOT NULL,
+                    index VARCHAR(255) NOT NULL,
+                    previousIndex VARCHAR(255),
+                    total INTEGER NOT NULL,
+                    new INTEGER NOT NULL,
+                    carried INTEGER NOT NULL,
+                    dropped INTEGER NOT NULL,
+                    computedAt TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (domain, index)
+                );
+            """)
+
+        await conn.commit()
+        logger.info("Index churn table ensured")
+    except Exception as e:
+        await conn.rollback()
+        logger.error(f"Error creating index churn table: {e}")
+
+
+def compute_delta(known_urls, domain_file_data, url_paths):
+    """
+    Split an index's URLs into what is new and how it differs from the last index.
+
+    New URLs are the ones not in the URL store, i.e. not registered from any
+    earlier index; only those need to reach the database. Churn compares
+    against the most recent index in the domain file: carried URLs appear in
+    both, dropped ones only in the previous index.
+
+    Returns (new_urls, churn).
+    """
+    current = set(url_paths)
+    previous_entries = domain_file_data.get('URL_paths') or []
+    # Entries are kept newest first
+    previous_entry = previous_entries[0] if previous_entries else {}
+    previous = set(previous_entry.get('url_paths', []))
+
+    new_urls = known_urls.unseen(current)
+    churn = {
+        'previous_index': previous_entry.get('index'),
+        'total': len(current),
+        'new': len(new_urls),
+        'carried': len(current & previous),
+        'dropped': len(previous - current),
+    }
+    return new_urls, churn
+
+
+async def record_churn(conn, domain, index_name, churn):
+    """Store one index's churn, replacing an earlier run of the same index."""
+    try:
+        async with conn.cursor() as cursor:
+            await cursor.execute("""
+                INSERT INTO index_churn (domain, index, previousIndex, total, new, carried, dropped)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (domain, index) DO UPDATE SET
+                    previousIndex = EXCLUDED.previousIndex,
+                    total = EXCLUDED.total,
+                    new = EXCLUDED.new,
+                    carried = EXCLUDED.carried,
+                    dropped = EXCLUDED.dropped,
+                    computedAt = NOW()
+            """, (domain, index_name, churn['previous_index'], churn['total'], churn['new'], churn['carried'], churn['dropped']))
+        await conn.commit()
+    except Exception as e:
+        await conn.rollback()
+        logger.error(f"Error recording churn for {domain} {index_name}: {e}")
+
+
+async def report(conn, domain=None):
+    """New, carried and dropped URLs per index, summed over domains."""
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            SELECT index, COUNT(*), SUM(total), SUM(new), SUM(carried), SUM(dropped)
+            FROM index_churn
+            WHERE %s::text IS NULL OR domain = %s
+            GROUP BY index
+            ORDER BY index
+        """, (domain, domain))
+        rows = await cursor.fetchall()
+
+    lines = [f"{'index':<18} {'domains':>8} {'total':>10} {'new':>10} {'new %':>7} {'carried':>10} {'dropped':>10}"]
+    for index_name, domains, total, new, carried, dropped in rows:
+        new_share = new / total if total else 0
+        lines.append(f"{index_name:<18} {domains:>8} {total:>10} {new:>10} {new_share:>7.1%} {carried:>10} {dropped:>10}")
+    return '\n'.join(lines)
+
+
+async def main(domain=None):
+    conn = await get_connection()
+
+    try:
+        await create_table(conn)
+        print(await report(conn, domain))
+    finally:
+        if conn:
+            await return_connection(conn)
+        await close_all_connections()
+
+
+if __name__ == "__main__":
+    # Optionally restrict the report to one domain
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else None))
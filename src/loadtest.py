@@ -0,0 +1,323 @@
+"""
+End-to-end load test: crawler.py -> save_url.py -> parser.py against local mocks.
+
+Starts a fake CDX index server, one fake Nepali news site per domain and a
+throwaway Postgres cluster (initdb/pg_ctl from PATH or PG_BIN), then runs
+the three stages as subprocesses in a scratch directory and reports the
+throughput of each stage and of the whole pipeline.
+
+    python loadtest.py --domains 50 --urls-per-index 2000 --cdx-429-rate 0.05
+
+Nothing talks to the real Common Crawl servers or news sites.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Vocabulary for the synthetic articles
+WORDS = (
+    "नेपाल सरकार काठमाडौं प्रधानमन्त्री मन्त्रालय निर्वाचन आयोग संसद बैठक निर्णय "
+    "अर्थतन्त्र बजेट विकास योजना सडक निर्माण विद्यालय शिक्षा स्वास्थ्य अस्पताल "
+    "किसान धान उत्पादन बजार मूल्य पर्यटन हिमाल पोखरा क्रिकेट फुटबल खेलाडी "
+    "प्रतियोगिता जित्यो भन्यो बताए गरेका छन् थियो भएको रहेको अनुसार पछि अघि "
+    "आज हिजो वर्ष महिना प्रदेश जिल्ला नगरपालिका गाउँपालिका नागरिक समाज"
+).split()
+CATEGORIES = ['politics', 'economy', 'sports', 'national', 'entertainment', 'opinion']
+BS_MONTHS = ['बैशाख', 'जेठ', 'असार', 'साउन', 'भदौ', 'असोज', 'कार्तिक', 'मंसिर', 'पुस', 'माघ', 'फागुन', 'चैत']
+NEPALI_DIGITS = str.maketrans('0123456789', '०१२३४५६७८९')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Counters:
+    """Request counters shared by the mock server threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, name):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + 1
+
+
+def article_ids(index_name, urls_per_index, overlap):
+    """
+    The article numbers a site has in one crawl index.
+
+    Consecutive indexes share `overlap` of their URLs, like real crawls
+    that keep re-capturing the same articles.
+    """
+    week = int(index_name.rsplit('-', 1)[-1]) if index_name.rsplit('-', 1)[-1].isdigit() else 0
+    start = int(week * urls_per_index * (1 - overlap))
+    return range(start, start + urls_per_index)
+
+
+def make_cdx_handler(options, site_ports, counters):
+    class CdxHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            counters.inc('cdx_requests')
+            time.sleep(options.cdx_latency / 1000 * random.uniform(0.5, 1.5))
+
+            if random.random() < options.cdx_429_rate:
+                counters.inc('cdx_429')
+                self.send_response(429)
+                self.send_header('Retry-After', '1')
+                self.end_headers()
+                return
+
+            # /CC-MAIN-2025-13-index?url=*.127.0.0.1:8001/*&output=json
+            index_name = urlparse(self.path).path.strip('/').removesuffix('-index')
+            query = parse_qs(urlparse(self.path).query).get('url', [''])[0]
+            host = query.removeprefix('*.').split('/')[0]
+            if host not in site_ports:
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            lines = []
+            for article_id in article_ids(index_name, options.urls_per_index, options.overlap):
+                url = f"http://{host}/news/{article_id}"
+                lines.append(json.dumps({
+                    'urlkey': url,
+                    'timestamp': '20250101000000',
+                    'url': url,
+                    'mime': 'text/html',
+                    'status': '200',
+                    'digest': hashlib.sha1(url.encode()).hexdigest(),
+                    'length': '12345',
+                    'offset': str(article_id * 12345),
+                    'filename': f'crawl-data/{index_name}/segments/loadtest/warc/loadtest.warc.gz',
+                }))
+            body = '\n'.join(lines).encode('utf-8')
+            counters.inc('cdx_records_served')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return CdxHandler
+
+
+def synthetic_article(host, article_id, duplicate_rate):
+    """Deterministic Nepali article page; a share of them copy the previous article's body."""
+    rng = random.Random(f"{host}/{article_id}")
+    body_rng = random.Random(f"{host}/{article_id - 1}") if rng.random() < duplicate_rate else rng
+
+    title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 10)))
+    paragraphs = [
+        ' '.join(body_rng.choice(WORDS) for _ in range(body_rng.randint(15, 40))) + '।'
+        for _ in range(body_rng.randint(6, 20))
+    ]
+
+    # Mix the date formats the parser has to normalize
+    style = rng.randrange(3)
+    if style == 0:
+        date_html = f'<meta property="article:published_time" content="2025-0{rng.randint(1, 9)}-{rng.randint(10, 28)}T10:00:00+05:45">'
+    elif style == 1:
+        bs_date = f"{rng.randint(2078, 2081)} {rng.choice(BS_MONTHS)} {rng.randint(1, 29)}".translate(NEPALI_DIGITS)
+        date_html = f'<span class="post-date">{bs_date}</span>'
+    else:
+        date_html = f'<span class="post-date">{str(rng.randint(1, 23)).translate(NEPALI_DIGITS)} घण्टा अगाडि</span>'
+
+    category = rng.choice(CATEGORIES)
+    return f"""<!DOCTYPE html>
+<html lang="ne"><head><meta charset="utf-8"><title>{title}</title>
+<meta name="description" content="{paragraphs[0][:120]}">
+<meta property="article:section" content="{category}">
+<meta property="og:type" content="article">
+{date_html if style == 0 else ''}
+</head><body>
+<nav><a href="/">गृहपृष्ठ</a> <a href="/{category}">{category}</a></nav>
+<article><h1>{title}</h1>{date_html if style != 0 else ''}
+<div class="author">संवाददाता</div>
+{''.join(f'<p>{p}</p>' for p in paragraphs)}
+</article><footer>© loadtest</footer></body></html>""".encode('utf-8')
+
+
+def make_site_handler(options, counters):
+    class SiteHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            counters.inc('site_requests')
+            time.sleep(options.site_latency / 1000 * random.uniform(0.5, 1.5))
+
+            parts = urlparse(self.path).path.strip('/').split('/')
+            if len(parts) != 2 or parts[0] != 'news' or not parts[1].isdigit():
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            body = synthetic_article(self.headers.get('Host', ''), int(parts[1]), options.duplicate_rate)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return SiteHandler
+
+
+def serve(handler, port):
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def pg_tool(name):
+    pg_bin = os.getenv('PG_BIN')
+    path = os.path.join(pg_bin, name) if pg_bin else shutil.which(name)
+    if not path:
+        sys.exit(f"{name} not found; put the PostgreSQL binaries on PATH or set PG_BIN")
+    return path
+
+
+def start_postgres(workdir):
+    """Initialise and start a throwaway cluster, return (db env, data dir)."""
+    data_dir = os.path.join(workdir, 'pgdata')
+    port = free_port()
+    subprocess.run([pg_tool('initdb'), '-D', data_dir, '-U', 'loadtest', '--auth=trust', '-E', 'UTF8'],
+                   check=True, stdout=subprocess.DEVNULL)
+    subprocess.run([pg_tool('pg_ctl'), '-D', data_dir, '-l', os.path.join(workdir, 'postgres.log'), '-w',
+                    '-o', f"-p {port} -k {workdir} -c listen_addresses=127.0.0.1 -c fsync=off",
+                    'start'], check=True, stdout=subprocess.DEVNULL)
+    env = {
+        'DB_NAME': 'postgres',
+        'DB_USER': 'loadtest',
+        # database.py insists on a password, trust auth ignores it
+        'DB_PASSWORD': 'loadtest',
+        'DB_HOST': '127.0.0.1',
+        'DB_PORT': str(port),
+    }
+    return env, data_dir
+
+
+def stop_postgres(data_dir):
+    subprocess.run([pg_tool('pg_ctl'), '-D', data_dir, '-m', 'fast', 'stop'], stdout=subprocess.DEVNULL)
+
+
+def count_rows(db_env, query):
+    import psycopg
+    with psycopg.connect(dbname=db_env['DB_NAME'], user=db_env['DB_USER'], password=db_env['DB_PASSWORD'],
+                         host=db_env['DB_HOST'], port=db_env['DB_PORT']) as conn:
+        try:
+            return conn.execute(query).fetchone()[0]
+        except psycopg.errors.UndefinedTable:
+            return 0
+
+
+def run_stage(name, script, workdir, env, args=()):
+    print(f"running {name} ...", flush=True)
+    started = time.monotonic()
+    result = subprocess.run([sys.executable, os.path.join(SRC_DIR, script), *args], cwd=workdir, env=env)
+    elapsed = time.monotonic() - started
+    if result.returncode:
+        print(f"{name} exited with {result.returncode}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the crawler -> save_url -> parser pipeline against local mocks")
+    parser.add_argument('--domains', type=int, default=10, help="number of fake news sites")
+    parser.add_argument('--urls-per-index', type=int, default=200, help="CDX records per site per index")
+    parser.add_argument('--overlap', type=float, default=0.5, help="share of URLs repeated between consecutive indexes")
+    parser.add_argument('--cdx-latency', type=float, default=200, help="mean CDX response delay in ms")
+    parser.add_argument('--cdx-429-rate', type=float, default=0.0, help="share of CDX requests answered with 429")
+    parser.add_argument('--site-latency', type=float, default=20, help="mean article response delay in ms")
+    parser.add_argument('--duplicate-rate', type=float, default=0.05, help="share of articles copying another's body")
+    parser.add_argument('--keep', action='store_true', help="keep the scratch directory and database")
+    options = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    counters = Counters()
+
+    # One server per site, the crawler matches URLs to a domain by host:port
+    site_ports = {}
+    servers = []
+    for _ in range(options.domains):
+        port = free_port()
+        site_ports[f"127.0.0.1:{port}"] = port
+        servers.append(serve(make_site_handler(options, counters), port))
+    cdx_port = free_port()
+    servers.append(serve(make_cdx_handler(options, site_ports, counters), cdx_port))
+
+    domains_dir = os.path.join(workdir, 'assets', 'newmediadomains')
+    os.makedirs(domains_dir)
+    os.makedirs(os.path.join(workdir, 'assets', 'generalcralwerurl'))
+    for number, host in enumerate(site_ports):
+        with open(os.path.join(domains_dir, f"site{number}.json"), 'w', encoding='utf-8') as f:
+            json.dump({'domain': host, 'URL_paths': [], 'total_lines': 0,
+                       'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, f)
+
+    db_env, data_dir = start_postgres(workdir)
+    env = {
+        **os.environ,
+        **db_env,
+        'CC_INDEX_SERVER': f"http://127.0.0.1:{cdx_port}/",
+        'CRAWLER_DELAY_SCALE': '0',
+        'ASSETS_MEDIA_DOMAINS_DIR': domains_dir,
+        'ASSETS_GENERAL_CRAWLER_DIR': os.path.join(workdir, 'assets', 'generalcralwerurl'),
+        'WARC_DIR': os.path.join(workdir, 'warc'),
+        'CRAWLER_METRICS_PORT': '0',
+        'PARSER_METRICS_PORT': '0',
+    }
+
+    try:
+        # save_url owns the url_registry DDL, the crawler only inserts
+        run_stage('schema', 'save_url.py', workdir, {**env, 'ASSETS_MEDIA_DOMAINS_DIR': os.path.join(workdir, 'none')})
+
+        timings = {}
+        timings['crawler'] = run_stage('crawler', 'crawler.py', workdir, env)
+        registered_after_crawl = count_rows(db_env, "SELECT count(*) FROM url_registry")
+        timings['save_url'] = run_stage('save_url', 'save_url.py', workdir, env)
+        registered = count_rows(db_env, "SELECT count(*) FROM url_registry")
+        timings['parser'] = run_stage('parser', 'parser.py', workdir, env)
+        parsed = count_rows(db_env, "SELECT count(*) FROM url_parsed_content")
+        duplicates = count_rows(db_env, "SELECT count(*) FROM url_parsed_content WHERE duplicateOf IS NOT NULL")
+        failed = count_rows(db_env, "SELECT count(*) FROM url_registry WHERE status = 'fail'")
+
+        print()
+        print(f"mock traffic: {counters.values}")
+        print(f"{'stage':<10} {'seconds':>9} {'items':>9} {'items/s':>9}")
+        for stage, items in (('crawler', registered_after_crawl), ('save_url', registered), ('parser', parsed)):
+            print(f"{stage:<10} {timings[stage]:>9.1f} {items:>9} {items / timings[stage] if timings[stage] else 0:>9.1f}")
+        total = sum(timings.values())
+        print(f"{'pipeline':<10} {total:>9.1f} {parsed:>9} {parsed / total if total else 0:>9.1f}")
+        print(f"{duplicates} near-duplicates linked, {failed} URLs failed")
+    finally:
+        for server in servers:
+            server.shutdown()
+        if options.keep:
+            print(f"scratch directory kept at {workdir}, database still running on port {db_env['DB_PORT']}")
+        else:
+            stop_postgres(data_dir)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+# One shared setup for every module: records go onto a queue and a
+# background thread formats them as JSON lines and writes the file
+LOG_FILE = os.getenv('LOG_FILE', 'database.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+# Share of per-URL events (logged with extra=SAMPLED) that are kept
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.01))
+
+# Pass as extra= on per-URL debug/info events to have them sampled
+SAMPLED = {'sampled': True}
+
+# LogRecord attributes that are not user-supplied extra fields
+RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sampled'}
+
+listener = None
+log_queue = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; extra= fields are kept as keys."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Enqueue the record untouched.
+
+    The stock QueueHandler merges msg and args before enqueueing, which
+    puts the string formatting back on the caller's thread. Listener and
+    callers share a process, so the record can cross the queue as is.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Keep LOG_SAMPLE_RATE of the records marked sampled, warnings and up always pass."""
+
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, 'sampled', False) and record.levelno < logging.WARNING:
+            return random.random() < self.rate
+        return True
+
+
+def _start_listener(filename, console):
+    global listener, log_queue
+    log_queue = queue.SimpleQueue()
+
+    formatter = JsonFormatter()
+    handlers = [logging.FileHandler(filename, mode='a', encoding='utf-8')]
+    if console:
+        handlers.append(logging.StreamHandler(sys.stderr))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=False)
+    listener.start()
+
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+
+def stop_logging():
+    """Drain the queue and stop the writer thread."""
+    global listener
+    if listener:
+        listener.stop()
+        listener = None
+
+
+def setup_logging(filename=LOG_FILE, console=False, force=False):
+    """
+    Route all logging through the queue to a JSON lines file.
+
+    Safe to call from every module: only the first call configures logging
+    unless force is set, e.g. by an entry point that logs to its own file.
+    """
+    if listener and not force:
+        return
+    stop_logging()
+    _start_listener(filename, console)
+    setup_logging.config = (filename, console)
+
+
+def _restart_in_child():
+    # A forked worker inherits the queue handler but not the writer thread
+    if listener:
+        _start_listener(*setup_logging.config)
+
+
+atexit.register(stop_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_in_child)
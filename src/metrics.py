@@ -0,0 +1,101 @@
+import os
+import logging
+from urllib.parse import urlparse
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+# Local /metrics endpoints, set a port to 0 to disable it
+METRICS_ADDR = os.getenv('METRICS_ADDR', '127.0.0.1')
+CRAWLER_METRICS_PORT = int(os.getenv('CRAWLER_METRICS_PORT', 9101))
+PARSER_METRICS_PORT = int(os.getenv('PARSER_METRICS_PORT', 9102))
+
+# Every metric has a component label, 'crawler' or 'parser'
+HTTP_REQUESTS = Counter(
+    'scraper_http_requests_total',
+    'HTTP requests by host and status code, or fetch outcome when no response came back',
+    ['component', 'host', 'status'],
+)
+HTTP_BYTES = Counter(
+    'scraper_http_response_bytes_total',
+    'Response body bytes downloaded',
+    ['component', 'host'],
+)
+FETCH_DURATION = Histogram(
+    'scraper_fetch_duration_seconds',
+    'Time from sending a request to having the full body',
+    ['component'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+PARSE_DURATION = Histogram(
+    'scraper_parse_duration_seconds',
+    'Time spent extracting metadata from one page',
+    ['component'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+DB_FLUSH_DURATION = Histogram(
+    'scraper_db_flush_duration_seconds',
+    'Time to write one batch to the database',
+    ['component'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+RESPONSES_SKIPPED = Counter(
+    'scraper_responses_skipped_total',
+    'Responses dropped after the headers because they are not HTML or too large',
+    ['component', 'host', 'outcome'],
+)
+RESPONSES_TRUNCATED = Counter(
+    'scraper_responses_truncated_total',
+    'Response bodies cut off at the size cap',
+    ['component', 'host'],
+)
+CONNECTIONS_OPENED = Counter(
+    'scraper_connections_opened_total',
+    'New TCP connections, each one a request that could not reuse a keep-alive connection',
+    ['component', 'host'],
+)
+DNS_LOOKUPS = Counter(
+    'scraper_dns_lookups_total',
+    'Host name resolutions by whether the DNS cache answered',
+    ['component', 'result'],
+)
+QUEUE_DEPTH = Gauge(
+    'scraper_queue_depth',
+    'Work items still waiting in the current run',
+    ['component'],
+)
+URLS_INSERTED = Counter(
+    'scraper_urls_inserted_total',
+    'URLs (crawler) or articles (parser) written for the first time',
+    ['component'],
+)
+URLS_DUPLICATE = Counter(
+    'scraper_urls_duplicate_total',
+    'URLs already registered (crawler) or near-duplicate articles (parser)',
+    ['component'],
+)
+
+
+def start_metrics_server(port):
+    """Serve /metrics on METRICS_ADDR:port in a background thread."""
+    if not port:
+        return
+    try:
+        start_http_server(port, addr=METRICS_ADDR)
+        logger.info(f"Metrics served on http://{METRICS_ADDR}:{port}/metrics")
+    except OSError as e:
+        logger.error(f"Could not start metrics endpoint on port {port}: {e}")
+
+
+def observe_response(component, url, status, size, elapsed):
+    """Record one HTTP response."""
+    host = urlparse(url).netloc
+    HTTP_REQUESTS.labels(component, host, str(status)).inc()
+    HTTP_BYTES.labels(component, host).inc(size)
+    FETCH_DURATION.labels(component).observe(elapsed)
+
+
+def observe_failure(component, url, outcome, elapsed):
+    """Record a request that failed without a response, labelled with its FetchOutcome."""
+    HTTP_REQUESTS.labels(component, urlparse(url).netloc, outcome.value).inc()
+    FETCH_DURATION.labels(component).observe(elapsed)
@@ -7,17 +7,64 @@ import re
 import os
 import asyncio
 import html
+import hashlib
 import logging
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from requests.utils import get_encoding_from_headers
+from log_setup import SAMPLED, setup_logging
 from database import get_connection, return_connection, close_all_connections
-
-logging.basicConfig(
-    filename='database.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
+from warc_archive import WARC_HOST, WarcWriter, read_record, fetch_remote_record
+from dedup import create_table as create_dedup_table, simhash, bands, to_signed, closest_match, find_duplicate
+from dates import create_table as create_dates_table, normalize_published_date, extract_date_from_url
+from search import create_table as create_search_table, search_vector
+from stats import create_table as create_stats_table
+from write_behind import FlushError, WriteBehindBuffer
+from http_pool import HostSessions
+from scheduler import claim_quotas, domain_success_rates, schedule
+from heuristic_profile import PROFILE_HEURISTICS, create_table as create_profile_table, profile, run_methods, save_profile
+from fetch_outcome import FetchOutcome, MAX_ATTEMPTS, classify_status, classify_exception, retry_after_seconds, next_attempt_at
+from metrics import (
+    PARSER_METRICS_PORT,
+    PARSE_DURATION,
+    QUEUE_DEPTH,
+    RESPONSES_SKIPPED,
+    RESPONSES_TRUNCATED,
+    URLS_DUPLICATE,
+    URLS_INSERTED,
+    observe_failure,
+    observe_response,
+    start_metrics_server,
 )
+from psycopg.rows import dict_row
+
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# Archive raw responses so the extraction can be re-run without fetching again
+WARC_ARCHIVE = os.getenv('WARC_ARCHIVE', '1') != '0'
+REPARSE_CHUNK_SIZE = 200
+
+# Pending URLs are claimed in batches of about this many, split over domains
+# by success rate; a claim holds them for CLAIM_LEASE_SECONDS, after which a
+# crashed run's batch is handed out again
+CLAIM_BATCH_SIZE = int(os.getenv('PARSER_CLAIM_BATCH_SIZE', 1000))
+CLAIM_LEASE_SECONDS = int(os.getenv('PARSER_CLAIM_LEASE_SECONDS', 3600))
+
+# Decoded bodies are cut off past this size; article text sits near the top
+# and the rest of a huge page is mostly scripts and listings
+MAX_BODY_BYTES = int(os.getenv('FETCH_MAX_BYTES', 5 * 1024 * 1024))
+STREAM_CHUNK_SIZE = 64 * 1024
+# Unwanted bodies (304s, error pages) up to this size are read and dropped so
+# the keep-alive connection goes back to the pool; larger ones close it
+DRAIN_MAX_BYTES = 64 * 1024
+# Responses of any other type (images, PDFs, feeds) are dropped after the headers
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+# Keep-alive sessions per site, see http_pool.py
+host_sessions = HostSessions('parser')
+
 async def create_table(conn):
    
     try:
@@ -43,6 +90,33 @@ async def create_table(conn):
                    
                 );
                 
+                CREATE TABLE IF NOT EXISTS url_fetch_validators (
+                    urlID TEXT PRIMARY KEY,
+                    etag TEXT,
+                    lastModified TEXT,
+                    contentHash TEXT,
+                    lastFetched TIMESTAMP NOT NULL,
+                    FOREIGN KEY (urlID) REFERENCES url_registry(urlID) ON DELETE CASCADE
+                );
+                
+                CREATE TABLE IF NOT EXISTS url_warc_index (
+                    urlID TEXT PRIMARY KEY,
+                    warcFile TEXT NOT NULL,
+                    recordOffset BIGINT NOT NULL,
+                    recordLength BIGINT NOT NULL,
+                    archivedAt TIMESTAMP NOT NULL,
+                    FOREIGN KEY (urlID) REFERENCES url_registry(urlID) ON DELETE CASCADE
+                );
+                
+                -- Retry schedule for failed fetches
+                ALTER TABLE url_registry ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+                ALTER TABLE url_registry ADD COLUMN IF NOT EXISTS nextAttemptAt TIMESTAMPTZ;
+                ALTER TABLE url_registry ADD COLUMN IF NOT EXISTS lastOutcome TEXT;
+                
+                -- Start of the transaction that last wrote the row, the export's
+                -- commit-ordered watermark (rows from before this column get the
+                -- time it was added)
+                ALTER TABLE url_parsed_content ADD COLUMN IF NOT EXISTS writtenAt TIMESTAMPTZ NOT NULL DEFAULT now();
                 
             """)
         
@@ -53,21 +127,31 @@ async def create_table(conn):
         logger.error(f"Error creating table: {e}")
         
         
-async def fetch_urls(conn):
+async def fetch_urls(conn, refresh=False):
+    """
+    Fetch the URLs to process along with any stored validators.
+
+    A normal pass takes the pending URLs whose retry time has passed; a
+    refresh pass revisits the URLs that were already parsed so they can be
+    re-fetched conditionally. Rows are dicts keyed by lower-case column name,
+    in the order the scheduler picked (fresh pages first, domains in turn).
+    """
+    status = 'success' if refresh else 'pending'
     try:
-        async with conn.cursor() as cursor:
+        async with conn.cursor(row_factory=dict_row) as cursor:
             await cursor.execute("""
-                SELECT urlID, urlPath
-                FROM url_registry
-                WHERE status ='pending'
-                ORDER BY RANDOM()
-             
-;""")
+                SELECT r.urlID, r.urlPath, r.domain, r.status, r.attempts, v.etag, v.lastModified, v.contentHash,
+                       r.warcFilename, r.warcOffset, r.warcLength, r.captureTimestamp, r.urlDate
+                FROM url_registry r
+                LEFT JOIN url_fetch_validators v ON v.urlID = r.urlID
+                WHERE r.status = %s
+                  AND (r.nextAttemptAt IS NULL OR r.nextAttemptAt <= now())
+;""", (status,))
                 
 
             urls = await cursor.fetchall()
             # logger.info(f"The url is fetched:{urls}")
-            return urls
+            return schedule(urls, await domain_success_rates(conn))
           
             
             
@@ -78,6 +162,63 @@ async def fetch_urls(conn):
         
                                       
     
+async def claim_pending_urls(conn, batch_size=CLAIM_BATCH_SIZE, lease=CLAIM_LEASE_SECONDS):
+    """
+    Claim the next batch of pending URLs, the scheduler's picks first.
+
+    Each domain's share of the batch follows its success rate
+    (claim_quotas) and within a domain the freshest URLs, by URL date else
+    capture time, are taken; the batch is what the scheduler would rank
+    highest, not a reordering of an arbitrary slice. Claiming pushes
+    nextAttemptAt out by the lease and commits, so parsers running side by
+    side never get the same URLs; SKIP LOCKED passes over rows another
+    claim is taking. Every per-domain probe is a scan of the
+    url_registry_pending_recency partial index and the domain list comes
+    from crawl_stats, so a claim does not slow down as url_registry grows.
+    Rows come back scheduled, like fetch_urls.
+    """
+    try:
+        success_rates = await domain_success_rates(conn)
+        async with conn.cursor(row_factory=dict_row) as cursor:
+            await cursor.execute("SELECT domain FROM crawl_stats WHERE status = 'pending' AND urls > 0")
+            domains = [row['domain'] for row in await cursor.fetchall()]
+            quotas = claim_quotas(domains, success_rates, batch_size)
+
+            await cursor.execute("""
+                WITH picked AS (
+                    SELECT p.urlID
+                    FROM unnest(%(domains)s::text[], %(quotas)s::int[]) AS d(domain, quota)
+                    CROSS JOIN LATERAL (
+                        SELECT urlID FROM url_registry
+                        WHERE domain = d.domain
+                          AND status = 'pending'
+                          AND (nextAttemptAt IS NULL OR nextAttemptAt <= now())
+                        ORDER BY COALESCE(urlDate, captureTimestamp) DESC NULLS LAST
+                        LIMIT d.quota
+                        FOR UPDATE SKIP LOCKED
+                    ) p
+                ),
+                claimed AS (
+                    UPDATE url_registry r
+                    SET nextAttemptAt = now() + make_interval(secs => %(lease)s)
+                    FROM picked
+                    WHERE r.urlID = picked.urlID
+                    RETURNING r.urlID, r.urlPath, r.domain, r.status, r.attempts,
+                              r.warcFilename, r.warcOffset, r.warcLength, r.captureTimestamp, r.urlDate
+                )
+                SELECT c.*, v.etag, v.lastModified, v.contentHash
+                FROM claimed c
+                LEFT JOIN url_fetch_validators v ON v.urlID = c.urlID
+            """, {'domains': list(quotas), 'quotas': list(quotas.values()), 'lease': lease})
+            urls = await cursor.fetchall()
+        await conn.commit()
+        return schedule(urls, success_rates)
+    except Exception as e:
+        await conn.rollback()
+        logger.error(f"Error claiming urls: {e}")
+        return []
+
+
 def get_user_agent():
     return "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 
@@ -152,235 +293,228 @@ def get_article_content(soup):
 
     return None
 
-def detect_category(soup, url):
-    """Detect the category of an article using multiple methods."""
-    from urllib.parse import urlparse
-    import json
-    import re
+COMMON_CATEGORIES = [ 'international','sports', 'sport', 'politics', 'video', 'entertainment', 'business',
+                     'technology', 'tech', 'health', 'science', 'travel', 'food', 'lifestyle',
+                     'opinion', 'education', 'culture', 'finance', 'world', 'national',
+                     'local', 'weather', 'environment', 'economy', 'real-estate', 'fashion',
+                     'music', 'movies', 'television', 'tv', 'books', 'art', 'celebrity', 'art-literature',
+                     'editorial', 'election-updates', 'society', 'kinmel', 'nepali-brand', 'cover-story', 'news',]
+
+CATEGORY_META_TAGS = [
+    ('property', 'article:section'),
+    ('name', 'category'),
+    ('name', 'article:section'),
+    ('name', 'sailthru.verticals'),
+    ('name', 'parsely-section'),
+    ('name', 'article-section'),
+    ('property', 'og:section'),
+    ('name', 'section'),
+    ('name', 'article:tag')
+]
+
+COMMON_CATEGORY_CLASSES = [
+    ".cat_name",
+      ".context",
+    ".card__category",
+    ".cat-tag",
+    ".catline",
+    ".breadcrumb-item.active",
+    ".breadcrumb-item",
+    ".uk-light.npdate-top.uk-margin-remove.uk-h4.uk-position-relative",
+    ".menu-item.menu-item-type-taxonomy.menu-item-object-category.current-post-ancestor.current-menu-parent.current-post-parent",
+    ".border-start.ps-3.ms-3",
+    ".active",
+    ".category-list",
+    ".thecategory",
+  ".btn.btn-underline.mb-4.pl-0",
+    ".cat-name",
+    ".no-tag-title",
+    ".cat-links",
+
+    ".sub-category",
+    ".badge.badge-primary",
+    ".current-post-parent",
+    ".items.half-more-news.category-news-list.col-12",
+    ".nav-item.active",
+    ".new_category",
+    ".badge.badge-light.badge-category",
+    ".entry-category",
+    ".current-post-ancestor.current-menu-parent.current-post-parent.menu-item-has-children",
+    ".current-post-ancestor.current-menu-parent.current-post-parent",
+    ".breadcrumb__menu--wrapper.uk-flex.uk-flex-wrap",
+    ".cat-p.text-decoration-none",
+    ".category.tag",
+    ".cat_matra",
+    ".single_post_category",
+    ".current-menu-items"
+]
+
+def category_from_meta_tags(soup, url):
+    """Look for category in meta tags"""
+    meta_categories = []
+    for attr, value in CATEGORY_META_TAGS:
+        # Find all matching meta tags (not just the first one)
+        meta_sections = soup.find_all('meta', {attr: value})
+        for meta_section in meta_sections:
+            if meta_section and meta_section.get('content'):
+                meta_categories.append(meta_section['content'].lower())
+
+    return meta_categories or None
+
+def category_from_json_ld(soup, url):
+    """Extract from JSON-LD metadata"""
+    article_sections = []
+    scripts = soup.find_all('script', {"type": "application/ld+json"})
+
+    for script in scripts:
+        try:
+            data = json.loads(script.string)
 
-    # Initialize category
-    category = None
+            if isinstance(data, list):
+                for item in data:
+                    if "articleSection" in item:
+                        article_sections.append(item["articleSection"])
+            elif "articleSection" in data:
+                article_sections.append(data["articleSection"])
+        except (json.JSONDecodeError, TypeError):
+            continue
 
-     # Method 4: Look for category in meta tags
-    if not category:
-          meta_categories = []
-          meta_tags_to_check = [
-              ('property', 'article:section'),
-              ('name', 'category'),
-              ('name', 'article:section'),
-              ('name', 'sailthru.verticals'),
-              ('name', 'parsely-section'),
-              ('name', 'article-section'),
-              ('property', 'og:section'),
-              ('name', 'section'),
-              ('name', 'article:tag')
-          ]
-
-          for attr, value in meta_tags_to_check:
-              # Find all matching meta tags (not just the first one)
-              meta_sections = soup.find_all('meta', {attr: value})
-              for meta_section in meta_sections:
-                  if meta_section and meta_section.get('content'):
-                      meta_categories.append(meta_section['content'].lower())
-
-          # Use the first category found if any were found
-          category = meta_categories
+    return article_sections or None
 
-    if not category:
-      # Method 1: Extract from JSON-LD metadata
-      article_sections = []
-      scripts = soup.find_all('script', {"type": "application/ld+json"})
-
-      for script in scripts:
-          try:
-              data = json.loads(script.string)
-
-              if isinstance(data, list):
-                  for item in data:
-                      if "articleSection" in item:
-                          article_sections.append(item["articleSection"])
-              elif "articleSection" in data:
-                  article_sections.append(data["articleSection"])
-          except (json.JSONDecodeError, TypeError):
-              continue
-
-      if article_sections:
-          category = article_sections
-
-    # Method 2: Extract from HTML elements with category classes
-    if not category:
-        common_category_classes = [
-            ".cat_name",
-              ".context",
-            ".card__category",
-            ".cat-tag",
-            ".catline",
-            ".breadcrumb-item.active",
-            ".breadcrumb-item",
-            ".uk-light.npdate-top.uk-margin-remove.uk-h4.uk-position-relative",
-            ".menu-item.menu-item-type-taxonomy.menu-item-object-category.current-post-ancestor.current-menu-parent.current-post-parent",
-            ".border-start.ps-3.ms-3",
-            ".active",
-            ".category-list",
-            ".thecategory",
-          ".btn.btn-underline.mb-4.pl-0",
-            ".cat-name",
-            ".no-tag-title",
-            ".cat-links",
-
-            ".sub-category",
-            ".badge.badge-primary",
-            ".current-post-parent",
-            ".items.half-more-news.category-news-list.col-12",
-            ".nav-item.active",
-            ".new_category",
-            ".badge.badge-light.badge-category",
-            ".entry-category",
-            ".current-post-ancestor.current-menu-parent.current-post-parent.menu-item-has-children",
-            ".current-post-ancestor.current-menu-parent.current-post-parent",
-            ".breadcrumb__menu--wrapper.uk-flex.uk-flex-wrap",
-            ".cat-p.text-decoration-none",
-            ".category.tag",
-            ".cat_matra",
-            ".single_post_category",
-            ".current-menu-items"
-        ]
-
-        for category_class in common_category_classes:
-            category_element = soup.select_one(category_class)
-            if category_element:
-                category = category_element.text.strip().lower()
-                break
-
-    # Method 3: Check URL path for category indicators
-    if not category:
-        path = urlparse(url).path.strip('/').split('/')
-        common_categories = [ 'international','sports', 'sport', 'politics', 'video', 'entertainment', 'business',
-                             'technology', 'tech', 'health', 'science', 'travel', 'food', 'lifestyle',
-                             'opinion', 'education', 'culture', 'finance', 'world', 'national',
-                             'local', 'weather', 'environment', 'economy', 'real-estate', 'fashion',
-                             'music', 'movies', 'television', 'tv', 'books', 'art', 'celebrity', 'art-literature',
-                             'editorial', 'election-updates', 'society', 'kinmel', 'nepali-brand', 'cover-story', 'news',]
+def category_from_classes(soup, url):
+    """Extract from HTML elements with category classes"""
+    for category_class in COMMON_CATEGORY_CLASSES:
+        category_element = soup.select_one(category_class)
+        if category_element:
+            # An empty match still ends this method, as it always has
+            return category_element.text.strip().lower() or None
+    return None
 
-        for segment in path:
-            if segment.lower() in common_categories:
-                category = segment.lower()
-                break
+def category_from_url_path(soup, url):
+    """Check URL path for category indicators"""
+    path = urlparse(url).path.strip('/').split('/')
+    for segment in path:
+        if segment.lower() in COMMON_CATEGORIES:
+            return segment.lower()
+    return None
 
+def category_from_breadcrumbs(soup, url):
+    """Look for breadcrumbs"""
+    breadcrumb_indicators = ['breadcrumb', 'breadcrumbs', 'path', 'navigation', 'crumbs']
 
-    # Method 5: Look for breadcrumbs
-    if not category:
-        breadcrumb_indicators = ['breadcrumb', 'breadcrumbs', 'path', 'navigation', 'crumbs']
+    breadcrumbs = None
+    for indicator in breadcrumb_indicators:
+        breadcrumbs = (
+            soup.find('ul', class_=lambda x: x and (indicator in x.lower())) or
+            soup.find('nav', class_=lambda x: x and (indicator in x.lower())) or
+            soup.find('div', class_=lambda x: x and (indicator in x.lower())) or
+            soup.find('ol', class_=lambda x: x and (indicator in x.lower()))
+        )
+
+        if breadcrumbs:
+            break
+
+    if breadcrumbs:
+        list_items = breadcrumbs.find_all('li') or breadcrumbs.find_all('a')
+        if list_items and len(list_items) > 1:
+            # Usually the second item in breadcrumbs is the category
+            category_text = list_items[1].get_text().strip().lower()
+            for cat in COMMON_CATEGORIES:
+                if cat in category_text:
+                    return cat
+            # Clean the text to use as category
+            category_text = re.sub(r'[^a-z0-9-]', '-', category_text)
+            category_text = re.sub(r'-+', '-', category_text).strip('-')
+            if category_text:
+                return category_text
+    return None
 
-        breadcrumbs = None
-        for indicator in breadcrumb_indicators:
-            breadcrumbs = (
-                soup.find('ul', class_=lambda x: x and (indicator in x.lower())) or
-                soup.find('nav', class_=lambda x: x and (indicator in x.lower())) or
-                soup.find('div', class_=lambda x: x and (indicator in x.lower())) or
-                soup.find('ol', class_=lambda x: x and (indicator in x.lower()))
-            )
+def category_from_divs(soup, url):
+    """Look for category in specific div elements"""
+    category_indicators = ['category', 'tag', 'topic', 'section']
+    for indicator in category_indicators:
+        category_div = soup.find('div', class_=lambda x: x and (indicator in x.lower()))
+        if category_div:
+            category_text = category_div.get_text().strip().lower()
+            for cat in COMMON_CATEGORIES:
+                if cat in category_text:
+                    return cat
+    return None
 
-            if breadcrumbs:
-                break
+def category_from_tag_links(soup, url):
+    """Look for tags that might indicate category"""
+    tag_containers = ['tags', 'tag-list', 'topics', 'categories']
+    for container in tag_containers:
+        tags_div = soup.find('div', class_=lambda x: x and (container in x.lower()))
+        if tags_div and tags_div.find_all('a'):
+            for tag in tags_div.find_all('a'):
+                tag_text = tag.get_text().strip().lower()
+                for cat in COMMON_CATEGORIES:
+                    if cat == tag_text:
+                        return cat
+    return None
 
-        if breadcrumbs:
-            list_items = breadcrumbs.find_all('li') or breadcrumbs.find_all('a')
-            if list_items and len(list_items) > 1:
-                # Usually the second item in breadcrumbs is the category
-                category_text = list_items[1].get_text().strip().lower()
-                for cat in common_categories:
-                    if cat in category_text:
-                        category = cat
-                        break
-                if not category:
-                    # Clean the text to use as category
-                    category_text = re.sub(r'[^a-z0-9-]', '-', category_text)
-                    category_text = re.sub(r'-+', '-', category_text).strip('-')
-                    if category_text:
-                        category = category_text
-
-    # Method 6: Look for category in specific div elements
-    if not category:
-        category_indicators = ['category', 'tag', 'topic', 'section']
-        for indicator in category_indicators:
-            category_div = soup.find('div', class_=lambda x: x and (indicator in x.lower()))
-            if category_div:
-                category_text = category_div.get_text().strip().lower()
-                for cat in common_categories:
-                    if cat in category_text:
-                        category = cat
-                        break
-                if category:
-                    break
-
-    # Method 7: Look for tags that might indicate category
-    if not category:
-        tag_containers = ['tags', 'tag-list', 'topics', 'categories']
-        for container in tag_containers:
-            tags_div = soup.find('div', class_=lambda x: x and (container in x.lower()))
-            if tags_div and tags_div.find_all('a'):
-                for tag in tags_div.find_all('a'):
-                    tag_text = tag.get_text().strip().lower()
-                    for cat in common_categories:
-                        if cat == tag_text:
-                            category = cat
-                            break
-                    if category:
-                        break
-            if category:
-                break
-
-   # Method 8: Look for elements with data-category attribute or similar data attributes
-    if not category:
-        # Find any element with data-category attribute
-        elements_with_data_category = soup.find_all(attrs={"data-category": True})
-        for element in elements_with_data_category:
+def category_from_data_attributes(soup, url):
+    """Look for elements with data-category attribute or similar data attributes"""
+    # Find any element with data-category attribute
+    elements_with_data_category = soup.find_all(attrs={"data-category": True})
+    for element in elements_with_data_category:
+        if element.get('data-category'):
+            return element['data-category'].lower()
+
+    # If still no category, check for data-cat-slug attribute
+    elements_with_data_cat_slug = soup.find_all(attrs={"data-cat-slug": True})
+    for element in elements_with_data_cat_slug:
+        if element.get('data-cat-slug'):
+            return element['data-cat-slug'].lower()
+
+    # Also check specific elements that commonly have these attributes
+    category_id_elements = [
+        soup.find('div', id='ga-data'),
+        soup.find('div', class_='ga-data'),
+        soup.find('article'),
+        soup.find('main')
+    ]
+
+    for element in category_id_elements:
+        if element:
+           # Try data-category attribute
             if element.get('data-category'):
-                category = element['data-category'].lower()
-                break
-
-        # If still no category, check for data-cat-slug attribute
-        if not category:
-            elements_with_data_cat_slug = soup.find_all(attrs={"data-cat-slug": True})
-            for element in elements_with_data_cat_slug:
-                if element.get('data-cat-slug'):
-                    category = element['data-cat-slug'].lower()
-                    break
-
-        # Also check specific elements that commonly have these attributes
-        if not category:
-            category_id_elements = [
-                soup.find('div', id='ga-data'),
-                soup.find('div', class_='ga-data'),
-                soup.find('article'),
-                soup.find('main')
-            ]
-
-            for element in category_id_elements:
-                if element:
-                   # Try data-category attribute
-                    if element.get('data-category'):
-                        category = element['data-category'].lower()
-                        break
-                    # Try data-cat-slug attribute
-                    elif element.get('data-cat-slug'):
-                        category = element['data-cat-slug'].lower()
-                        break
-                    # Try data-section attribute
-                    elif element.get('data-section'):
-                        category = element['data-section'].lower()
-                        break
-
-    # Method 9: If still no category, try to extract from canonical URL
-    if not category:
-        canonical = soup.find('link', {'rel': 'canonical'})
-        if canonical and canonical.get('href'):
-            canon_path = urlparse(canonical['href']).path.strip('/').split('/')
-            for segment in canon_path:
-                if segment.lower() in common_categories:
-                    category = segment.lower()
-                    break
+                return element['data-category'].lower()
+            # Try data-cat-slug attribute
+            elif element.get('data-cat-slug'):
+                return element['data-cat-slug'].lower()
+            # Try data-section attribute
+            elif element.get('data-section'):
+                return element['data-section'].lower()
+    return None
+
+def category_from_canonical_url(soup, url):
+    """If still no category, try to extract from canonical URL"""
+    canonical = soup.find('link', {'rel': 'canonical'})
+    if canonical and canonical.get('href'):
+        canon_path = urlparse(canonical['href']).path.strip('/').split('/')
+        for segment in canon_path:
+            if segment.lower() in COMMON_CATEGORIES:
+                return segment.lower()
+    return None
+
+# Tried in this order, the first method to return something other than None wins
+CATEGORY_METHODS = [
+    ('meta_tags', category_from_meta_tags),
+    ('json_ld', category_from_json_ld),
+    ('classes', category_from_classes),
+    ('url_path', category_from_url_path),
+    ('breadcrumbs', category_from_breadcrumbs),
+    ('divs', category_from_divs),
+    ('tag_links', category_from_tag_links),
+    ('data_attributes', category_from_data_attributes),
+    ('canonical_url', category_from_canonical_url),
+]
+
+def detect_category(soup, url):
+    """Detect the category of an article using multiple methods."""
+    category = run_methods('category', CATEGORY_METHODS, soup, url)
 
     # Default category if none found
     if not category:
@@ -388,52 +522,61 @@ def detect_category(soup, url):
 
     return category
 
-def extract_publication_date(soup, url):
-    """
-    Extract publication date from webpage using multiple methods
-
-    Args:
-        soup: BeautifulSoup object
-        url: URL of the webpage
-
-    Returns:
-        str: Publication date if found, None otherwise
-    """
-    # Method 1: Extract from JSON-LD structured data (most reliable)
-    json_ld_date = extract_from_json_ld(soup)
-    if json_ld_date:
-        return json_ld_date
-
-    # Method 2: Extract from meta tags (comprehensive list)
-    date_meta_tags = [
-        ('property', 'article:published_time'),
-        ('name', 'publication_date'),
-        ('name', 'date'),
-        ('property', 'og:published_time'),
-        ('name', 'pubdate'),
-        ('itemprop', 'datePublished'),
-        ('name', 'publish-date'),
-        ('name', 'article:published_time'),
-        ('property', 'article:publishedTime'),
-        ('name', 'PublishDate'),
-        ('name', 'publishdate'),
-        ('property', 'og:pubDate'),
-        ('name', 'creation-date'),
-        ('name', 'DC.date.issued'),
-        ('name', 'DCSext.articleFirstPublished'),
-        ('property', 'datePublished'),
-        ('itemprop', 'dateCreated'),
-        ('http-equiv', 'date'),
-        ('name', 'sailthru.date'),
-        ('property', 'og:article:published_time')
-    ]
-
-    for attr, value in date_meta_tags:
+DATE_META_TAGS = [
+    ('property', 'article:published_time'),
+    ('name', 'publication_date'),
+    ('name', 'date'),
+    ('property', 'og:published_time'),
+    ('name', 'pubdate'),
+    ('itemprop', 'datePublished'),
+    ('name', 'publish-date'),
+    ('name', 'article:published_time'),
+    ('property', 'article:publishedTime'),
+    ('name', 'PublishDate'),
+    ('name', 'publishdate'),
+    ('property', 'og:pubDate'),
+    ('name', 'creation-date'),
+    ('name', 'DC.date.issued'),
+    ('name', 'DCSext.articleFirstPublished'),
+    ('property', 'datePublished'),
+    ('itemprop', 'dateCreated'),
+    ('http-equiv', 'date'),
+    ('name', 'sailthru.date'),
+    ('property', 'og:article:published_time')
+]
+
+COMMON_DATE_CLASSES = [
+ '.post-time', '.published-date','.posted-date',  '.date', '.article-date', '.post-date', '.news-date',
+'.entry-date', '.publish-date', '.article-time', '.article__date', '.publishedDate',
+'.news__date', '.story__date', '.story-date', '.article_datetime', '.timeago',
+'.timestamp', '.ArticleTimestamp', '.article-timestamp', '.content-timestamp',
+'.post__date', '.post-timestamp', '.dateline', '.byline-timestamp', '.metadata__date',
+'.top-item-left', '.newstime.m-0.mt-1', '.post-date-grey', '.font-weight-bold',
+'.pub-date', '.designation.alt', '.designation', '.esndt', '.date-line', '.pubed',
+'.post__time', '.posted-on-nepali', '.text-prakashit-list', '.date__time', '.date-np',
+'.sticky-date-np', '.date-time-today', '.today_date',
+'.reporter-details', '.single-author-name pt-3 ml-3', '.pdate', '.HitW',
+'.span-ago-date', '.post-meta', '.today_date_div','.single-published-date',
+  '.post_commentbox'
+
+
+]
+
+DATE_DATA_ATTRS = [
+    'data-date', 'data-publish-date', 'data-published', 'data-post-date',
+    'data-timestamp', 'data-article-date'
+]
+
+def date_from_meta_tags(soup, url):
+    """Extract from meta tags (comprehensive list)"""
+    for attr, value in DATE_META_TAGS:
         date_tag = soup.find('meta', {attr: value})
         if date_tag and date_tag.get('content'):
             return date_tag['content']
+    return None
 
-     # Method 4: Try looking for time elements
+def date_from_time_elements(soup, url):
+    """Try looking for time elements"""
     time_elements = soup.find_all('time')
     for time_elem in time_elements:
         # Check for datetime attribute first
@@ -442,63 +585,60 @@ def extract_publication_date(soup, url):
         # Otherwise use text content
         if time_elem.text.strip():
             return time_elem.text.strip()
+    return None
 
-    # Method 3: Extract from HTML elements with date classes
-    common_date_classes = [
-     '.post-time', '.published-date','.posted-date',  '.date', '.article-date', '.post-date', '.news-date',
-    '.entry-date', '.publish-date', '.article-time', '.article__date', '.publishedDate',
-    '.news__date', '.story__date', '.story-date', '.article_datetime', '.timeago',
-    '.timestamp', '.ArticleTimestamp', '.article-timestamp', '.content-timestamp',
-    '.post__date', '.post-timestamp', '.dateline', '.byline-timestamp', '.metadata__date',
-    '.top-item-left', '.newstime.m-0.mt-1', '.post-date-grey', '.font-weight-bold',
-    '.pub-date', '.designation.alt', '.designation', '.esndt', '.date-line', '.pubed',
-    '.post__time', '.posted-on-nepali', '.text-prakashit-list', '.date__time', '.date-np',
-    '.sticky-date-np', '.date-time-today', '.today_date',
-    '.reporter-details', '.single-author-name pt-3 ml-3', '.pdate', '.HitW',
-    '.span-ago-date', '.post-meta', '.today_date_div','.single-published-date',
-      '.post_commentbox'
-
-
-    ]
-
-    for date_class in common_date_classes:
+def date_from_classes(soup, url):
+    """Extract from HTML elements with date classes"""
+    for date_class in COMMON_DATE_CLASSES:
         date_element = soup.select_one(date_class)
         if date_element:
             return date_element.text.strip()
+    return None
 
-    # Method 4: Try looking for time elements
-    time_elements = soup.find_all('time')
-    for time_elem in time_elements:
-        # Check for datetime attribute first
-        if time_elem.get('datetime'):
-            return time_elem['datetime']
-        # Otherwise use text content
-        if time_elem.text.strip():
-            return time_elem.text.strip()
-
-    # Method 5: Extract from elements with datetime attributes
+def date_from_datetime_attributes(soup, url):
+    """Extract from elements with datetime attributes"""
     elements_with_datetime = soup.find_all(attrs={"datetime": True})
     for element in elements_with_datetime:
         return element['datetime']
+    return None
 
-    # Method 6: Look for data-* attributes related to dates
-    date_data_attrs = [
-        'data-date', 'data-publish-date', 'data-published', 'data-post-date',
-        'data-timestamp', 'data-article-date'
-    ]
-
-    for attr in date_data_attrs:
+def date_from_data_attributes(soup, url):
+    """Look for data-* attributes related to dates"""
+    for attr in DATE_DATA_ATTRS:
         elements = soup.find_all(attrs={attr: True})
 
         if elements:
             return elements[0][attr]
+    return None
 
-    # Method 7: Extract from URL
-    date_from_url = extract_date_from_url(url)
-    if date_from_url:
-        return date_from_url
+def date_from_url(soup, url):
+    """Extract from URL"""
+    return extract_date_from_url(url)
+
+# JSON-LD is the most reliable, the URL the least. Time elements used to be
+# tried a second time after the date classes, that repeat could never match.
+DATE_METHODS = [
+    ('json_ld', lambda soup, url: extract_from_json_ld(soup)),
+    ('meta_tags', date_from_meta_tags),
+    ('time_elements', date_from_time_elements),
+    ('classes', date_from_classes),
+    ('datetime_attributes', date_from_datetime_attributes),
+    ('data_attributes', date_from_data_attributes),
+    ('url', date_from_url),
+]
 
-    return None
+def extract_publication_date(soup, url):
+    """
+    Extract publication date from webpage using multiple methods
+
+    Args:
+        soup: BeautifulSoup object
+        url: URL of the webpage
+
+    Returns:
+        str: Publication date if found, None otherwise
+    """
+    return run_methods('date', DATE_METHODS, soup, url)
 
 
 def extract_from_json_ld(soup):
@@ -557,251 +697,604 @@ def get_date_from_json_object(obj):
     return None
 
 
-def extract_date_from_url(url):
-    """Extract date from URL if it contains date patterns"""
-    # Common date patterns in URLs: YYYY/MM/DD or YYYY-MM-DD
-    date_patterns = [
-        r'(\d{4})[/-](\d{1,2})[/-](\d{1,2})',  # YYYY/MM/DD or YYYY-MM-DD
-        r'(\d{4})(\d{2})(\d{2})'               # YYYYMMDD
-    ]
+def is_html(headers):
+    """True when the Content-Type is HTML, or missing so only the body can tell."""
+    media_type = (headers.get('Content-Type') or headers.get('content-type') or '').split(';', 1)[0].strip().lower()
+    return not media_type or media_type in HTML_CONTENT_TYPES
 
-    for pattern in date_patterns:
-        match = re.search(pattern, url)
-        if match:
-            year, month, day = match.groups()
-            try:
-                # Validate date
-                date_obj = datetime.datetime(int(year), int(month), int(day))
-                # Return ISO format
-                return date_obj.strftime('%Y-%m-%d')
-            except ValueError:
-                continue
-    return None
 
+def content_length(headers):
+    """
+    The declared size of the decoded body, None when it is unknown.
+
+    With a Content-Encoding the Content-Length counts compressed bytes,
+    which says nothing about the decoded size MAX_BODY_BYTES caps, so it
+    is ignored; so is a missing or malformed header.
+    """
+    encoding = (headers.get('Content-Encoding') or headers.get('content-encoding') or '').strip().lower()
+    if encoding and encoding != 'identity':
+        return None
+    value = headers.get('Content-Length') or headers.get('content-length')
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def drain(response, limit=DRAIN_MAX_BYTES):
+    """
+    Read and discard a body that is not wanted.
+
+    requests closes the socket of a streamed response whose body was not
+    consumed, so without this every 304 or error page costs a new
+    connection. Bodies declared or found to be over limit are not worth
+    downloading and their connection is dropped instead.
+    """
+    declared = content_length(response.headers)
+    if declared is not None and declared > limit:
+        return
+    size = 0
+    for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+        size += len(chunk)
+        if size > limit:
+            return
 
-def extract_metadata(url):
+
+def read_capped(response, limit=MAX_BODY_BYTES):
+    """
+    Read a streamed response body, stopping after limit bytes.
+
+    iter_content decompresses as it reads, so the cap applies to the decoded
+    size and a small compressed body can't balloon in memory.
+    Returns (body, truncated).
+    """
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            return b''.join(chunks)[:limit], True
+    return b''.join(chunks), False
+
+
+def extract_metadata(url, validators=None, archive=None, url_id=None):
     """
     Extract metadata from a given URL
+
+    If validators from a previous fetch are given, the request is made
+    conditional. A 304 or an unchanged body returns {"not_modified": True}
+    without parsing the page. If a WarcWriter is given the raw response is
+    archived and its location returned under 'warc'.
+
+    The body is streamed: non-HTML responses and uncompressed ones whose
+    Content-Length is over MAX_BODY_BYTES are rejected once the headers are
+    in, and HTML is read up to MAX_BODY_BYTES decoded bytes. Bodies that are not read are drained so
+    the connection is reused.
     """
     headers = {'User-Agent': get_user_agent()}
 
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    started = time.monotonic()
     try:
-        # Fetch the webpage
-        response = requests.get(url, headers=headers, timeout=30)
+        # Fetch the webpage, downloading the body only when it can hold an article
+        with host_sessions.get(url, headers=headers, timeout=30, stream=True) as response:
+            body, truncated = b'', False
+            declared = content_length(response.headers)
+            too_large = declared is not None and declared > MAX_BODY_BYTES
+            wanted = response.ok and response.status_code not in (204, 304) and is_html(response.headers) and not too_large
+            if wanted:
+                body, truncated = read_capped(response)
+            elif not too_large:
+                drain(response)
+        observe_response('parser', url, response.status_code, len(body), time.monotonic() - started)
+
+        # Server confirmed our copy is current, nothing was downloaded
+        if response.status_code == 304:
+            return {"not_modified": True, "url": url}
+
         response.raise_for_status()
 
-        # Try to determine encoding
-        encoding = response.encoding or 'utf-8-sig'
+        if response.status_code == 204:
+            return {"error": "204 No Content", "url": url, "outcome": FetchOutcome.HTTP_NO_CONTENT}
 
-        # Parse the HTML
-        soup = BeautifulSoup(response.content, 'lxml', from_encoding=encoding)
+        if not is_html(response.headers):
+            RESPONSES_SKIPPED.labels('parser', urlparse(url).netloc, FetchOutcome.NOT_HTML.value).inc()
+            return {"error": f"Not HTML: {response.headers.get('Content-Type')}", "url": url, "outcome": FetchOutcome.NOT_HTML}
 
-        # Get domain for link classification
-        domain = urlparse(url).netloc
+        if too_large:
+            RESPONSES_SKIPPED.labels('parser', urlparse(url).netloc, FetchOutcome.TOO_LARGE.value).inc()
+            return {"error": f"Content-Length {declared} over {MAX_BODY_BYTES} bytes", "url": url, "outcome": FetchOutcome.TOO_LARGE}
 
-        # Detect category
-        category = detect_category(soup, url)
+        if truncated:
+            RESPONSES_TRUNCATED.labels('parser', urlparse(url).netloc).inc()
+            logger.info("Body of %s cut off at %s bytes", url, MAX_BODY_BYTES, extra=SAMPLED)
 
-        # Initialize the article data structure
-        article_data = {
-            'url': url,
-            'extraction_timestamp': datetime.datetime.now().isoformat(),
-            'title': soup.title.string.strip() if soup.title and soup.title.string else "No title",
-            'category': category,
+        new_validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_hash': hashlib.sha256(body).hexdigest(),
         }
 
-        # Extract meta tags
-        article_data['meta_tags'] = {}
+        # Servers without ETag/Last-Modified support still get caught by the hash
+        if validators and validators.get('content_hash') == new_validators['content_hash']:
+            return {"not_modified": True, "url": url, "validators": new_validators}
 
-        # Extract description
-        meta_desc = soup.find('meta', {'name': 'description'}) or soup.find('meta', {'property': 'og:description'})
-        if meta_desc and meta_desc.get('content'):
-            article_data['meta_tags']['description'] = meta_desc['content']
-        else:
-            article_data['meta_tags']['description'] = "No description"
-
-        # Extract keywords
-        meta_keywords = soup.find('meta', {'name': 'keywords'})
-        if meta_keywords and meta_keywords.get('content'):
-            article_data['meta_tags']['keywords'] = meta_keywords['content']
-
-        # Extract author - try multiple methods
-        author = None
-        # Method 1: meta tag
-        meta_author = soup.find('meta', {'name': 'author'}) or soup.find('meta', {'property': 'article:author'})
-        if meta_author and meta_author.get('content'):
-            author = meta_author['content']
-
-        # Method 2: byline or author class
-        if not author:
-            author_elements = (
-                soup.find('div', class_=lambda x: x and 'byline' in str(x).lower()) or
-                soup.find('div', class_=lambda x: x and 'author' in str(x).lower()) or
-                soup.find('div', class_=lambda x: x and 'writer' in str(x).lower()) or
-                soup.find('span', class_=lambda x: x and 'byline' in str(x).lower()) or
-                soup.find('span', class_=lambda x: x and 'author' in str(x).lower()) or
-                soup.find('span', class_=lambda x: x and 'writer' in str(x).lower()) or
-                soup.find('span', class_=lambda x: x and 'reporter' in str(x).lower())
-
-            )
-
-            if not author_elements:
-              # Try to find anchor tags with author href
-              author_links = soup.find_all('a', href=lambda x: x and '/author/' in x)
-
-              # If found, check for spans inside them
-              for link in author_links:
-                  span = link.find('span')
-                  if span:
-                      author_elements = span
-                      break
-
-            if author_elements:
-                author = author_elements.get_text(strip=True)
-
-        if author:
-            article_data['meta_tags']['author'] = author
-
-        # Extract publication date - try multiple methods
-        pub_date = extract_publication_date(soup, url)
-        
-        article_data['meta_tags']['publication_date'] = pub_date if pub_date is None else html.unescape(pub_date)
+        warc_location = None
+        if archive:
+            try:
+                warc_location = archive.write_response(url, response.status_code, response.reason, response.headers, body,
+                                                       url_id=url_id, truncated=truncated)
+            except OSError as e:
+                logger.error(f"Error archiving {url}: {e}")
 
-        og_type_tag = soup.find('meta', property = 'og:type')
-        if og_type_tag and og_type_tag.get('content'):
-            article_data['type'] = og_type_tag['content']
-        
+    except requests.RequestException as e:
+        # print(f"Error fetching URL: {e}")
+        outcome = classify_exception(e)
+        if e.response is None:
+            observe_failure('parser', url, outcome, time.monotonic() - started)
+        return {"error": str(e), "url": url, "outcome": outcome, "retry_after": retry_after_seconds(e.response)}
 
-      
-       
-        # Try to find the article content
-        article_body = get_article_content(soup)
+    try:
+        with PARSE_DURATION.labels('parser').time():
+            article_data = parse_html(body, url, response.encoding)
+    except Exception as e:
+        # print(f"Error processing URL: {e}")
+        return {"error": str(e), "url": url, "outcome": FetchOutcome.PARSE_ERROR}
 
+    article_data['validators'] = new_validators
+    if warc_location:
+        article_data['warc'] = warc_location
 
-        if article_body:
+    return article_data
 
-            paragraphs = []
-            for p in soup.find_all('p'):
-                # Check if this paragraph is inside another paragraph
-                if not any(parent.name == 'p' for parent in p.parents) and len(p.get_text(strip =True).split())>10:
-                    paragraphs.append(p)
 
-            # Extract text from these non-nested paragraphs
-            text = ' '.join(p.get_text(strip=True) for p in paragraphs)
-            article_data['text'] = text
+def extract_metadata_from_warc(url, warc_filename, offset, length):
+    """
+    Extract metadata from the Common Crawl capture of a URL
 
-        else:
-            # If no article container found, use the body
-            if soup.body:
-                for script in soup.body.find_all(['script', 'style', 'nav', 'header', 'footer']):
-                    script.decompose()
-                article_data['text'] = soup.body.get_text(separator=' ', strip=True)
-                article_data['text'] = re.sub(r'\s+', ' ', article_data['text']).strip()
-            else:
-                article_data['text'] = "No content found"
+    The record is range-requested from WARC_HOST, so the origin site is not
+    contacted at all.
+    """
+    started = time.monotonic()
+    try:
+        _, status_code, http_headers, body = fetch_remote_record(warc_filename, offset, length)
+        # Range requests against the CC bucket, accounted to WARC_HOST
+        observe_response('parser', WARC_HOST, 206, length, time.monotonic() - started)
+    except requests.RequestException as e:
+        outcome = classify_exception(e)
+        observe_failure('parser', WARC_HOST, outcome, time.monotonic() - started)
+        return {"error": str(e), "url": url, "outcome": outcome, "retry_after": retry_after_seconds(e.response)}
+    except Exception as e:
+        return {"error": str(e), "url": url, "outcome": FetchOutcome.PARSE_ERROR}
 
-        if not article_data['text'] or article_data['text'] == "":
-            meta_description = soup.find('meta', attrs={'name': 'description'}) or soup.find('meta', attrs={'property': 'og:description'})
-            if meta_description and meta_description.get('content'):
-                article_data['text'] = meta_description.get('content')
-            else:
-                article_data['text'] = "No content found"
+    if status_code and status_code >= 400:
+        return {"error": f"{status_code} in archived response", "url": url, "outcome": classify_status(status_code)}
+
+    if not is_html(http_headers):
+        RESPONSES_SKIPPED.labels('parser', urlparse(url).netloc, FetchOutcome.NOT_HTML.value).inc()
+        return {"error": f"Not HTML: {http_headers.get('content-type')}", "url": url, "outcome": FetchOutcome.NOT_HTML}
+
+    try:
+        with PARSE_DURATION.labels('parser').time():
+            return parse_html(body, url, get_encoding_from_headers(http_headers))
+    except Exception as e:
+        return {"error": str(e), "url": url, "outcome": FetchOutcome.PARSE_ERROR}
+
+
+def parse_html(content, url, encoding=None):
+    """
+    Run the extraction heuristics over raw HTML of a page
 
-        # Count links and images
-        article_data['statistics'] = {
+    Kept separate from the fetch so archived pages can be re-parsed offline.
+    """
+    # Try to determine encoding
+    encoding = encoding or 'utf-8-sig'
+
+    # Parse the HTML
+    soup = BeautifulSoup(content, 'lxml', from_encoding=encoding)
+
+    # Get domain for link classification
+    domain = urlparse(url).netloc
+
+    # Detect category
+    category = detect_category(soup, url)
+
+    # Initialize the article data structure
+    article_data = {
+        'url': url,
+        'extraction_timestamp': datetime.datetime.now().isoformat(),
+        'title': soup.title.string.strip() if soup.title and soup.title.string else "No title",
+        'category': category,
+    }
+
+    # Extract meta tags
+    article_data['meta_tags'] = {}
+
+    # Extract description
+    meta_desc = soup.find('meta', {'name': 'description'}) or soup.find('meta', {'property': 'og:description'})
+    if meta_desc and meta_desc.get('content'):
+        article_data['meta_tags']['description'] = meta_desc['content']
+    else:
+        article_data['meta_tags']['description'] = "No description"
+
+    # Extract keywords
+    meta_keywords = soup.find('meta', {'name': 'keywords'})
+    if meta_keywords and meta_keywords.get('content'):
+        article_data['meta_tags']['keywords'] = meta_keywords['content']
+
+    # Extract author - try multiple methods
+    author = None
+    # Method 1: meta tag
+    meta_author = soup.find('meta', {'name': 'author'}) or soup.find('meta', {'property': 'article:author'})
+    if meta_author and meta_author.get('content'):
+        author = meta_author['content']
+
+    # Method 2: byline or author class
+    if not author:
+        author_elements = (
+            soup.find('div', class_=lambda x: x and 'byline' in str(x).lower()) or
+            soup.find('div', class_=lambda x: x and 'author' in str(x).lower()) or
+            soup.find('div', class_=lambda x: x and 'writer' in str(x).lower()) or
+            soup.find('span', class_=lambda x: x and 'byline' in str(x).lower()) or
+            soup.find('span', class_=lambda x: x and 'author' in str(x).lower()) or
+            soup.find('span', class_=lambda x: x and 'writer' in str(x).lower()) or
+            soup.find('span', class_=lambda x: x and 'reporter' in str(x).lower())
+
+        )
+
+        if not author_elements:
+          # Try to find anchor tags with author href
+          author_links = soup.find_all('a', href=lambda x: x and '/author/' in x)
+
+          # If found, check for spans inside them
+          for link in author_links:
+              span = link.find('span')
+              if span:
+                  author_elements = span
+                  break
+
+        if author_elements:
+            author = author_elements.get_text(strip=True)
+
+    if author:
+        article_data['meta_tags']['author'] = author
+
+    # Extract publication date - try multiple methods
+    pub_date = extract_publication_date(soup, url)
+    
+    article_data['meta_tags']['publication_date'] = pub_date if pub_date is None else html.unescape(pub_date)
+
+    og_type_tag = soup.find('meta', property = 'og:type')
+    if og_type_tag and og_type_tag.get('content'):
+        article_data['type'] = og_type_tag['content']
     
-            'text_length': len(article_data['text']),
-            'word_count': len(article_data['text'].split())
-        }
 
-        return article_data
+  
+   
+    # Try to find the article content
+    article_body = get_article_content(soup)
 
-    except requests.RequestException as e:
-        # print(f"Error fetching URL: {e}")
-        return {"error": str(e), "url": url}
-    except Exception as e:
-        # print(f"Error processing URL: {e}")
-        return {"error": str(e), "url": url}
+
+    if article_body:
+
+        paragraphs = []
+        for p in soup.find_all('p'):
+            # Check if this paragraph is inside another paragraph
+            if not any(parent.name == 'p' for parent in p.parents) and len(p.get_text(strip =True).split())>10:
+                paragraphs.append(p)
+
+        # Extract text from these non-nested paragraphs
+        text = ' '.join(p.get_text(strip=True) for p in paragraphs)
+        article_data['text'] = text
+
+    else:
+        # If no article container found, use the body
+        if soup.body:
+            for script in soup.body.find_all(['script', 'style', 'nav', 'header', 'footer']):
+                script.decompose()
+            article_data['text'] = soup.body.get_text(separator=' ', strip=True)
+            article_data['text'] = re.sub(r'\s+', ' ', article_data['text']).strip()
+        else:
+            article_data['text'] = "No content found"
+
+    if not article_data['text'] or article_data['text'] == "":
+        meta_description = soup.find('meta', attrs={'name': 'description'}) or soup.find('meta', attrs={'property': 'og:description'})
+        if meta_description and meta_description.get('content'):
+            article_data['text'] = meta_description.get('content')
+        else:
+            article_data['text'] = "No content found"
+
+    # Count links and images
+    article_data['statistics'] = {
+
+        'text_length': len(article_data['text']),
+        'word_count': len(article_data['text'].split())
+    }
+
+    return article_data
     
  
-async def update_status(conn, url_id, status): 
-    try:
-        async with conn.cursor() as cursor:
-            
-            await cursor.execute(
-            """
-                    UPDATE url_registry
-                    SET status = %s
-                    WHERE urlID = %s
-            """, (status, url_id))
-        
-        await conn.commit()
-        logger.info(f"Updated URL ID {url_id} status to {status}")
-    except Exception as e:
-        await conn.rollback()
-        logger.error(f"Error updating status for URL ID {url_id}: {e}") 
- 
-async def store_url_content(conn):
-    url_paths = await fetch_urls(conn)
+def content_row(url_id, data, duplicate_of=None):
+    """Build the url_parsed_content row for a parsed page, keyed by column name."""
+    # Duplicates only link to the canonical copy instead of storing the body again
+    article_body = None if duplicate_of else data.get('text', 'N/A')
+    extraction_timestamp = datetime.datetime.fromisoformat(data.get('extraction_timestamp', datetime.datetime.now().isoformat()))
+    published_date = data.get('meta_tags', {}).get('publication_date', 'N/A')
+    category = data.get('category', 'N/A')
+    # Meta tags can yield several sections
+    if isinstance(category, list):
+        category = ', '.join(category)
+    title = data.get('title', 'N/A')
+    keywords = data.get('meta_tags', {}).get('keywords', 'N/A')
+    return {
+        'urlID': url_id,
+        'extractionTimestamp': extraction_timestamp,
+        'title': title,
+        'author': data.get('meta_tags', {}).get('author', 'N/A'),
+        'type': data.get('type', 'N/A'),
+        'publishedDate': published_date,
+        'category': category,
+        'keywords': keywords,
+        'articleBody': article_body,
+        'wordCount': data.get('statistics', {}).get('word_count', 0),
+        'textLength': data.get('statistics', {}).get('text_length', 0),
+        'duplicateOf': duplicate_of,
+        'publishedAt': normalize_published_date(published_date, extraction_timestamp),
+        # Duplicates stay out of the search index, their canonical copy is in it
+        'searchVector': None if duplicate_of else search_vector(title, article_body, category, keywords),
+    }
+
+async def stage_parsed_content(cursor, buffer, url_id, data):
+    """
+    Buffer a parsed page, checking for a near-duplicate first
+
+    Both the SimHash index and the fingerprints still waiting in the buffer
+    are searched. Returns the canonical urlID when the page is a duplicate.
+    """
+    fingerprint = simhash(data.get('text'))
+    canonical_url_id = None
+    if fingerprint is not None:
+        canonical_url_id = (
+            closest_match(fingerprint, buffer.pending_fingerprints(), exclude_url_id=url_id)
+            or await find_duplicate(cursor, fingerprint, exclude_url_id=url_id)
+        )
+    
+    buffer.add_content(content_row(url_id, data, duplicate_of=canonical_url_id))
     
-    if not url_paths:
-        logger.info("Urls not fetched for the url_registry table")
+    if fingerprint is not None:
+        buffer.add_fingerprint(url_id, to_signed(fingerprint), bands(fingerprint), canonical_url_id)
+    if canonical_url_id:
+        URLS_DUPLICATE.labels('parser').inc()
+        logger.info("URL ID %s is a near-duplicate of %s", url_id, canonical_url_id, extra=SAMPLED)
+    else:
+        URLS_INSERTED.labels('parser').inc()
+    return canonical_url_id
+ 
+def record_failure(buffer, row, outcome, retry_after=None):
+    """
+    Schedule a retry for a failed URL, or give up on it
+
+    Permanent outcomes and URLs out of attempts are marked 'fail' and never
+    handed out again; anything else keeps its status with the next attempt
+    pushed back exponentially.
+    """
+    attempts = row['attempts'] + 1
+    if outcome.permanent or attempts >= MAX_ATTEMPTS:
+        buffer.add_status(row['urlid'], 'fail', outcome.value, attempts)
+        logger.info("Giving up on URL ID %s after %s attempts: %s", row['urlid'], attempts, outcome.value, extra=SAMPLED)
+    else:
+        retry_at = next_attempt_at(attempts, retry_after)
+        buffer.add_status(row['urlid'], row['status'], outcome.value, attempts, retry_at)
+        logger.info("Retrying URL ID %s at %s after %s", row['urlid'], retry_at, outcome.value, extra=SAMPLED)
+ 
+async def url_batches(conn, refresh=False):
+    """
+    Yield the URL rows to process, batch by batch.
+
+    A refresh pass is a single batch of everything already parsed; a
+    normal pass keeps claiming pending URLs until there are none left.
+    """
+    if refresh:
+        url_rows = await fetch_urls(conn, refresh=True)
+        if url_rows:
+            yield url_rows
         return
+    while url_rows := await claim_pending_urls(conn):
+        yield url_rows
+
+
+async def store_url_content(conn, refresh=False, from_warc=False):
+    # Pages read from CC WARCs are already archived there
+    archive = WarcWriter() if WARC_ARCHIVE and not from_warc else None
+    # Rows of the URLs still in the buffer, to schedule a retry for any
+    # URL the buffer cannot store
+    claimed = {}
+
+    def reject(url_id, error):
+        if url_id in claimed:
+            record_failure(buffer, claimed[url_id], FetchOutcome.STORE_ERROR)
+
+    buffer = WriteBehindBuffer(conn, on_reject=reject)
+    processed = 0
     
     try:
         async with conn.cursor() as cursor:
-            for url_path in url_paths:
-                url_id = url_path[0]
-                url = url_path[1]
+            async for url_rows in url_batches(conn, refresh=refresh):
+                processed += len(url_rows)
+                claimed = {url_id: row for url_id, row in claimed.items() if url_id in buffer}
+                claimed.update((row['urlid'], row) for row in url_rows)
+                host_sessions.reserve(row['urlpath'] for row in url_rows)
+                for position, row in enumerate(url_rows):
+                    QUEUE_DEPTH.labels('parser').set(len(url_rows) - position)
+                    url_id = row['urlid']
+                    url = row['urlpath']
+                    validators = {
+                        'etag': row['etag'],
+                        'last_modified': row['lastmodified'],
+                        'content_hash': row['contenthash'],
+                    }
                 
-                try:
-                    data = extract_metadata(url)
+                    try:
+                        # Read the Common Crawl capture when we know where it is
+                        if from_warc and row['warcfilename']:
+                            data = extract_metadata_from_warc(url, row['warcfilename'], row['warcoffset'], row['warclength'])
+                        else:
+                            data = extract_metadata(url, validators, archive=archive, url_id=url_id)
                     
-                    # Check if extract_metadata returned an error
-                    if isinstance(data, dict) and "error" in data:
-                        error_msg = data["error"]
-                        # print(f"HTTP Error detected: {error_msg}")
-                        
-                        # Check for HTTP error codes
-                        if any(code in error_msg for code in ["204", "404", "410", "403", "451"]) or "NameResolutionError" in error_msg or "ConnectionError" in error_msg:
-                            await update_status(conn, url_id, "fail")
+                        fetched_at = datetime.datetime.now()
+                    
+                        # Unchanged since the last fetch, keep the stored content
+                        if data.get("not_modified"):
+                            buffer.add_validators(url_id, data.get("validators", {}), fetched_at)
+                            logger.debug("Not modified: %s", url_id, extra=SAMPLED)
+                            buffer.add_status(url_id, "success", FetchOutcome.NOT_MODIFIED.value, 0)
+                            continue
+                    
+                        # Check if extract_metadata returned an error
+                        if "error" in data:
+                            record_failure(buffer, row, data.get("outcome", FetchOutcome.UNKNOWN), data.get("retry_after"))
                             continue  # Skip to the next URL
                                             
-                    # Proceed with normal insertion if no HTTP error
-                    await cursor.execute("""
-                        INSERT INTO url_parsed_content (urlID, extractionTimestamp, title, author, type, publishedDate, category, keywords, articleBody, wordCount, textLength)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """, (url_id, data.get('extraction_timestamp', datetime.datetime.now().isoformat()), data.get('title', 'N/A'), data.get('meta_tags', {}).get('author', 'N/A'), data.get('type', 'N/A'), data.get('meta_tags', {}).get('publication_date', 'N/A'), data.get('category', 'N/A'), data.get('meta_tags', {}).get('keywords', 'N/A'), data.get('text', 'N/A'), data.get('statistics', {}).get('word_count', 0), data.get('statistics', {}).get('text_length', 0))    
-                    )
-                    
-                    await conn.commit()
-                    logger.info(f"Processed Domain:{url_id}")
-                    # Update status to success
-                    await update_status(conn, url_id, "success")
+                        # Proceed with normal insertion if no error
+                        await stage_parsed_content(cursor, buffer, url_id, data)
                     
-                except Exception as e:
-                    error_msg = str(e)
-                    # print(f"Error:{error_msg}")
+                        logger.debug("Processed Domain:%s", url_id, extra=SAMPLED)
+                        if data.get("validators"):
+                            buffer.add_validators(url_id, data["validators"], fetched_at)
+                        if data.get("warc"):
+                            buffer.add_warc_location(url_id, data["warc"], fetched_at)
+                        # Update status to success
+                        buffer.add_status(url_id, "success", FetchOutcome.SUCCESS.value, 0)
                     
-                    # Handle any other errors as before
-                    if any(code in error_msg for code in ["204", "404", "410", "403", "451"]):
-                         await update_status(conn, url_id, "fail")
-                    else:
-                        await update_status(conn, url_id, "success")
+                    except Exception as e:
+                        logger.error("Error processing URL ID %s: %s", url_id, e)
+                        record_failure(buffer, row, classify_exception(e))
+                    finally:
+                        await buffer.maybe_flush()
         
-        logger.info("Finished processing all URLs")
+        await buffer.flush(final=True)
+        QUEUE_DEPTH.labels('parser').set(0)
+        if not processed:
+            logger.info("Urls not fetched for the url_registry table")
+            return
+        logger.info(f"Finished processing all {processed} URLs")
+        logger.info("HTTP reuse: %s", host_sessions.stats())
         
+    except FlushError:
+        raise
     except Exception as e:
         await conn.rollback()
-        logger.error(f"Error processing url_paths {url_paths}: {e}")
+        logger.error(f"Error processing url_rows: {e}")
+    finally:
+        if archive:
+            archive.close()
+
+async def fetch_archived_urls(conn):
+    """Fetch every archived record, ordered so each WARC file is read sequentially."""
+    try:
+        async with conn.cursor() as cursor:
+            await cursor.execute("""
+                SELECT w.urlID, r.urlPath, w.warcFile, w.recordOffset, w.recordLength
+                FROM url_warc_index w
+                JOIN url_registry r ON r.urlID = w.urlID
+                ORDER BY w.warcFile, w.recordOffset
+;""")
+            return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Error fetching archived urls: {e}")
+
+def reparse_archived_records(records):
+    """
+    Parse a chunk of archived records, runs inside a worker process
+
+    Returns a list of (url_id, article_data) in the same shape as
+    extract_metadata, plus the worker's heuristic profile rows.
+    """
+    results = []
+    for url_id, url, warc_file, offset, length in records:
+        try:
+            _, _, http_headers, body = read_record(warc_file, offset, length)
+            data = parse_html(body, url, get_encoding_from_headers(http_headers))
+        except Exception as e:
+            data = {"error": str(e), "url": url}
+        results.append((url_id, data))
+    # Method timings made in this worker, merged by the parent
+    return results, profile.drain()
+
+async def reparse_from_archive(conn, workers=None):
+    """
+    Re-run the extraction over archived responses and backfill url_parsed_content
+
+    No network is involved; the parsing is spread over a process pool and
+    the main process only writes the results.
+    """
+    records = await fetch_archived_urls(conn)
+    
+    if not records:
+        logger.info("No archived records found in url_warc_index")
+        return
+    
+    chunks = [records[i:i + REPARSE_CHUNK_SIZE] for i in range(0, len(records), REPARSE_CHUNK_SIZE)]
+    logger.info(f"Reparsing {len(records)} archived records in {len(chunks)} chunks")
+    
+    loop = asyncio.get_running_loop()
+    buffer = WriteBehindBuffer(conn)
+    parsed_count = 0
+    failed_count = 0
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [loop.run_in_executor(executor, reparse_archived_records, chunk) for chunk in chunks]
+        
+        for future in asyncio.as_completed(futures):
+            results, profile_rows = await future
+            profile.merge(profile_rows)
+            try:
+                async with conn.cursor() as cursor:
+                    for url_id, data in results:
+                        if "error" in data:
+                            failed_count += 1
+                            logger.error("Error reparsing URL ID %s: %s", url_id, data['error'])
+                            continue
+                        await stage_parsed_content(cursor, buffer, url_id, data)
+                        parsed_count += 1
+                
+                await buffer.maybe_flush()
+            except Exception as e:
+                await conn.rollback()
+                logger.error(f"Error storing reparsed chunk: {e}")
+        
+        await buffer.flush(final=True)
+    
+    logger.info(f"Reparse finished: {parsed_count} records backfilled, {failed_count} failed")
 
-async def main():
+async def main(refresh=False, reparse=False, from_warc=False):
     conn = await get_connection()
+    start_metrics_server(PARSER_METRICS_PORT)
     
     try:
         # Create table structure
         await create_table(conn)
-        await store_url_content(conn)
+        await create_dedup_table(conn)
+        await create_dates_table(conn)
+        await create_search_table(conn)
+        await create_stats_table(conn)
+        if PROFILE_HEURISTICS:
+            await create_profile_table(conn)
+        if reparse:
+            await reparse_from_archive(conn)
+        else:
+            await store_url_content(conn, refresh=refresh, from_warc=from_warc)
+        if PROFILE_HEURISTICS:
+            await save_profile(conn)
+    except FlushError:
+        # Buffered results were lost, exit non-zero
+        raise
     except Exception as e:
         logger.error(f"Unexpected error in main execution: {e}")
     finally:
@@ -811,4 +1304,14 @@ async def main():
    
     
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # Revisit already parsed URLs with conditional requests
+    if len(sys.argv) > 1 and sys.argv[1] == '--refresh':
+        asyncio.run(main(refresh=True))
+    # Re-extract from archived responses without touching the network
+    elif len(sys.argv) > 1 and sys.argv[1] == '--reparse':
+        asyncio.run(main(reparse=True))
+    # Read pages from Common Crawl WARC byte ranges instead of the origin sites
+    elif len(sys.argv) > 1 and sys.argv[1] == '--from-warc':
+        asyncio.run(main(from_warc=True))
+    else:
+        asyncio.run(main())
\ No newline at end of file
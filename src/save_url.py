@@ -1,52 +1,37 @@
-import json
+import ijson
 import psycopg
 import asyncio
+import hashlib
 import os
+import sys
 import logging
 import re
 from datetime import datetime
 from urllib.parse import urlparse
 from pathlib import Path
-from database import get_connection, return_connection, close_all_connections
+from concurrent.futures import ProcessPoolExecutor
+from psycopg.types.json import Jsonb
+from log_setup import SAMPLED, setup_logging
+from database import DB_CONFIG, get_connection, return_connection, close_all_connections
+from dates import url_date
 
 
 
 
 # Configure logging
-logging.basicConfig(
-    filename='dadef insert_into_url_registry_table(conn, ):
+setup_logging()
+logger = logging.getLogger(__name__)
 
-    do_insert_into_url_registry_table_block = f"""
-            DO $$
-            BEGIN
-                INSERT INTO url_registry (domain, accessTimestamp, index, urlPath, status)
-                VALUES (%s, %s, %s, %s, 'pending')
-                ON CONFLICT (urlPath) DO NOTHING;
-            END
-            $$;
-    """
+# Rows COPYed into the staging table before each merge into url_registry
+COPY_BATCH_SIZE = 10000
 
-    with psycopg.connect(conn_info) as conn:
-        with conn.cursor() as cur:
-            cur.execute(do_insert_into_url_registry_table_block, (domain_from_url, timestamp, index_value, url_path))
-tabase.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-logger = logging.getLogger(__name__)
+# Asset folders to ingest, one JSON file per domain
+MEDIA_DOMAINS_DIR = os.getenv('ASSETS_MEDIA_DOMAINS_DIR', './assets/newmediadomains')
+GENERAL_CRAWLER_DIR = os.getenv('ASSETS_GENERAL_CRAWLER_DIR', './assets/generalcralwerurl')
 
+# Files ingested in parallel; None lets the pool use one process per CPU
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 0)) or None
 
-async def load_json_file(file_path):
-    """Load and parse a JSON file."""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        logger.info(f"JSON data loaded successfully from {file_path}")
-        return data
-    except Exception as e:
-        logger.error(f"Error loading JSON file {file_path}: {e}")
-        return None
 
 async def create_table(conn):
     """Create table with url_id as primary key and url_path as unique constraint"""
@@ -54,6 +39,12 @@ async def create_table(conn):
         async with conn.cursor() as cursor:
             await cursor.execute("""
                 CREATE SEQUENCE IF NOT EXISTS url_id_seq START 1;
+                
+                -- Four bytes per row instead of free text, and typos fail loudly
+                DO $$ BEGIN
+                    CREATE TYPE url_status AS ENUM ('pending', 'success', 'fail');
+                EXCEPTION WHEN duplicate_object THEN NULL;
+                END $$;
                                  
                 CREATE TABLE IF NOT EXISTS url_registry (
                     urlID TEXT PRIMARY KEY DEFAULT 'url' || nextval('url_id_seq'),
@@ -61,10 +52,49 @@ async def create_table(conn):
                     accessTimestamp TIMESTAMP NOT NULL,
                     index TEXT NOT NULL,
                     urlPath TEXT NOT NULL,
-                    status TEXT NOT NULL DEFAULT 'pending',
+                    status url_status NOT NULL DEFAULT 'pending',
                     CONSTRAINT unique_url_path UNIQUE (urlPath)
                 );
                 
+                -- Tables created before the enum still have a TEXT status, convert them in place
+                DO $$ BEGIN
+                    IF (SELECT data_type FROM information_schema.columns
+                        WHERE table_name = 'url_registry' AND column_name = 'status') = 'text' THEN
+                        -- An index built against the TEXT column cannot be rebuilt for the enum
+                        DROP INDEX IF EXISTS url_registry_pending;
+                        ALTER TABLE url_registry ALTER COLUMN status DROP DEFAULT;
+                        ALTER TABLE url_registry ALTER COLUMN status TYPE url_status USING status::url_status;
+                        ALTER TABLE url_registry ALTER COLUMN status SET DEFAULT 'pending';
+                    END IF;
+                END $$;
+                
+                -- Location of the Common Crawl capture, when the URL came from a CC index
+                ALTER TABLE url_registry ADD COLUMN IF NOT EXISTS warcFilename TEXT;
+                ALTER TABLE url_registry ADD COLUMN IF NOT EXISTS warcOffset BIGINT;
+                ALTER TABLE url_registry ADD COLUMN IF NOT EXISTS warcLength BIGINT;
+                -- When Common Crawl captured the page, a recency hint for the parse scheduler
+                ALTER TABLE url_registry ADD COLUMN IF NOT EXISTS captureTimestamp TIMESTAMP;
+                -- Date in the URL path (UTC), the scheduler's preferred recency signal
+                ALTER TABLE url_registry ADD COLUMN IF NOT EXISTS urlDate TIMESTAMP;
+                
+                -- Only pending rows are ever claimed, so the index stays the size of
+                -- the backlog however large url_registry grows. It is ordered the way
+                -- the scheduler ranks recency: URL date, else capture time. Created
+                -- after the enum conversion so its predicate compares url_status values
+                DROP INDEX IF EXISTS url_registry_pending;
+                CREATE INDEX IF NOT EXISTS url_registry_pending_recency
+                    ON url_registry (domain, (COALESCE(urlDate, captureTimestamp)) DESC NULLS LAST)
+                    WHERE status = 'pending';
+                
+                -- What has already been loaded from each asset file
+                CREATE TABLE IF NOT EXISTS asset_manifest (
+                    kind TEXT NOT NULL,
+                    fileName TEXT NOT NULL,
+                    contentHash TEXT NOT NULL,
+                    ingestedOffsets JSONB NOT NULL DEFAULT '{}',
+                    ingestedAt TIMESTAMP NOT NULL,
+                    PRIMARY KEY (kind, fileName)
+                );
                 
             """)
         
@@ -78,7 +108,7 @@ def should_skip_url(url):
     """Check if the URL should be skipped based on filtering criteria"""
     # Skip robots.txt URLs
     if "robots.txt" in url.lower():
-        logger.debug(f"Skipping robots.txt URL: {url}")
+        logger.debug("Skipping robots.txt URL: %s", url, extra=SAMPLED)
         return True
     
     # Parse URL to check for english subdomain
@@ -88,155 +118,274 @@ def should_skip_url(url):
     # Check if domain starts with "english." subdomain pattern
     parts = domain.split('.')
     if len(parts) >= 3 and parts[0] == "english":
-        logger.debug(f"Skipping english subdomain URL: {url}")
+        logger.debug("Skipping english subdomain URL: %s", url, extra=SAMPLED)
         return True
     
     return False
 
-async def process_general_crawler_file(conn, file_path):
-    """Process a single general crawler JSON file"""
-    domain = Path(file_path).stem  # Extract domain name from filename
-    json_data = await load_json_file(file_path)
+def parse_timestamp(timestamp_str):
+    """Parse the asset timestamps, falling back to the current time."""
+    timestamp_str = timestamp_str or ''
+    if 'T' in timestamp_str:
+        # Convert from format like '2025-04-26T01:50:37.054463'
+        timestamp_str = timestamp_str.replace('T', ' ').split('.')[0]
+    
+    try:
+        return datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        logger.warning(f"Could not parse timestamp '{timestamp_str}', using current time")
+        return datetime.now()
+
+def iter_general_crawler_rows(file_path, offsets=None):
+    """
+    Stream (domain, timestamp, index, url) rows from a general crawler file.
+    
+    The crawler appends to these files, so offsets['items'] is the number
+    of entries already ingested; they are skipped and the offset is moved
+    to the end of the file as it is read.
+    """
+    offsets = {} if offsets is None else offsets
+    ingested = offsets.get('items', 0)
+    position = 0
+    with open(file_path, 'rb') as file:
+        for data in ijson.items(file, 'item'):
+            position += 1
+            url_path = data.get('url')
+            if position <= ingested or not url_path:
+                continue
+            yield urlparse(url_path).netloc, parse_timestamp(data.get('discovery_time')), "General Crawler", url_path
+    offsets['items'] = position
+
+def read_media_domain_headers(file_path):
+    """Stream the per-object domain and timestamp of a media domains file, skipping the URL lists."""
+    headers = []
+    with open(file_path, 'rb') as file:
+        for prefix, event, value in ijson.parse(file):
+            prefix = prefix[5:] if prefix.startswith('item.') else prefix
+            if event == 'start_map' and prefix in ('', 'item'):
+                headers.append({})
+            elif prefix in ('domain', 'timestamp') and event == 'string':
+                headers[-1][prefix] = value
+    return headers
+
+def iter_media_domain_rows(file_path, offsets=None):
+    """
+    Stream (domain, timestamp, index, url) rows from a media domains file.
+    
+    Files hold either one domain object or a list of them. The object's
+    timestamp comes after its URL_paths, so a first pass collects only the
+    per-object domain and timestamp and the second pass streams the URLs.
+    Neither pass holds the URL lists in memory.
+    
+    offsets maps "domain/index" to the number of url_paths already ingested
+    for that index. The crawler adds whole new indexes, so usually only the
+    new ones are read; offsets are updated in place as the file is read.
+    """
+    offsets = {} if offsets is None else offsets
+    headers = read_media_domain_headers(file_path)
     
-    if not json_data:
-        return 0, 0, 0  # Return zeros if file couldn't be loaded
+    timestamps = [parse_timestamp(header.get('timestamp')) for header in headers]
+    
+    object_idx = -1
+    index = None
+    position = 0
+    with open(file_path, 'rb') as file:
+        for prefix, event, value in ijson.parse(file):
+            prefix = prefix[5:] if prefix.startswith('item.') else prefix
+            if event == 'start_map' and prefix in ('', 'item'):
+                object_idx += 1
+            elif prefix == 'URL_paths.item.index' and event == 'string':
+                index = value
+            elif prefix == 'URL_paths.item.url_paths' and event == 'start_array':
+                key = f"{headers[object_idx].get('domain')}/{index}"
+                ingested = offsets.get(key, 0)
+                position = 0
+            elif prefix == 'URL_paths.item.url_paths' and event == 'end_array':
+                offsets[key] = position
+            elif prefix == 'URL_paths.item.url_paths.item' and event == 'string':
+                position += 1
+                if position > ingested:
+                    yield headers[object_idx].get('domain'), timestamps[object_idx], index, value
+
+def file_hash(file_path):
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+async def merge_staged_urls(cursor):
+    """Merge the staged batch into url_registry, returning how many rows were new."""
+    await cursor.execute("""
+        WITH inserted AS (
+            INSERT INTO url_registry (domain, accessTimestamp, index, urlPath, status, urlDate)
+            SELECT domain, accessTimestamp, index, urlPath, 'pending', urlDate
+            FROM staging_url_registry
+            ON CONFLICT (urlPath) DO NOTHING
+            RETURNING 1
+        )
+        SELECT count(*) FROM inserted
+    """)
+    inserted = (await cursor.fetchone())[0]
+    await cursor.execute("TRUNCATE staging_url_registry")
+    return inserted
+
+async def load_rows(conn, rows, batch_size=COPY_BATCH_SIZE):
+    """
+    Bulk load (domain, timestamp, index, url) rows into url_registry.
     
+    Rows are COPYed into a temp staging table in batches and each batch is
+    merged with a single INSERT ... SELECT ... ON CONFLICT. The whole load
+    is one transaction. Returns (inserted, duplicates, filtered).
+    """
     inserted_count = 0
-    duplicate_count = 0
+    staged_count = 0
     filtered_count = 0
+    batch = []
     
-    try:
-        async with conn.cursor() as cursor:
-            for data in json_data:
-                full_path = data.get('url')
-                
-                # Skip URLs that match filtering criteria
-                if should_skip_url(full_path):
-                    filtered_count += 1
-                    continue
-                
-                parsed = urlparse(full_path)
-                domain_from_url = parsed.netloc
-                
-                # Handle the different timestamp format
-                timestamp_str = data.get('discovery_time', '')
-                if 'T' in timestamp_str:
-                    # Convert from format like '2025-04-26T01:50:37.054463'
-                    timestamp_str = timestamp_str.replace('T', ' ').split('.')[0]
-                
-                try:
-                    timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    timestamp = datetime.now()
-                    logger.warning(f"Could not parse timestamp '{timestamp_str}', using current time")
-                
-                index = "General Crawler"
-                url_path = data.get('url')
-                
-                try:
-                    await cursor.execute("""
-                        INSERT INTO url_registry (domain, accessTimestamp, index, urlPath, status) 
-                        VALUES (%s, %s, %s, %s, %s)
-                        ON CONFLICT (urlPath) DO NOTHING
-                    """, (domain_from_url, timestamp, index, url_path, 'pending'))
-                    
-                    if cursor.rowcount > 0:
-                        inserted_count += 1
-                    else:
-                        duplicate_count += 1
-                except Exception as e:
-                    logger.error(f"Error inserting record: {e}")
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS staging_url_registry (
+                domain VARCHAR(255),
+                accessTimestamp TIMESTAMP,
+                index TEXT,
+                urlPath TEXT,
+                urlDate TIMESTAMP
+            )
+        """)
         
-        await conn.commit()
-        logger.info(f"Domain {domain} from General Crawler: {inserted_count} unique URLs inserted, {duplicate_count} duplicates skipped, {filtered_count} URLs filtered out")
-        return inserted_count, duplicate_count, filtered_count
-    except Exception as e:
-        await conn.rollback()
-        logger.error(f"Error processing file {file_path}: {e}")
-        return 0, 0, 0
-
-async def process_media_domains_file(conn, file_path):
-    """Process a single media domains JSON file"""
-    domain = Path(file_path).stem  # Extract domain name from filename
-    json_data = await load_json_file(file_path)
+        async def copy_batch():
+            async with cursor.copy("COPY staging_url_registry (domain, accessTimestamp, index, urlPath, urlDate) FROM STDIN") as copy:
+                for row in batch:
+                    await copy.write_row((*row, url_date(row[3])))
+            inserted = await merge_staged_urls(cursor)
+            batch.clear()
+            return inserted
+        
+        for row in rows:
+            # Skip URLs that match filtering criteria
+            if should_skip_url(row[3]):
+                filtered_count += 1
+                continue
+            
+            batch.append(row)
+            staged_count += 1
+            if len(batch) >= batch_size:
+                inserted_count += await copy_batch()
+        
+        if batch:
+            inserted_count += await copy_batch()
     
-    if not json_data:
-        return 0, 0, 0  # Return zeros if file couldn't be loaded
+    return inserted_count, staged_count - inserted_count, filtered_count
+
+ASSET_READERS = {
+    'media': iter_media_domain_rows,
+    'general': iter_general_crawler_rows,
+}
+
+async def load_manifest(conn, kind):
+    """Return {fileName: (contentHash, ingestedOffsets)} for one asset kind."""
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            SELECT fileName, contentHash, ingestedOffsets
+            FROM asset_manifest
+            WHERE kind = %s
+        """, (kind,))
+        return {file_name: (content_hash, offsets) for file_name, content_hash, offsets in await cursor.fetchall()}
+
+async def ingest_file(conn, kind, file_path, manifest_entry=None):
+    """
+    Load one asset file, skipping it when unchanged since the last run.
     
-    inserted_count = 0
-    duplicate_count = 0
-    filtered_count = 0
+    Only entries past the recorded offsets are loaded. The URLs and the
+    manifest update are committed in one transaction, so a failed file is
+    simply retried in full next time. Returns (inserted, duplicates,
+    filtered), or None when the file was unchanged.
+    """
+    content_hash = file_hash(file_path)
+    if manifest_entry and manifest_entry[0] == content_hash:
+        return None
     
+    offsets = dict(manifest_entry[1]) if manifest_entry else {}
     try:
+        inserted_count, duplicate_count, filtered_count = await load_rows(conn, ASSET_READERS[kind](file_path, offsets))
+        
         async with conn.cursor() as cursor:
-            for data in json_data:
-                domain = data.get('domain')
-                timestamp_str = data.get('timestamp')
-                
-                try:
-                    timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    timestamp = datetime.now()
-                    logger.warning(f"Could not parse timestamp '{timestamp_str}', using current time")
-                
-                url_paths = data.get('URL_paths', [])
-                for url_data in url_paths:
-                    index = url_data.get('index')
-                    url_paths_list = url_data.get('url_paths', [])
-                    
-                    for url_path in url_paths_list:
-                        # Skip URLs that match filtering criteria
-                        if should_skip_url(url_path):
-                            filtered_count += 1
-                            continue
-                            
-                        try:
-                            await cursor.execute("""
-                                INSERT INTO url_registry (domain, accessTimestamp, index, urlPath, status) 
-                                VALUES (%s, %s, %s, %s, %s)
-                                ON CONFLICT (urlPath) DO NOTHING
-                            """, (domain, timestamp, index, url_path, 'pending'))
-                            
-                            if cursor.rowcount > 0:
-                                inserted_count += 1
-                            else:
-                                duplicate_count += 1
-                        except Exception as e:
-                            logger.error(f"Error inserting record: {e}")
+            await cursor.execute("""
+                INSERT INTO asset_manifest (kind, fileName, contentHash, ingestedOffsets, ingestedAt)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (kind, fileName) DO UPDATE SET
+                    contentHash = EXCLUDED.contentHash,
+                    ingestedOffsets = EXCLUDED.ingestedOffsets,
+                    ingestedAt = EXCLUDED.ingestedAt
+            """, (kind, os.path.basename(file_path), content_hash, Jsonb(offsets), datetime.now()))
         
         await conn.commit()
-        logger.info(f"Domain {domain} from CommonCrawl: {inserted_count} unique URLs inserted, {duplicate_count} duplicates skipped, {filtered_count} URLs filtered out")
-        return inserted_count, duplicate_count, filtered_count
-    except Exception as e:
+    except Exception:
         await conn.rollback()
+        raise
+    
+    logger.info(f"Domain {Path(file_path).stem} ({kind}): {inserted_count} unique URLs inserted, {duplicate_count} duplicates skipped, {filtered_count} URLs filtered out")
+    return inserted_count, duplicate_count, filtered_count
+
+async def ingest_file_with_own_connection(kind, file_path, manifest_entry):
+    # Pools don't survive into a child process, each worker opens its own connection
+    conn = await psycopg.AsyncConnection.connect(**DB_CONFIG)
+    try:
+        return await ingest_file(conn, kind, file_path, manifest_entry)
+    finally:
+        await conn.close()
+
+def ingest_file_worker(kind, file_path, manifest_entry):
+    """Process pool entry point: ingest one file on a fresh event loop."""
+    try:
+        return asyncio.run(ingest_file_with_own_connection(kind, file_path, manifest_entry))
+    except Exception as e:
         logger.error(f"Error processing file {file_path}: {e}")
         return 0, 0, 0
 
-async def process_folder(conn, folder_path, process_func):
-    """Process all JSON files in the specified folder"""
+async def process_folder(conn, folder_path, kind, force=False, workers=INGEST_WORKERS):
+    """
+    Ingest the changed JSON files in a folder across a process pool.
+    
+    With force the manifest is ignored and every file is loaded in full;
+    url_registry's unique constraint keeps that idempotent.
+    """
     if not os.path.exists(folder_path):
         logger.error(f"Folder not found: {folder_path}")
         return
     
+    manifest = {} if force else await load_manifest(conn, kind)
+    file_names = sorted(filename for filename in os.listdir(folder_path) if filename.endswith('.json'))
+    
     total_inserted = 0
     total_duplicates = 0
     total_filtered = 0
     file_count = 0
+    unchanged_count = 0
     
-    for filename in os.listdir(folder_path):
-        if filename.endswith('.json'):
-            file_path = os.path.join(folder_path, filename)
-            logger.info(f"Processing file: {filename}")
-            
-            inserted, duplicates, filtered = await process_func(conn, file_path)
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            loop.run_in_executor(executor, ingest_file_worker, kind, os.path.join(folder_path, filename), manifest.get(filename))
+            for filename in file_names
+        ]
+        
+        for future in asyncio.as_completed(futures):
+            result = await future
+            if result is None:
+                unchanged_count += 1
+                continue
+            inserted, duplicates, filtered = result
             total_inserted += inserted
             total_duplicates += duplicates
             total_filtered += filtered
             file_count += 1
     
-    logger.info(f"Processed {file_count} files: {total_inserted} total unique URLs inserted, {total_duplicates} total duplicates skipped, {total_filtered} total URLs filtered out")
+    logger.info(f"Processed {file_count} files ({unchanged_count} unchanged skipped): {total_inserted} total unique URLs inserted, {total_duplicates} total duplicates skipped, {total_filtered} total URLs filtered out")
 
-async def main():
+async def main(force=False):
     logger.info("Script execution started")
     
     # Connect to database
@@ -250,14 +399,12 @@ async def main():
         await create_table(conn)
         
         # Process media domains files (CommonCrawl)
-        media_domains_folder = r"C:\Users\Dell\OneDrive\Desktop\WebScraping\assests\newmediadomains"
-        logger.info(f"Processing CommonCrawl data from folder: {media_domains_folder}")
-        await process_folder(conn, media_domains_folder, process_media_domains_file)
+        logger.info(f"Processing CommonCrawl data from folder: {MEDIA_DOMAINS_DIR}")
+        await process_folder(conn, MEDIA_DOMAINS_DIR, 'media', force=force)
         
         # Process general crawler files
-        general_crawler_folder = r"C:\Users\Dell\OneDrive\Desktop\WebScraping\assests\generalcralwerurl"
-        logger.info(f"Processing General Crawler data from folder: {general_crawler_folder}")
-        await process_folder(conn, general_crawler_folder, process_general_crawler_file)
+        logger.info(f"Processing General Crawler data from folder: {GENERAL_CRAWLER_DIR}")
+        await process_folder(conn, GENERAL_CRAWLER_DIR, 'general', force=force)
         
         logger.info("Data processing complete")
     except Exception as e:
@@ -268,4 +415,8 @@ async def main():
             logger.info("Database connection closed")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # Ignore the manifest and reload every asset file
+    if len(sys.argv) > 1 and sys.argv[1] == '--force':
+        asyncio.run(main(force=True))
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,106 @@
+import os
+import heapq
+import logging
+import datetime
+from collections import defaultdict
+from dates import NEPAL_TZ, url_date
+from stats import domain_status_counts
+
+logger = logging.getLogger(__name__)
+
+# A page loses half its priority every this many days of age
+RECENCY_HALF_LIFE_DAYS = float(os.getenv('SCHEDULER_HALF_LIFE_DAYS', 30))
+
+# Priority of a URL with no date in the path and no capture time
+UNDATED_RECENCY = float(os.getenv('SCHEDULER_UNDATED_RECENCY', 0.1))
+
+# Most URLs handed out per domain in one pass, 0 for no limit
+DOMAIN_BUDGET = int(os.getenv('SCHEDULER_DOMAIN_BUDGET', 0))
+
+# Domains with no history start at a 50% success rate
+PRIOR_SUCCESSES = 1
+PRIOR_FAILURES = 1
+
+
+async def domain_success_rates(conn):
+    """Smoothed share of finished URLs per domain that parsed successfully."""
+    rates = {}
+    for domain, counts in (await domain_status_counts(conn)).items():
+        successes = counts.get('success', 0)
+        failures = counts.get('fail', 0)
+        rates[domain] = (successes + PRIOR_SUCCESSES) / (successes + failures + PRIOR_SUCCESSES + PRIOR_FAILURES)
+    return rates
+
+
+def recency(row, now):
+    """
+    1.0 for a page published now, halving every RECENCY_HALF_LIFE_DAYS.
+
+    The date in the URL path is preferred (BS dates included, stored as
+    urlDate when the URL was registered); the Common Crawl capture time is
+    the fallback, an upper bound on the page's age. Both are naive UTC.
+    """
+    published = row.get('urldate') or url_date(row['urlpath']) or row.get('capturetimestamp')
+    if published is None:
+        return UNDATED_RECENCY
+    published = published.replace(tzinfo=datetime.timezone.utc)
+
+    age_days = max((now - published).total_seconds() / 86400, 0)
+    return 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS)
+
+
+def claim_quotas(domains, success_rates, batch_size):
+    """
+    Split a claim of about batch_size URLs over domains in proportion to
+    their success rates, the same shares stride scheduling serves them in.
+    Every domain gets at least one URL so none is starved.
+    """
+    default_rate = PRIOR_SUCCESSES / (PRIOR_SUCCESSES + PRIOR_FAILURES)
+    rates = {domain: success_rates.get(domain, default_rate) for domain in domains}
+    total_rate = sum(rates.values())
+    if not total_rate:
+        return {}
+    return {domain: max(round(batch_size * rate / total_rate), 1) for domain, rate in rates.items()}
+
+
+def schedule(rows, success_rates, now=None, budget=DOMAIN_BUDGET):
+    """
+    Order URL rows so valuable pages come first and no domain crowds out the rest.
+
+    Within a domain, URLs are sorted by recency. Domains then take turns
+    by stride scheduling: each is served in proportion to its success
+    rate, so a large domain gets no more turns than a small one with the
+    same rate, it just keeps getting them for longer. budget caps the URLs
+    per domain in this pass.
+    """
+    now = now or datetime.datetime.now(NEPAL_TZ)
+    default_rate = PRIOR_SUCCESSES / (PRIOR_SUCCESSES + PRIOR_FAILURES)
+
+    queues = defaultdict(list)
+    for row in rows:
+        queues[row['domain']].append(row)
+
+    deferred = 0
+    turns = []
+    for position, (domain, domain_rows) in enumerate(queues.items()):
+        rate = success_rates.get(domain, default_rate)
+        domain_rows.sort(key=lambda row: recency(row, now), reverse=True)
+        if budget and len(domain_rows) > budget:
+            deferred += len(domain_rows) - budget
+            del domain_rows[budget:]
+        # (pass, tie breaker, stride, domain); the lowest pass is served next
+        stride = 1 / max(rate, 0.01)
+        turns.append((stride, position, stride, domain))
+    heapq.heapify(turns)
+
+    ordered = []
+    next_row = dict.fromkeys(queues, 0)
+    while turns:
+        pass_value, position, stride, domain = heapq.heappop(turns)
+        ordered.append(queues[domain][next_row[domain]])
+        next_row[domain] += 1
+        if next_row[domain] < len(queues[domain]):
+            heapq.heappush(turns, (pass_value + stride, position, stride, domain))
+
+    logger.info(f"Scheduled {len(ordered)} URLs over {len(queues)} domains, {deferred} over the per-domain budget deferred")
+    return ordered
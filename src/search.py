@@ -0,0 +1,291 @@
+import re
+import sys
+import asyncio
+import logging
+import datetime
+import unicodedata
+from collections import defaultdict
+from psycopg.rows import dict_row
+from log_setup import setup_logging
+from database import get_connection, return_connection, close_all_connections
+from dates import NEPALI_DIGITS
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+RESULTS_PER_PAGE = 20
+
+# Letters, digits and Devanagari including its vowel signs and virama, which
+# \w does not count as word characters; the danda (। ॥) ends a word
+TOKEN_PATTERN = re.compile(r'[0-9a-z\u00c0-\u024f\u0900-\u0963\u0966-\u097f]+')
+# Joiners only change how a conjunct is drawn
+JOINERS = str.maketrans('', '', '\u200c\u200d')
+
+# Postgres keeps at most 256 positions per lexeme and counts up to 16383
+MAX_POSITIONS_PER_LEXEME = 256
+MAX_POSITION = 16383
+MAX_TOKEN_LENGTH = 100
+
+# Case markers and postpositions are written joined to the noun
+# ("नेपालको", "सरकारले"), the plural marker sits before them ("दलहरूले")
+NEPALI_POSTPOSITIONS = sorted([
+    'को', 'का', 'की', 'ले', 'लाई', 'मा', 'बाट', 'देखि', 'सम्म', 'सँग', 'संग',
+    'भन्दा', 'तिर', 'द्वारा', 'माथि', 'भित्र', 'बारे',
+], key=len, reverse=True)
+NEPALI_PLURALS = ['हरू', 'हरु']
+# These also end many base words after an i vowel sign ("गाउँपालिका",
+# "अमेरिका", "प्रतिमा"), so they are never stripped there
+AMBIGUOUS_POSTPOSITIONS = {'का', 'की', 'मा'}
+MIN_STEM_LENGTH = 2
+# A stem keeps at least this many syllables, so "सीमा" is not cut to "सी"
+MIN_STEM_SYLLABLES = 2
+# Consonants and independent vowels start a syllable unless a virama joins
+# them to the next consonant
+SYLLABLE_PATTERN = re.compile(r'[\u0904-\u0939\u0958-\u0961](?!\u094d)')
+VIRAMA = '\u094d'
+VOWEL_SIGN_I = '\u093f'
+
+STOP_WORDS = {
+    # Nepali
+    'र', 'छ', 'हो', 'पनि', 'यो', 'त्यो', 'यस', 'उक्त', 'तथा', 'वा', 'भने', 'छन्', 'थियो', 'थिए',
+    'गरेको', 'भएको', 'रहेको', 'गर्न', 'गरे', 'भए', 'भन्ने', 'गरी', 'लागि', 'अनुसार', 'एक',
+    # English
+    'the', 'a', 'an', 'and', 'or', 'of', 'to', 'in', 'on', 'for', 'is', 'are', 'was', 'with', 'by', 'at',
+}
+
+NOT_AVAILABLE = 'N/A'
+
+
+async def create_table(conn):
+    """Add the full-text search vector and its GIN index to url_parsed_content."""
+    try:
+        async with conn.cursor() as cursor:
+            await cursor.execute("""
+                ALTER TABLE url_parsed_content ADD COLUMN IF NOT EXISTS searchVector TSVECTOR;
+
+                CREATE INDEX IF NOT EXISTS url_parsed_content_search
+                    ON url_parsed_content USING GIN (searchVector);
+            """)
+
+        await conn.commit()
+        logger.info("searchVector column ensured")
+    except Exception as e:
+        await conn.rollback()
+        logger.error(f"Error creating searchVector column: {e}")
+
+
+def strippable(token, suffix):
+    """
+    Whether suffix is an inflection of token rather than part of the word.
+
+    What is left must keep MIN_STEM_SYLLABLES syllables and must not end
+    in a virama (the suffix would be half of a conjunct, as in "आत्मा"),
+    and an ambiguous postposition is kept after the i vowel sign.
+    """
+    if not token.endswith(suffix):
+        return False
+    remainder = token[:-len(suffix)]
+    if len(SYLLABLE_PATTERN.findall(remainder)) < MIN_STEM_SYLLABLES or remainder.endswith(VIRAMA):
+        return False
+    return not (suffix in AMBIGUOUS_POSTPOSITIONS and remainder.endswith(VOWEL_SIGN_I))
+
+
+def stem(token):
+    """
+    Strip one postposition and then a plural marker.
+
+    Base and inflected forms get the same lexeme ("अमेरिका", "अमेरिकाले"),
+    and pages and queries go through the same rule.
+    """
+    for suffixes in (NEPALI_POSTPOSITIONS, NEPALI_PLURALS):
+        for suffix in suffixes:
+            if strippable(token, suffix):
+                token = token[:-len(suffix)]
+                break
+    return token
+
+
+def tokenize(text):
+    """
+    Split text into search terms, the same way for pages and queries.
+
+    Text is NFC normalized, Nepali digits become Latin ones and Latin
+    letters are lower-cased, so "२०८१" matches "2081".
+    """
+    if not text or text == NOT_AVAILABLE:
+        return []
+    text = unicodedata.normalize('NFC', text).translate(NEPALI_DIGITS).translate(JOINERS).lower()
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text):
+        if token in STOP_WORDS:
+            continue
+        token = stem(token)[:MAX_TOKEN_LENGTH]
+        if len(token) >= MIN_STEM_LENGTH and token not in STOP_WORDS:
+            tokens.append(token)
+    return tokens
+
+
+def quote_lexeme(token):
+    return "'" + token.replace('\\', '\\\\').replace("'", "''") + "'"
+
+
+def search_vector(title, body, category=None, keywords=None):
+    """
+    tsvector literal for a page: title weighted A, category and keywords B, body D.
+
+    Built here rather than with to_tsvector() because the Postgres parsers
+    split Devanagari words at every vowel sign. None when there is no text.
+    """
+    positions = defaultdict(list)
+    position = 0
+    for text, weight in ((title, 'A'), (category, 'B'), (keywords, 'B'), (body, 'D')):
+        for token in tokenize(text):
+            position = min(position + 1, MAX_POSITION)
+            if len(positions[token]) < MAX_POSITIONS_PER_LEXEME:
+                positions[token].append(f'{position}{weight}')
+
+    if not positions:
+        return None
+    return ' '.join(f"{quote_lexeme(token)}:{','.join(token_positions)}" for token, token_positions in positions.items())
+
+
+def search_query(text):
+    """tsquery literal matching pages that contain every term of text, None if it has none."""
+    tokens = list(dict.fromkeys(tokenize(text)))
+    if not tokens:
+        return None
+    return ' & '.join(quote_lexeme(token) for token in tokens)
+
+
+async def search(conn, text, domain=None, category=None, published_from=None, published_to=None,
+                 limit=RESULTS_PER_PAGE, offset=0):
+    """
+    Ranked articles matching every term of text.
+
+    Title hits outrank category/keyword hits, which outrank body hits; ties
+    go to the more recent article. Near-duplicates are not indexed, so each
+    story shows up once. Returns a list of dicts.
+    """
+    query = search_query(text)
+    if query is None:
+        return []
+
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute("""
+            SELECT c.urlID, r.urlPath, r.domain, c.title, c.category, c.publishedAt,
+                   ts_rank(c.searchVector, q.query) AS rank
+            FROM url_parsed_content c
+            JOIN url_registry r ON r.urlID = c.urlID
+            CROSS JOIN (SELECT %(query)s::tsquery AS query) q
+            WHERE c.searchVector @@ q.query
+              AND (%(domain)s::text IS NULL OR r.domain = %(domain)s)
+              AND (%(category)s::text IS NULL OR %(category)s = ANY(string_to_array(c.category, ', ')))
+              AND (%(published_from)s::timestamptz IS NULL OR c.publishedAt >= %(published_from)s)
+              AND (%(published_to)s::timestamptz IS NULL OR c.publishedAt < %(published_to)s)
+            ORDER BY rank DESC, c.publishedAt DESC NULLS LAST, c.urlID
+            LIMIT %(limit)s OFFSET %(offset)s
+        """, {
+            'query': query,
+            'domain': domain,
+            'category': category,
+            'published_from': published_from,
+            'published_to': published_to,
+            'limit': limit,
+            'offset': offset,
+        })
+        return await cursor.fetchall()
+
+
+async def backfill_search_vectors(conn, batch_size=BATCH_SIZE, rebuild=False):
+    """
+    Fill searchVector for rows parsed before it existed, one keyset batch per
+    transaction. rebuild recomputes every vector, e.g. after tokenize changed.
+    """
+    last_parse_id = ''
+    updated_count = 0
+
+    while True:
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute("""
+                    SELECT parseID, title, articleBody, category, keywords
+                    FROM url_parsed_content
+                    WHERE (%s OR searchVector IS NULL)
+                      AND duplicateOf IS NULL
+                      AND parseID > %s
+                    ORDER BY parseID
+                    LIMIT %s
+                """, (rebuild, last_parse_id, batch_size))
+                rows = await cursor.fetchall()
+
+                if not rows:
+                    break
+
+                last_parse_id = rows[-1][0]
+                updates = []
+                for parse_id, title, article_body, category, keywords in rows:
+                    vector = search_vector(title, article_body, category, keywords)
+                    if vector:
+                        updates.append((vector, parse_id))
+
+                if updates:
+                    await cursor.executemany("""
+                        UPDATE url_parsed_content SET searchVector = %s::tsvector WHERE parseID = %s
+                    """, updates)
+                updated_count += len(updates)
+
+            await conn.commit()
+            logger.info(f"searchVector backfill progress: {updated_count} updated")
+        except Exception as e:
+            await conn.rollback()
+            logger.error(f"Error during searchVector backfill: {e}")
+            break
+
+    logger.info(f"searchVector backfill finished: {updated_count} updated")
+
+
+def parse_args(argv):
+    """Query words plus --domain, --category, --from/--to (YYYY-MM-DD) and --page."""
+    options = {'domain': None, 'category': None, 'published_from': None, 'published_to': None, 'page': 1}
+    flags = {'--domain': 'domain', '--category': 'category', '--from': 'published_from', '--to': 'published_to', '--page': 'page'}
+    words = []
+    args = iter(argv)
+    for arg in args:
+        if arg in flags:
+            options[flags[arg]] = next(args, None)
+        else:
+            words.append(arg)
+
+    for name in ('published_from', 'published_to'):
+        if options[name]:
+            options[name] = datetime.datetime.fromisoformat(options[name])
+    options['page'] = max(int(options['page']), 1)
+    return ' '.join(words), options
+
+
+async def main(argv):
+    conn = await get_connection()
+
+    try:
+        await create_table(conn)
+        # Index the rows parsed before searchVector existed, or re-index everything
+        if argv and argv[0] in ('--backfill', '--reindex'):
+            await backfill_search_vectors(conn, rebuild=argv[0] == '--reindex')
+            return
+
+        text, options = parse_args(argv)
+        page = options.pop('page')
+        results = await search(conn, text, limit=RESULTS_PER_PAGE, offset=(page - 1) * RESULTS_PER_PAGE, **options)
+        for result in results:
+            published = result['publishedat'].date().isoformat() if result['publishedat'] else '-'
+            print(f"{result['rank']:.3f}  {published}  {result['domain']}  {result['title']}\n       {result['urlpath']}")
+        print(f"page {page}, {len(results)} results")
+    finally:
+        if conn:
+            await return_connection(conn)
+        await close_all_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,220 @@
+import sys
+import asyncio
+import logging
+from log_setup import setup_logging
+from database import get_connection, return_connection, close_all_connections
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Counters kept current by statement-level triggers: each INSERT, UPDATE or
+# DELETE statement adds its net change, grouped, in one upsert per table.
+# Stats rows are upserted in key order so concurrent writers lock them in
+# the same order.
+STATS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS crawl_stats (
+        domain VARCHAR(255) NOT NULL,
+        status TEXT NOT NULL,
+        urls BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (domain, status)
+    );
+
+    CREATE TABLE IF NOT EXISTS index_stats (
+        index TEXT PRIMARY KEY,
+        urls BIGINT NOT NULL DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS daily_ingest (
+        day DATE NOT NULL,
+        domain VARCHAR(255) NOT NULL,
+        articles BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, domain)
+    );
+
+    CREATE OR REPLACE FUNCTION url_registry_stats_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO crawl_stats (domain, status, urls)
+        SELECT domain, status, COUNT(*) FROM new_rows GROUP BY domain, status ORDER BY domain, status
+        ON CONFLICT (domain, status) DO UPDATE SET urls = crawl_stats.urls + EXCLUDED.urls;
+
+        INSERT INTO index_stats (index, urls)
+        SELECT index, COUNT(*) FROM new_rows GROUP BY index ORDER BY index
+        ON CONFLICT (index) DO UPDATE SET urls = index_stats.urls + EXCLUDED.urls;
+        RETURN NULL;
+    END $$;
+
+    CREATE OR REPLACE FUNCTION url_registry_stats_update() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO crawl_stats (domain, status, urls)
+        SELECT domain, status, SUM(delta) FROM (
+            SELECT o.domain, o.status, -1 AS delta
+            FROM old_rows o JOIN new_rows n ON n.urlID = o.urlID
+            WHERE o.status IS DISTINCT FROM n.status OR o.domain IS DISTINCT FROM n.domain
+            UNION ALL
+            SELECT n.domain, n.status, 1
+            FROM old_rows o JOIN new_rows n ON n.urlID = o.urlID
+            WHERE o.status IS DISTINCT FROM n.status OR o.domain IS DISTINCT FROM n.domain
+        ) changes
+        GROUP BY domain, status ORDER BY domain, status
+        ON CONFLICT (domain, status) DO UPDATE SET urls = crawl_stats.urls + EXCLUDED.urls;
+        RETURN NULL;
+    END $$;
+
+    CREATE OR REPLACE FUNCTION url_registry_stats_delete() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO crawl_stats (domain, status, urls)
+        SELECT domain, status, -COUNT(*) FROM old_rows GROUP BY domain, status ORDER BY domain, status
+        ON CONFLICT (domain, status) DO UPDATE SET urls = crawl_stats.urls + EXCLUDED.urls;
+
+        INSERT INTO index_stats (index, urls)
+        SELECT index, -COUNT(*) FROM old_rows GROUP BY index ORDER BY index
+        ON CONFLICT (index) DO UPDATE SET urls = index_stats.urls + EXCLUDED.urls;
+        RETURN NULL;
+    END $$;
+
+    CREATE OR REPLACE FUNCTION url_parsed_content_stats_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO daily_ingest (day, domain, articles)
+        SELECT n.extractionTimestamp::date, r.domain, COUNT(*)
+        FROM new_rows n JOIN url_registry r ON r.urlID = n.urlID
+        GROUP BY 1, 2 ORDER BY 1, 2
+        ON CONFLICT (day, domain) DO UPDATE SET articles = daily_ingest.articles + EXCLUDED.articles;
+        RETURN NULL;
+    END $$;
+
+    -- CREATE TRIGGER locks the table against writes, so only run it for
+    -- triggers that are missing rather than on every start
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                       WHERE tgrelid = 'url_registry'::regclass AND tgname = 'url_registry_stats_insert') THEN
+            CREATE TRIGGER url_registry_stats_insert AFTER INSERT ON url_registry
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION url_registry_stats_insert();
+        END IF;
+
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                       WHERE tgrelid = 'url_registry'::regclass AND tgname = 'url_registry_stats_update') THEN
+            CREATE TRIGGER url_registry_stats_update AFTER UPDATE ON url_registry
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION url_registry_stats_update();
+        END IF;
+
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                       WHERE tgrelid = 'url_registry'::regclass AND tgname = 'url_registry_stats_delete') THEN
+            CREATE TRIGGER url_registry_stats_delete AFTER DELETE ON url_registry
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION url_registry_stats_delete();
+        END IF;
+
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                       WHERE tgrelid = 'url_parsed_content'::regclass AND tgname = 'url_parsed_content_stats_insert') THEN
+            CREATE TRIGGER url_parsed_content_stats_insert AFTER INSERT ON url_parsed_content
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION url_parsed_content_stats_insert();
+        END IF;
+    END $$;
+"""
+
+REBUILD_STATS = """
+    TRUNCATE crawl_stats, index_stats, daily_ingest;
+
+    INSERT INTO crawl_stats (domain, status, urls)
+    SELECT domain, status, COUNT(*) FROM url_registry GROUP BY domain, status;
+
+    INSERT INTO index_stats (index, urls)
+    SELECT index, COUNT(*) FROM url_registry GROUP BY index;
+
+    INSERT INTO daily_ingest (day, domain, articles)
+    SELECT c.extractionTimestamp::date, r.domain, COUNT(*)
+    FROM url_parsed_content c JOIN url_registry r ON r.urlID = c.urlID
+    GROUP BY 1, 2;
+"""
+
+
+async def create_table(conn):
+    """
+    Create the stats tables and the triggers that maintain them.
+
+    Needs url_registry and url_parsed_content. The first time, the counts
+    are filled from a full scan; creating the triggers locks both tables
+    against writes until the commit, so nothing is missed or counted twice.
+    """
+    try:
+        async with conn.cursor() as cursor:
+            await cursor.execute(STATS_SCHEMA)
+            await cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM crawl_stats)")
+            if (await cursor.fetchone())[0]:
+                await cursor.execute(REBUILD_STATS)
+                logger.info("Crawl stats filled from url_registry and url_parsed_content")
+
+        await conn.commit()
+        logger.info("Crawl stats tables and triggers ensured")
+    except Exception as e:
+        await conn.rollback()
+        logger.error(f"Error creating crawl stats tables: {e}")
+
+
+async def rebuild(conn):
+    """Recount everything, e.g. after the triggers were disabled for a bulk load."""
+    try:
+        async with conn.cursor() as cursor:
+            # Hold writers off so the recount is exact
+            await cursor.execute("LOCK TABLE url_registry, url_parsed_content IN SHARE MODE")
+            await cursor.execute(REBUILD_STATS)
+        await conn.commit()
+        logger.info("Crawl stats rebuilt")
+    except Exception as e:
+        await conn.rollback()
+        logger.error(f"Error rebuilding crawl stats: {e}")
+
+
+async def domain_status_counts(conn):
+    """{domain: {status: urls}} from crawl_stats."""
+    async with conn.cursor() as cursor:
+        await cursor.execute("SELECT domain, status, urls FROM crawl_stats WHERE urls <> 0")
+        counts = {}
+        for domain, status, urls in await cursor.fetchall():
+            counts.setdefault(domain, {})[status] = urls
+        return counts
+
+
+async def report(conn):
+    """URLs per domain and status, with the articles ingested today."""
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            SELECT s.domain,
+                   SUM(s.urls) FILTER (WHERE s.status = 'pending'),
+                   SUM(s.urls) FILTER (WHERE s.status = 'success'),
+                   SUM(s.urls) FILTER (WHERE s.status = 'fail'),
+                   COALESCE(MAX(d.articles), 0)
+            FROM crawl_stats s
+            LEFT JOIN daily_ingest d ON d.domain = s.domain AND d.day = CURRENT_DATE
+            GROUP BY s.domain
+            ORDER BY s.domain
+        """)
+        rows = await cursor.fetchall()
+
+    lines = [f"{'domain':<32} {'pending':>10} {'success':>10} {'fail':>10} {'today':>8}"]
+    for domain, pending, success, fail, today in rows:
+        lines.append(f"{domain:<32} {pending or 0:>10} {success or 0:>10} {fail or 0:>10} {today:>8}")
+    return '\n'.join(lines)
+
+
+async def main(rebuild_stats=False):
+    conn = await get_connection()
+
+    try:
+        await create_table(conn)
+        if rebuild_stats:
+            await rebuild(conn)
+        print(await report(conn))
+    finally:
+        if conn:
+            await return_connection(conn)
+        await close_all_connections()
+
+
+if __name__ == "__main__":
+    # Recount from the source tables before reporting
+    asyncio.run(main(rebuild_stats=len(sys.argv) > 1 and sys.argv[1] == '--rebuild'))
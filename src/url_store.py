@@ -0,0 +1,336 @@
+import os
+import sys
+import mmap
+import heapq
+import struct
+import logging
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# One store file per domain
+URL_STORE_DIR = os.getenv('URL_STORE_DIR', './assets/urlstore')
+
+# URLs per front-coded block; the first URL of a block is stored in full so
+# lookups can binary search the blocks and then scan at most one of them
+BLOCK_SIZE = 64
+
+MAGIC = b'FCURLS01'
+# magic, url count, block size, block count, offset of the block index
+HEADER = struct.Struct('<8sQIIQ')
+OFFSET = struct.Struct('<Q')
+
+
+def domain_key(host):
+    """Store name for a host; www. and the letter case don't make a different site."""
+    host = host.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return host.replace(':', '_')
+
+
+def store_path(domain, directory=URL_STORE_DIR):
+    return os.path.join(directory, domain_key(domain) + '.urls')
+
+
+def encode_varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(buffer, position):
+    result = 0
+    shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+def common_prefix_length(a, b):
+    limit = min(len(a), len(b))
+    i = 0
+    while i < limit and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def write_store(path, sorted_urls):
+    """
+    Write already sorted, unique URLs (bytes) as a front-coded store.
+
+    Written to a temp file and moved into place, so readers never see a
+    half written store. Returns the number of URLs written.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = path + '.tmp'
+    offsets = []
+    count = 0
+    previous = b''
+
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, 0, BLOCK_SIZE, 0, 0))
+        for url in sorted_urls:
+            if count % BLOCK_SIZE == 0:
+                offsets.append(f.tell())
+                f.write(encode_varint(len(url)))
+                f.write(url)
+            else:
+                shared = common_prefix_length(previous, url)
+                f.write(encode_varint(shared))
+                f.write(encode_varint(len(url) - shared))
+                f.write(url[shared:])
+            previous = url
+            count += 1
+
+        index_offset = f.tell()
+        for offset in offsets:
+            f.write(OFFSET.pack(offset))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, count, BLOCK_SIZE, len(offsets), index_offset))
+
+    os.replace(temp_path, path)
+    return count
+
+
+class UrlStore:
+    """
+    Read-only, memory-mapped view of one domain's sorted URL set.
+
+    URLs are compared as UTF-8 bytes. Membership costs a binary search over
+    the block heads plus decoding at most one block; nothing is loaded
+    into Python objects up front, the OS pages the file in as needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.block_size, self.block_count, self.index_offset = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a URL store")
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def _block_offset(self, block):
+        return OFFSET.unpack_from(self.mm, self.index_offset + block * OFFSET.size)[0]
+
+    def _block_head(self, block):
+        position = self._block_offset(block)
+        length, position = decode_varint(self.mm, position)
+        return self.mm[position:position + length]
+
+    def _find_block(self, url):
+        """Index of the last block whose head is <= url, or -1."""
+        lo, hi = 0, self.block_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._block_head(mid) <= url:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1
+
+    def _iter_blocks(self, first_block):
+        """Decode URLs (bytes) from the start of first_block to the end of the store."""
+        if self.count == 0:
+            return
+        position = self._block_offset(first_block)
+        remaining = self.count - first_block * self.block_size
+        previous = b''
+        for i in range(remaining):
+            if i % self.block_size == 0:
+                length, position = decode_varint(self.mm, position)
+                url = self.mm[position:position + length]
+            else:
+                shared, position = decode_varint(self.mm, position)
+                length, position = decode_varint(self.mm, position)
+                url = previous[:shared] + self.mm[position:position + length]
+            position += length
+            previous = url
+            yield url
+
+    def __contains__(self, url):
+        key = url.encode('utf-8') if isinstance(url, str) else url
+        block = self._find_block(key)
+        if block < 0:
+            return False
+        for i, candidate in enumerate(self._iter_blocks(block)):
+            if candidate >= key or i >= self.block_size:
+                return candidate == key
+        return False
+
+    def __iter__(self):
+        for url in self._iter_blocks(0):
+            yield url.decode('utf-8')
+
+    def range(self, start, stop=None):
+        """URLs u with start <= u < stop, in sorted order."""
+        start_key = start.encode('utf-8')
+        stop_key = stop.encode('utf-8') if stop is not None else None
+        for url in self._iter_blocks(max(self._find_block(start_key), 0)):
+            if url < start_key:
+                continue
+            if stop_key is not None and url >= stop_key:
+                return
+            yield url.decode('utf-8')
+
+    def prefix(self, prefix):
+        """URLs starting with prefix, e.g. every article under /2024/."""
+        key = prefix.encode('utf-8')
+        for url in self.range(prefix):
+            if not url.encode('utf-8').startswith(key):
+                return
+            yield url
+
+    def difference(self, urls):
+        """
+        The URLs not in the store, sorted and unique.
+
+        One merge walk over the store instead of a lookup per URL, which is
+        cheaper once a batch is a sizeable part of the store.
+        """
+        pending = sorted({url.encode('utf-8') for url in urls})
+        missing = []
+        stored = self._iter_blocks(0)
+        current = next(stored, None)
+        for key in pending:
+            while current is not None and current < key:
+                current = next(stored, None)
+            if current != key:
+                missing.append(key.decode('utf-8'))
+        return missing
+
+
+def merge_into_store(path, urls):
+    """
+    Add URLs to a store, creating it if needed.
+
+    The existing store is streamed and merged with the sorted new URLs, so
+    only the new ones are held in memory. Returns the number actually added.
+    """
+    new_urls = sorted({url.encode('utf-8') for url in urls})
+    if not new_urls:
+        return 0
+
+    existing = UrlStore(path) if os.path.exists(path) else None
+    try:
+        old_count = len(existing) if existing else 0
+        merged = heapq.merge(existing._iter_blocks(0), new_urls) if existing else iter(new_urls)
+
+        def unique(items):
+            previous = None
+            for item in items:
+                if item != previous:
+                    yield item
+                    previous = item
+
+        # Write next to the old file first; the old mmap is still being read
+        temp_path = path + '.merge'
+        new_count = write_store(temp_path, unique(merged))
+    finally:
+        if existing:
+            existing.close()
+
+    os.replace(temp_path, path)
+    return new_count - old_count
+
+
+class KnownUrls:
+    """
+    "Have we seen this URL" across all domains, one store per domain.
+
+    Stores are opened lazily on first lookup; add() merges new URLs in and
+    reopens the affected stores.
+    """
+
+    def __init__(self, directory=URL_STORE_DIR):
+        self.directory = directory
+        self.stores = {}
+
+    def _store(self, host):
+        key = domain_key(host)
+        if key not in self.stores:
+            path = store_path(host, self.directory)
+            self.stores[key] = UrlStore(path) if os.path.exists(path) else None
+        return self.stores[key]
+
+    def __contains__(self, url):
+        store = self._store(urlparse(url).netloc)
+        return store is not None and url in store
+
+    def unseen(self, urls):
+        """The URLs not recorded yet, sorted per domain and unique."""
+        by_domain = {}
+        for url in urls:
+            by_domain.setdefault(urlparse(url).netloc, []).append(url)
+
+        missing = []
+        for host, domain_urls in by_domain.items():
+            store = self._store(host)
+            missing.extend(store.difference(domain_urls) if store else sorted(set(domain_urls)))
+        return missing
+
+    def add(self, urls):
+        """Record URLs as seen, returns how many were new."""
+        by_domain = {}
+        for url in urls:
+            by_domain.setdefault(domain_key(urlparse(url).netloc), []).append(url)
+
+        added = 0
+        for key, domain_urls in by_domain.items():
+            store = self.stores.pop(key, None)
+            if store:
+                store.close()
+            added += merge_into_store(os.path.join(self.directory, key + '.urls'), domain_urls)
+        return added
+
+    def close(self):
+        for store in self.stores.values():
+            if store:
+                store.close()
+        self.stores.clear()
+
+
+def build_from_assets(folder):
+    """Build the stores from the newmediadomains files and compare sizes."""
+    from save_url import iter_media_domain_rows
+
+    known = KnownUrls()
+    json_bytes = 0
+    for filename in sorted(os.listdir(folder)):
+        if not filename.endswith('.json'):
+            continue
+        file_path = os.path.join(folder, filename)
+        json_bytes += os.path.getsize(file_path)
+        added = known.add(url for _, _, _, url in iter_media_domain_rows(file_path))
+        logger.info(f"URL store for {filename}: {added} new URLs")
+    known.close()
+
+    store_bytes = sum(os.path.getsize(os.path.join(known.directory, f)) for f in os.listdir(known.directory) if f.endswith('.urls'))
+    print(f"JSON files: {json_bytes / 1024 / 1024:.1f} MiB, URL stores: {store_bytes / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    build_from_assets(sys.argv[1] if len(sys.argv) > 1 else './assets/newmediadomains')
@@ -0,0 +1,191 @@
+import os
+import gzip
+import uuid
+import hashlib
+import datetime
+import logging
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Where archives are written and when to roll over to a new file
+WARC_DIR = os.getenv('WARC_DIR', './warc')
+WARC_MAX_SIZE = int(os.getenv('WARC_MAX_SIZE', 1024 * 1024 * 1024))
+
+# Host serving Common Crawl WARC files, point at a local file server for testing
+WARC_HOST = os.getenv('WARC_HOST', 'https://data.commoncrawl.org/')
+
+# Headers describing the transfer rather than the payload we store
+HOP_BY_HOP_HEADERS = {'content-encoding', 'transfer-encoding', 'content-length', 'connection'}
+
+
+def warc_date(when=None):
+    """Format a timestamp the way WARC-Date expects it."""
+    when = when or datetime.datetime.now(datetime.timezone.utc)
+    return when.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def build_record(warc_type, headers, block):
+    """Serialize one WARC record (headers + block) as bytes."""
+    lines = [b'WARC/1.0']
+    headers = {
+        'WARC-Type': warc_type,
+        'WARC-Record-ID': f'<urn:uuid:{uuid.uuid4()}>',
+        'WARC-Date': warc_date(),
+        **headers,
+        'Content-Length': str(len(block)),
+    }
+    for name, value in headers.items():
+        lines.append(f'{name}: {value}'.encode('utf-8'))
+    return b'\r\n'.join(lines) + b'\r\n\r\n' + block + b'\r\n\r\n'
+
+
+def build_http_block(status_code, reason, headers, body):
+    """
+    Rebuild the HTTP response as stored in the archive.
+
+    requests hands us the decoded body, so the transfer headers are dropped
+    and Content-Length is set to match what is actually stored.
+    """
+    lines = [f'HTTP/1.1 {status_code} {reason or ""}'.rstrip().encode('utf-8')]
+    for name, value in headers.items():
+        if name.lower() in HOP_BY_HOP_HEADERS:
+            continue
+        lines.append(f'{name}: {value}'.encode('utf-8', 'replace'))
+    lines.append(f'Content-Length: {len(body)}'.encode('utf-8'))
+    return b'\r\n'.join(lines) + b'\r\n\r\n' + body
+
+
+def parse_record(data):
+    """
+    Split an uncompressed WARC response record.
+
+    Returns (warc_headers, status_code, http_headers, body).
+    """
+    warc_head, _, rest = data.partition(b'\r\n\r\n')
+    warc_headers = parse_headers(warc_head.split(b'\r\n')[1:])
+
+    block_length = int(warc_headers.get('content-length', len(rest)))
+    block = rest[:block_length]
+
+    http_head, _, body = block.partition(b'\r\n\r\n')
+    http_lines = http_head.split(b'\r\n')
+    status_parts = http_lines[0].split(b' ', 2)
+    status_code = int(status_parts[1]) if len(status_parts) > 1 and status_parts[1].isdigit() else None
+    http_headers = parse_headers(http_lines[1:])
+
+    return warc_headers, status_code, http_headers, body
+
+
+def parse_headers(lines):
+    """Parse 'Name: value' lines into a dict with lower-cased names."""
+    headers = {}
+    for line in lines:
+        name, sep, value = line.decode('utf-8', 'replace').partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def read_record(path, offset, length):
+    """Read and decompress the single gzip member holding one record."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        member = f.read(length)
+    return parse_record(gzip.decompress(member))
+
+
+def fetch_remote_record(filename, offset, length, host=WARC_HOST, session=None, timeout=30):
+    """
+    Range-request one record from a remote WARC file and decompress it.
+
+    Only the gzip member of the record is transferred. Servers that ignore
+    the Range header (like python -m http.server) return the whole file,
+    in which case the member is sliced out locally.
+    """
+    url = host.rstrip('/') + '/' + filename.lstrip('/')
+    headers = {'Range': f'bytes={offset}-{offset + length - 1}'}
+
+    response = (session or requests).get(url, headers=headers, timeout=timeout)
+    response.raise_for_status()
+
+    member = response.content
+    if response.status_code == 200 and len(member) > length:
+        member = member[offset:offset + length]
+
+    warc_headers, status_code, http_headers, body = parse_record(gzip.decompress(member))
+
+    # CC usually stores decoded payloads but keep gzip payloads readable too
+    if http_headers.get('content-encoding') == 'gzip' and body[:2] == b'\x1f\x8b':
+        body = gzip.decompress(body)
+
+    return warc_headers, status_code, http_headers, body
+
+
+class WarcWriter:
+    """
+    Append response records to gzipped WARC files.
+
+    Every record is its own gzip member, so a record can be read back with
+    one seek and one decompress given its (offset, length).
+    """
+
+    def __init__(self, directory=WARC_DIR, prefix='parser', max_size=WARC_MAX_SIZE):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_size = max_size
+        self.sequence = 0
+        self.file = None
+        self.path = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_next_file(self):
+        self.close()
+        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        filename = f'{self.prefix}-{timestamp}-{os.getpid()}-{self.sequence:05d}.warc.gz'
+        self.sequence += 1
+        self.path = os.path.join(self.directory, filename)
+        self.file = open(self.path, 'ab')
+
+        info = b'software: Web-Scraping parser\r\nformat: WARC File Format 1.0\r\n'
+        self._append(build_record('warcinfo', {
+            'WARC-Filename': filename,
+            'Content-Type': 'application/warc-fields',
+        }, info))
+        logger.info(f"Opened WARC file {self.path}")
+
+    def _append(self, record):
+        offset = self.file.tell()
+        member = gzip.compress(record)
+        self.file.write(member)
+        self.file.flush()
+        return offset, len(member)
+
+    def write_response(self, url, status_code, reason, headers, body, url_id=None, truncated=False):
+        """
+        Archive one HTTP response.
+
+        truncated marks a body cut off at the fetcher's size cap.
+        Returns (path, offset, length) locating the compressed record.
+        """
+        if self.file is None or self.file.tell() >= self.max_size:
+            self._open_next_file()
+
+        block = build_http_block(status_code, reason, headers, body)
+        warc_headers = {
+            'WARC-Target-URI': url,
+            'Content-Type': 'application/http; msgtype=response',
+            'WARC-Payload-Digest': 'sha256:' + hashlib.sha256(body).hexdigest(),
+        }
+        if url_id:
+            warc_headers['WARC-Url-ID'] = url_id
+        if truncated:
+            warc_headers['WARC-Truncated'] = 'length'
+
+        offset, length = self._append(build_record('response', warc_headers, block))
+        return self.path, offset, length
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,280 @@
+import os
+import time
+import logging
+from metrics import DB_FLUSH_DURATION
+
+logger = logging.getLogger(__name__)
+
+# Flush when this many URLs are buffered or this many seconds have passed
+FLUSH_ROWS = int(os.getenv('WRITE_BEHIND_ROWS', 500))
+FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_INTERVAL', 5))
+# Failed flushes of the whole buffer before it is written URL by URL to
+# find the rows that cannot be stored
+FLUSH_MAX_RETRIES = int(os.getenv('WRITE_BEHIND_MAX_RETRIES', 3))
+
+# url_parsed_content columns written by the parser, with their staging types
+CONTENT_COLUMNS = [
+    ('urlID', 'TEXT'),
+    ('extractionTimestamp', 'TIMESTAMP'),
+    ('title', 'TEXT'),
+    ('author', 'TEXT'),
+    ('type', 'TEXT'),
+    ('publishedDate', 'TEXT'),
+    ('category', 'TEXT'),
+    ('keywords', 'TEXT'),
+    ('articleBody', 'TEXT'),
+    ('wordCount', 'INTEGER'),
+    ('textLength', 'INTEGER'),
+    ('duplicateOf', 'TEXT'),
+    ('publishedAt', 'TIMESTAMPTZ'),
+    ('searchVector', 'TSVECTOR'),
+]
+
+STAGING_TABLES = f"""
+    CREATE TEMP TABLE IF NOT EXISTS staging_parsed_content (
+        {', '.join(f'{name} {kind}' for name, kind in CONTENT_COLUMNS)}
+    ) ON COMMIT DELETE ROWS;
+
+    CREATE TEMP TABLE IF NOT EXISTS staging_fingerprints (
+        urlID TEXT, simhash BIGINT, band0 INTEGER, band1 INTEGER,
+        band2 INTEGER, band3 INTEGER, canonicalUrlID TEXT
+    ) ON COMMIT DELETE ROWS;
+
+    CREATE TEMP TABLE IF NOT EXISTS staging_validators (
+        urlID TEXT, etag TEXT, lastModified TEXT, contentHash TEXT, lastFetched TIMESTAMP
+    ) ON COMMIT DELETE ROWS;
+
+    CREATE TEMP TABLE IF NOT EXISTS staging_warc_index (
+        urlID TEXT, warcFile TEXT, recordOffset BIGINT, recordLength BIGINT, archivedAt TIMESTAMP
+    ) ON COMMIT DELETE ROWS;
+
+    CREATE TEMP TABLE IF NOT EXISTS staging_status (
+        urlID TEXT, status url_status, lastOutcome TEXT, attempts INTEGER, nextAttemptAt TIMESTAMPTZ
+    ) ON COMMIT DELETE ROWS;
+"""
+
+MERGE_CONTENT = f"""
+    INSERT INTO url_parsed_content ({', '.join(name for name, _ in CONTENT_COLUMNS)})
+    SELECT {', '.join(name for name, _ in CONTENT_COLUMNS)} FROM staging_parsed_content
+    ON CONFLICT (urlID) DO UPDATE SET
+        {', '.join(f'{name} = EXCLUDED.{name}' for name, _ in CONTENT_COLUMNS[1:])},
+        writtenAt = now()
+"""
+
+MERGE_FINGERPRINTS = """
+    INSERT INTO article_fingerprints (urlID, simhash, band0, band1, band2, band3, canonicalUrlID)
+    SELECT urlID, simhash, band0, band1, band2, band3, canonicalUrlID FROM staging_fingerprints
+    ON CONFLICT (urlID) DO UPDATE SET
+        simhash = EXCLUDED.simhash,
+        band0 = EXCLUDED.band0,
+        band1 = EXCLUDED.band1,
+        band2 = EXCLUDED.band2,
+        band3 = EXCLUDED.band3,
+        canonicalUrlID = EXCLUDED.canonicalUrlID
+"""
+
+MERGE_VALIDATORS = """
+    INSERT INTO url_fetch_validators (urlID, etag, lastModified, contentHash, lastFetched)
+    SELECT urlID, etag, lastModified, contentHash, lastFetched FROM staging_validators
+    ON CONFLICT (urlID) DO UPDATE SET
+        etag = COALESCE(EXCLUDED.etag, url_fetch_validators.etag),
+        lastModified = COALESCE(EXCLUDED.lastModified, url_fetch_validators.lastModified),
+        contentHash = COALESCE(EXCLUDED.contentHash, url_fetch_validators.contentHash),
+        lastFetched = EXCLUDED.lastFetched
+"""
+
+MERGE_WARC_INDEX = """
+    INSERT INTO url_warc_index (urlID, warcFile, recordOffset, recordLength, archivedAt)
+    SELECT urlID, warcFile, recordOffset, recordLength, archivedAt FROM staging_warc_index
+    ON CONFLICT (urlID) DO UPDATE SET
+        warcFile = EXCLUDED.warcFile,
+        recordOffset = EXCLUDED.recordOffset,
+        recordLength = EXCLUDED.recordLength,
+        archivedAt = EXCLUDED.archivedAt
+"""
+
+MERGE_STATUS = """
+    UPDATE url_registry r
+    SET status = s.status,
+        lastOutcome = COALESCE(s.lastOutcome, r.lastOutcome),
+        attempts = COALESCE(s.attempts, r.attempts),
+        nextAttemptAt = s.nextAttemptAt
+    FROM staging_status s
+    WHERE r.urlID = s.urlID
+"""
+
+
+class FlushError(RuntimeError):
+    """The final flush could not store every buffered URL."""
+
+
+class WriteBehindBuffer:
+    """
+    Collect the parser's writes and persist them in batches.
+
+    Every flush COPYs the buffered rows into temp staging tables and merges
+    them in a single transaction, content before status, so a URL is only
+    marked done together with its content. Rows stay buffered until the
+    commit succeeds; a failed flush is retried on the next one. After
+    max_retries failures in a row the buffer is bisected down to single
+    URLs, and URLs that still fail are dropped and handed to on_reject.
+    All merges are upserts, so replaying a batch is harmless
+    (at-least-once).
+    """
+
+    def __init__(self, conn, max_rows=FLUSH_ROWS, max_interval=FLUSH_INTERVAL, max_retries=FLUSH_MAX_RETRIES, on_reject=None):
+        self.conn = conn
+        self.max_rows = max_rows
+        self.max_interval = max_interval
+        self.max_retries = max_retries
+        # Called with (urlID, error) for a URL whose rows could not be stored
+        self.on_reject = on_reject
+        self.failed_flushes = 0
+        self.last_flush = time.monotonic()
+        # Keyed by urlID so a URL seen twice in one batch is written once
+        self.content = {}
+        self.fingerprints = {}
+        self.validators = {}
+        self.warc_locations = {}
+        self.statuses = {}
+
+    def _url_ids(self):
+        return set(self.content) | set(self.statuses) | set(self.validators) | set(self.warc_locations) | set(self.fingerprints)
+
+    def __len__(self):
+        return len(self._url_ids())
+
+    def __contains__(self, url_id):
+        return any(url_id in rows for rows in (self.content, self.fingerprints, self.validators, self.warc_locations, self.statuses))
+
+    def add_content(self, row):
+        """Buffer a url_parsed_content row, a dict keyed by CONTENT_COLUMNS names."""
+        self.content[row['urlID']] = tuple(row[name] for name, _ in CONTENT_COLUMNS)
+
+    def add_fingerprint(self, url_id, simhash, band_values, canonical_url_id=None):
+        self.fingerprints[url_id] = (url_id, simhash, *band_values, canonical_url_id)
+
+    def add_validators(self, url_id, validators, fetched_at):
+        self.validators[url_id] = (url_id, validators.get('etag'), validators.get('last_modified'), validators.get('content_hash'), fetched_at)
+
+    def add_warc_location(self, url_id, warc_location, archived_at):
+        warc_file, offset, length = warc_location
+        self.warc_locations[url_id] = (url_id, warc_file, offset, length, archived_at)
+
+    def add_status(self, url_id, status, outcome=None, attempts=None, next_attempt_at=None):
+        """Buffer a status transition, with the retry schedule when the fetch failed."""
+        self.statuses[url_id] = (url_id, status, outcome, attempts, next_attempt_at)
+
+    def pending_fingerprints(self):
+        """Fingerprints not yet in the database, as (urlID, simhash, canonicalUrlID)."""
+        return [(row[0], row[1], row[-1]) for row in self.fingerprints.values()]
+
+    async def maybe_flush(self):
+        """Flush if the buffer is full or the flush interval has passed."""
+        if len(self) >= self.max_rows or time.monotonic() - self.last_flush >= self.max_interval:
+            await self.flush()
+
+    async def _copy(self, cursor, table, rows):
+        if not rows:
+            return
+        async with cursor.copy(f"COPY {table} FROM STDIN") as copy:
+            for row in rows:
+                await copy.write_row(row)
+
+    def _discard(self, url_ids):
+        for rows in (self.content, self.fingerprints, self.validators, self.warc_locations, self.statuses):
+            for url_id in url_ids:
+                rows.pop(url_id, None)
+
+    async def _write(self, url_ids):
+        """Store the buffered rows of url_ids in one transaction, then drop them from the buffer."""
+        def pick(rows):
+            return [row for url_id, row in rows.items() if url_id in url_ids]
+
+        content = pick(self.content)
+        fingerprints = pick(self.fingerprints)
+        validators = pick(self.validators)
+        warc_locations = pick(self.warc_locations)
+        statuses = pick(self.statuses)
+        try:
+            async with self.conn.cursor() as cursor:
+                await cursor.execute(STAGING_TABLES)
+
+                await self._copy(cursor, 'staging_parsed_content', content)
+                await self._copy(cursor, 'staging_fingerprints', fingerprints)
+                await self._copy(cursor, 'staging_validators', validators)
+                await self._copy(cursor, 'staging_warc_index', warc_locations)
+                await self._copy(cursor, 'staging_status', statuses)
+
+                if content:
+                    await cursor.execute(MERGE_CONTENT)
+                if fingerprints:
+                    await cursor.execute(MERGE_FINGERPRINTS)
+                if validators:
+                    await cursor.execute(MERGE_VALIDATORS)
+                if warc_locations:
+                    await cursor.execute(MERGE_WARC_INDEX)
+                if statuses:
+                    await cursor.execute(MERGE_STATUS)
+
+            await self.conn.commit()
+        except Exception:
+            await self.conn.rollback()
+            raise
+        self._discard(url_ids)
+        return len(content), len(statuses)
+
+    async def _bisect(self, url_ids):
+        """Write url_ids in halves until every URL is stored or fails on its own; returns the failures."""
+        try:
+            await self._write(url_ids)
+            return []
+        except Exception as e:
+            if len(url_ids) == 1:
+                return [(next(iter(url_ids)), e)]
+        ordered = sorted(url_ids)
+        middle = len(ordered) // 2
+        return await self._bisect(set(ordered[:middle])) + await self._bisect(set(ordered[middle:]))
+
+    async def flush(self, final=False):
+        """
+        Write everything buffered in one transaction.
+
+        The final flush at shutdown has no next flush to retry on, so it
+        bisects straight away and raises if anything is left unstored.
+        """
+        self.last_flush = time.monotonic()
+        if not len(self):
+            return
+
+        started = time.monotonic()
+        try:
+            content_count, status_count = await self._write(self._url_ids())
+            self.failed_flushes = 0
+            DB_FLUSH_DURATION.labels('parser').observe(time.monotonic() - started)
+            logger.info(f"Flushed {content_count} parsed rows and {status_count} status updates in {time.monotonic() - started:.3f}s")
+            return
+        except Exception as e:
+            self.failed_flushes += 1
+            if not final and self.failed_flushes < self.max_retries:
+                logger.error(f"Write-behind flush of {len(self)} URLs failed ({self.failed_flushes} of {self.max_retries}), "
+                             f"keeping them for the next flush: {e}")
+                return
+            logger.error(f"Write-behind flush of {len(self)} URLs failed ({self.failed_flushes} of {self.max_retries}), "
+                         f"writing them URL by URL: {e}")
+
+        self.failed_flushes = 0
+        rejected = await self._bisect(self._url_ids())
+        for url_id, error in rejected:
+            # Only a status update was left: report it and let the claim
+            # lease hand the URL out again rather than loop on it
+            status_only = url_id not in self.content and url_id not in self.validators and url_id not in self.warc_locations
+            logger.error(f"Dropping buffered rows of URL ID {url_id}: {error}")
+            self._discard({url_id})
+            if self.on_reject and not status_only:
+                self.on_reject(url_id, error)
+        if final and len(self):
+            # on_reject buffered failure statuses for the dropped URLs
+            rejected = await self._bisect(self._url_ids())
+        if final and rejected:
+            raise FlushError(f"Final write-behind flush left {len(rejected)} URLs unstored")